@@ -198,15 +198,16 @@ class UserViewSet(viewsets.ModelViewSet):
     """
     User management endpoints
     """
-    queryset = User.objects.all()
+    queryset = User.objects.select_related('profile')
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
+        queryset = super().get_queryset()
         # Regular users can only see themselves
         if not self.request.user.is_staff:
-            return User.objects.filter(id=self.request.user.id)
-        return super().get_queryset()
+            return queryset.filter(id=self.request.user.id)
+        return queryset
     
     @action(detail=False, methods=['get', 'put', 'patch'])
     def profile(self, request):
@@ -1,5 +1,6 @@
 from pathlib import Path
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 import pymysql
 from datetime import timedelta
 import os
@@ -115,6 +116,47 @@ else:
             }
         }
 
+# Cache
+# Use a shared Redis cache when REDIS_URL is set so invalidation reaches every
+# worker; otherwise fall back to a per-process in-memory cache, which is only
+# correct with a single web worker
+REDIS_URL = os.environ.get('REDIS_URL')
+WEB_CONCURRENCY = config('WEB_CONCURRENCY', default=1, cast=int)  # web workers; also read by gunicorn
+if WEB_CONCURRENCY > 1 and not REDIS_URL:
+    raise ImproperlyConfigured(
+        'REDIS_URL is required with more than one web worker: cache invalidation '
+        'and stream events in one worker never reach the others without it'
+    )
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Per-user dashboard statistics are cached and invalidated on Ad/Booking/Payment writes;
+# impression/click counters catch up when the entry expires
+USER_STATS_CACHE_TTL = config('USER_STATS_CACHE_TTL', default=300, cast=int)
+
+# Public marketing overview payload; invalidated on content writes and banner schedule boundaries
+MARKETING_OVERVIEW_CACHE_TTL = config('MARKETING_OVERVIEW_CACHE_TTL', default=3600, cast=int)
+
+# Catalog endpoints send ETags and a public Cache-Control so a CDN can absorb them
+CATALOG_CACHE_MAX_AGE = config('CATALOG_CACHE_MAX_AGE', default=60, cast=int)
+CATALOG_STALE_WHILE_REVALIDATE = config('CATALOG_STALE_WHILE_REVALIDATE', default=300, cast=int)
+MODEL_VERSION_CACHE_TTL = 300  # bounds staleness from QuerySet.update(), which skips signals
+
+# Full-text search: blank uses PostgreSQL/MySQL native search where available,
+# otherwise the portable inverted index (rebuild with `manage.py rebuild_search_index`)
+SEARCH_BACKEND = config('SEARCH_BACKEND', default='')
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -202,8 +244,12 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'upload-offset',
+    'if-none-match',
 ]
 
+CORS_EXPOSE_HEADERS = ['etag']
+
 # CSRF Trusted Origins
 CSRF_TRUSTED_ORIGINS = [
     "http://localhost:5173",
@@ -244,6 +290,67 @@ SIMPLE_JWT = {
 # Change line ~245:
 FILE_UPLOAD_MAX_MEMORY_SIZE = 3145728  # 3MB (was 10485760)
 DATA_UPLOAD_MAX_MEMORY_SIZE = 3145728  # 3MB (was 10485760)
+# Larger uploads are hashed while they stream to disk, so storing them reads nothing again
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'advertisers.storage.HashingTemporaryFileUploadHandler',
+]
+
+# Resumable Uploads
+# Large files are sent in chunks via /files/uploads/; chunks stream straight to
+# a temp file, so these limits do not touch the in-memory limits above.
+RESUMABLE_UPLOAD_ROOT = BASE_DIR / 'upload_sessions'
+RESUMABLE_UPLOAD_MAX_SIZE = config('RESUMABLE_UPLOAD_MAX_SIZE', default=200 * 1024 * 1024, cast=int)
+RESUMABLE_UPLOAD_CHUNK_SIZE = config('RESUMABLE_UPLOAD_CHUNK_SIZE', default=5 * 1024 * 1024, cast=int)
+RESUMABLE_UPLOAD_EXPIRY_HOURS = config('RESUMABLE_UPLOAD_EXPIRY_HOURS', default=24, cast=int)
+
+# Virus Scanning
+# Uploads are scanned in the background by a pool of workers holding persistent
+# clamd sessions. Set CLAMD_HOST to use TCP instead of the Unix socket.
+CLAMD_SOCKET = config('CLAMD_SOCKET', default='/var/run/clamav/clamd.ctl')
+CLAMD_HOST = config('CLAMD_HOST', default=None)
+CLAMD_PORT = config('CLAMD_PORT', default=3310, cast=int)
+VIRUS_SCAN_WORKERS = config('VIRUS_SCAN_WORKERS', default=2, cast=int)
+VIRUS_SCAN_QUEUE_SIZE = config('VIRUS_SCAN_QUEUE_SIZE', default=100, cast=int)
+QUARANTINE_ROOT = BASE_DIR / 'quarantine'  # outside MEDIA_ROOT so it is never served
+
+# Image Variants
+# Thumbnails and per-placement WebP variants are rendered in a process pool
+IMAGE_VARIANT_PROCESSES = config('IMAGE_VARIANT_PROCESSES', default=2, cast=int)
+IMAGE_VARIANT_QUALITY = config('IMAGE_VARIANT_QUALITY', default=80, cast=int)
+
+# Email Outbox
+# Emails are queued in the database and sent by `manage.py send_outbox_emails --loop`
+EMAIL_OUTBOX_MAX_ATTEMPTS = config('EMAIL_OUTBOX_MAX_ATTEMPTS', default=5, cast=int)
+EMAIL_OUTBOX_BACKOFF_SECONDS = config('EMAIL_OUTBOX_BACKOFF_SECONDS', default=60, cast=int)
+EMAIL_OUTBOX_LEASE_SECONDS = 300  # a claimed batch is retried if the worker dies
+
+# Ad & Booking Lifecycle
+# Statuses move by date and booking notices go out via `manage.py run_lifecycle` (every minute)
+BOOKING_REMINDER_DAYS = config('BOOKING_REMINDER_DAYS', default=1, cast=int)  # reminder this many days ahead
+BOOKING_END_NOTICE_GRACE_DAYS = 3  # older completed bookings are not announced
+
+# Ad Serving
+# Live ads per placement are served from an in-memory index, rebuilt on change and at midnight
+SERVING_INDEX_MAX_AGE = config('SERVING_INDEX_MAX_AGE', default=300, cast=int)  # seconds
+SERVING_INDEX_CHECK_INTERVAL = 1  # seconds between shared-cache version checks
+SERVING_FEATURED_WEIGHT = config('SERVING_FEATURED_WEIGHT', default=3, cast=int)  # featured ads shown 3x as often
+
+# Notifications
+# Unread counts are cached per user and pushed to the event stream on change
+NOTIFICATION_COUNT_CACHE_TTL = 60 * 60
+
+# Event Stream (Server-Sent Events, served by the ASGI app)
+# Events fan out through Redis when it is configured so every node sees them
+# (RedisBroker needs the redis package from requirements.txt). The in-process
+# broker only reaches streams in the publishing process, so without Redis
+# events from the lifecycle worker and other commands are not streamed.
+EVENT_BROKER = (
+    'advertisers.events.RedisBroker' if REDIS_URL else 'advertisers.events.InProcessBroker'
+)
+EVENT_STREAM_HEARTBEAT = 15  # seconds between keep-alive comments
+EVENT_STREAM_QUEUE_SIZE = 100  # events buffered per connection before dropping
+
 # Custom User Model
 AUTH_USER_MODEL = 'accounts.User'
 
@@ -261,4 +368,25 @@ CKEDITOR_CONFIGS = {
 }
 
 
-DNN_API_URL = config('DNN_API_URL', default='http://webflyers.uk/api')
\ No newline at end of file
+DNN_API_URL = config('DNN_API_URL', default='http://webflyers.uk/api')
+DNN_API_TIMEOUT = config('DNN_API_TIMEOUT', default=3, cast=float)  # seconds
+DNN_CACHE_TTL = config('DNN_CACHE_TTL', default=60, cast=int)  # fresh for 60s
+DNN_CACHE_STALE_TTL = config('DNN_CACHE_STALE_TTL', default=300, cast=int)  # then served stale while refreshing
+DNN_CACHE_MAX_FLYERS = config('DNN_CACHE_MAX_FLYERS', default=1000, cast=int)  # least recently used dropped first
+DNN_BREAKER_FAILURES = config('DNN_BREAKER_FAILURES', default=5, cast=int)
+DNN_BREAKER_RESET = config('DNN_BREAKER_RESET', default=30, cast=int)  # seconds before a retry probe
+
+
+# Analytics Ingestion
+# Beacon events are buffered per process and bulk-written every N events or T ms
+ANALYTICS_BUFFER_MAX_EVENTS = config('ANALYTICS_BUFFER_MAX_EVENTS', default=500, cast=int)
+ANALYTICS_BUFFER_FLUSH_MS = config('ANALYTICS_BUFFER_FLUSH_MS', default=1000, cast=int)
+ANALYTICS_BUFFER_MAX_PENDING = config('ANALYTICS_BUFFER_MAX_PENDING', default=50000, cast=int)  # kept for retry while writes fail
+# Proxies (IPs or CIDR ranges) whose X-Forwarded-For header is trusted for the client IP
+TRUSTED_PROXIES = [proxy for proxy in config('TRUSTED_PROXIES', default='127.0.0.1,::1').split(',') if proxy]
+# Repeated events per (event type, ad, IP + user agent) inside the window are dropped (0 disables)
+ANALYTICS_DEDUP_WINDOW = config('ANALYTICS_DEDUP_WINDOW', default=1800, cast=int)  # seconds
+ANALYTICS_DEDUP_CAPACITY = config('ANALYTICS_DEDUP_CAPACITY', default=1000000, cast=int)  # distinct keys per window
+ANALYTICS_DEDUP_ERROR_RATE = 0.001  # share of first-time events wrongly dropped
+ANALYTICS_DEDUP_BUCKETS = 4  # ~2 MB per process with the defaults
+USER_AGENT_CACHE_SIZE = config('USER_AGENT_CACHE_SIZE', default=4096, cast=int)  # parsed user agents kept per process
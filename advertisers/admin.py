@@ -1,10 +1,14 @@
 from django.contrib import admin
-
+from django.db.models import Q
 from django.utils.html import format_html
+
+from .moderation import moderate_ads
+from .pagination import CappedCountPaginator
+from .search import get_spec, search
 from .models import (
     # Existing models
     PricingPackage, AdPlacement, Ad, UploadedFile, Booking,
-    Analytics, Message, MessageReply, Notification, AuditLog,
+    Analytics, UserAgent, Message, MessageReply, Notification, AuditLog, OutboxEmail,
     # New marketing models
     PlatformBenefit, FAQ, Testimonial, CaseStudy,
     PricingFeature, EnhancedPricingPackage, PackageFeature,
@@ -32,13 +36,44 @@ class AdPlacementAdmin(admin.ModelAdmin):
     search_fields = ['placement_name', 'placement_code']
 
 
+class FullTextSearchAdminMixin:
+    """
+    Admin search through the full-text index. ``search_fields`` outside
+    the model's indexed fields (e.g. the owner's username) still match
+    with icontains.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        results = search(self.model._default_manager.all(), search_term)
+        if results is None:
+            return super().get_search_results(request, queryset, search_term)
+
+        condition = Q(pk__in=results.values('pk'))
+        indexed = get_spec(self.model).fields
+        for field in self.get_search_fields(request):
+            if field not in indexed:
+                condition |= Q(**{f'{field}__icontains': search_term})
+        return queryset.filter(condition), False
+
+
 @admin.register(Ad)
-class AdAdmin(admin.ModelAdmin):
+class AdAdmin(FullTextSearchAdminMixin, admin.ModelAdmin):
     list_display = ['title', 'user', 'status', 'is_featured', 'start_date', 'end_date', 'total_impressions', 'total_clicks']
     list_filter = ['status', 'is_featured', 'created_at']
     search_fields = ['title', 'user__username', 'user__email']
     readonly_fields = ['total_impressions', 'total_clicks', 'created_at', 'updated_at']
     date_hierarchy = 'created_at'
+    actions = ['approve_selected', 'reject_selected']
+    
+    @admin.action(description='Approve selected ads')
+    def approve_selected(self, request, queryset):
+        updated = moderate_ads(list(queryset.values_list('pk', flat=True)), 'approve', request.user)
+        self.message_user(request, f'{len(updated)} ads approved.')
+    
+    @admin.action(description='Reject selected ads')
+    def reject_selected(self, request, queryset):
+        updated = moderate_ads(list(queryset.values_list('pk', flat=True)), 'reject', request.user)
+        self.message_user(request, f'{len(updated)} ads rejected.')
 
 
 @admin.register(UploadedFile)
@@ -61,6 +96,21 @@ class AnalyticsAdmin(admin.ModelAdmin):
     list_display = ['ad', 'event_type', 'device_type', 'country', 'event_timestamp']
     list_filter = ['event_type', 'device_type', 'country', 'event_timestamp']
     search_fields = ['ad__title']
+    list_select_related = ['ad']
+    raw_id_fields = ['user_agent']
+    # The events table is huge: bound the counts and drill down by date instead
+    ordering = ['-event_timestamp', '-id']
+    date_hierarchy = 'event_timestamp'
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(UserAgent)
+class UserAgentAdmin(admin.ModelAdmin):
+    list_display = ['browser', 'os', 'device_type', 'is_bot', 'created_at']
+    list_filter = ['device_type', 'browser', 'os', 'is_bot']
+    search_fields = ['user_agent']
+    readonly_fields = ['ua_hash', 'created_at']
 
 
 @admin.register(Message)
@@ -90,6 +140,14 @@ class AuditLogAdmin(admin.ModelAdmin):
     search_fields = ['action', 'description', 'user__username']
 
 
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['subject', 'last_error']
+    readonly_fields = ['attempts', 'last_error', 'sent_at', 'created_at']
+
+
 # ============================================================================
 # NEW MARKETING MODEL ADMINS
 # ============================================================================
@@ -104,7 +162,7 @@ class PlatformBenefitAdmin(admin.ModelAdmin):
 
 
 @admin.register(FAQ)
-class FAQAdmin(admin.ModelAdmin):
+class FAQAdmin(FullTextSearchAdminMixin, admin.ModelAdmin):
     list_display = ['question', 'category', 'order', 'is_active', 'views_count']
     list_editable = ['order', 'is_active']
     list_filter = ['category', 'is_active', 'created_at']
@@ -121,7 +179,7 @@ class TestimonialAdmin(admin.ModelAdmin):
 
 
 @admin.register(CaseStudy)
-class CaseStudyAdmin(admin.ModelAdmin):
+class CaseStudyAdmin(FullTextSearchAdminMixin, admin.ModelAdmin):
     list_display = ['title', 'company_name', 'industry', 'is_featured', 'is_published', 'views_count']
     list_editable = ['is_featured', 'is_published']
     list_filter = ['industry', 'is_featured', 'is_published', 'published_date']
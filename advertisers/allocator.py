@@ -0,0 +1,91 @@
+"""
+Concurrency-safe booking allocation
+
+Every write that can consume placement capacity (creating a booking,
+confirming one) runs here. The placement row is locked with
+SELECT ... FOR UPDATE, overlapping confirmed/active bookings are counted
+per day against ``max_concurrent_ads`` and the write is committed in the
+same transaction, so two requests can never both take the last slot.
+
+A process-local lock per placement sits in front of the row lock. It keeps
+threads of one worker from queueing on the database and is what serializes
+allocations on SQLite, which ignores FOR UPDATE.
+"""
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+
+from .models import AdPlacement, Booking
+from .occupancy import BLOCKING_STATUSES, peak_concurrency
+
+
+class PlacementFullError(Exception):
+    """The placement has no free slot on at least one requested day"""
+
+
+_placement_locks = defaultdict(threading.Lock)
+_placement_locks_guard = threading.Lock()
+
+
+def _process_lock(placement_id):
+    with _placement_locks_guard:
+        return _placement_locks[placement_id]
+
+
+def _check_capacity(placement, start_date, end_date, exclude=None):
+    overlapping = Booking.objects.filter(
+        placement=placement,
+        status__in=BLOCKING_STATUSES,
+        start_date__lte=end_date,
+        end_date__gte=start_date
+    )
+    if exclude:
+        overlapping = overlapping.exclude(pk=exclude)
+
+    peak = peak_concurrency(
+        overlapping.values_list('start_date', 'end_date'), start_date, end_date
+    )
+    if peak >= placement.max_concurrent_ads:
+        raise PlacementFullError(
+            f'{placement.placement_name} is fully booked for the selected dates.'
+        )
+
+
+def allocate_booking(placement_id, start_date, end_date, **fields):
+    """
+    Create a booking if the placement still has capacity for every day of
+    the range. Raises PlacementFullError otherwise.
+    """
+    with _process_lock(placement_id), transaction.atomic():
+        placement = AdPlacement.objects.select_for_update().get(pk=placement_id)
+        _check_capacity(placement, start_date, end_date)
+
+        fields.setdefault('price_per_day', placement.base_price_per_day)
+        return Booking.objects.create(
+            placement=placement,
+            start_date=start_date,
+            end_date=end_date,
+            **fields
+        )
+
+
+def update_booking(booking, **changes):
+    """
+    Apply changes to a booking, re-checking capacity under lock whenever
+    the result occupies the placement. Raises PlacementFullError if the
+    updated booking no longer fits.
+    """
+    with _process_lock(booking.placement_id), transaction.atomic():
+        placement = AdPlacement.objects.select_for_update().get(pk=booking.placement_id)
+        for field, value in changes.items():
+            setattr(booking, field, value)
+        if booking.status in BLOCKING_STATUSES:
+            _check_capacity(placement, booking.start_date, booking.end_date, exclude=booking.pk)
+        booking.save()
+        return booking
+
+
+def confirm_booking(booking):
+    """Confirm a booking if its dates still fit the placement"""
+    return update_booking(booking, status='confirmed')
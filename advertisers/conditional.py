@@ -0,0 +1,125 @@
+"""
+Conditional GET for read-only catalog endpoints
+
+Each model's version stamp is its row count plus the newest ``updated_at``,
+read with one aggregate query and cached until a save or delete signal
+drops it. The ETag of a response hashes the stamps of every model the
+view reads together with the request path, query string and negotiated
+media type. When the client's If-None-Match matches, the view answers 304
+before any queryset is evaluated or serializer runs.
+
+Responses also carry a public Cache-Control policy so a CDN can serve
+them and revalidate with the same ETag.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+VERSION_FIELDS = ('updated_at', 'last_updated')
+
+
+def _version_key(model):
+    return f'model_version:{model._meta.label_lower}'
+
+
+def model_version(model):
+    """``'<count>:<newest updated_at>'`` for all rows of a model, cached"""
+    key = _version_key(model)
+    stamp = cache.get(key)
+    if stamp is None:
+        field = next(
+            name for name in VERSION_FIELDS
+            if any(f.name == name for f in model._meta.concrete_fields)
+        )
+        row = model._default_manager.aggregate(count=Count('pk'), newest=Max(field))
+        newest = row['newest'].isoformat() if row['newest'] else ''
+        stamp = f"{row['count']}:{newest}"
+        # Bounded so QuerySet.update(), which sends no signals, is picked up too
+        cache.set(key, stamp, timeout=getattr(settings, 'MODEL_VERSION_CACHE_TTL', 300))
+    return stamp
+
+
+def invalidate_model_version(model):
+    cache.delete(_version_key(model))
+
+
+def make_etag(*parts):
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored
+    tags = {tag.removeprefix('W/') for tag in parse_etags(header)}
+    return '*' in tags or etag in tags
+
+
+def apply_cache_policy(response, etag, public=True):
+    response['ETag'] = etag
+    max_age = getattr(settings, 'CATALOG_CACHE_MAX_AGE', 60)
+    if public:
+        patch_cache_control(
+            response, public=True, max_age=max_age,
+            stale_while_revalidate=getattr(settings, 'CATALOG_STALE_WHILE_REVALIDATE', 300)
+        )
+    else:
+        patch_cache_control(response, private=True, max_age=max_age)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+class NotModified(APIException):
+    status_code = status.HTTP_304_NOT_MODIFIED
+
+
+class ConditionalGetMixin:
+    """
+    ETag/304 handling for read-only viewsets
+
+    ``etag_models`` lists every model the serialized output depends on.
+    Only actions in ``conditional_actions`` are covered; anything reading
+    other tables (e.g. placement availability) is left alone.
+    """
+    etag_models = ()
+    conditional_actions = ('list', 'retrieve')
+
+    def get_etag_parts(self):
+        """Extra values that change the response; override for time-dependent content"""
+        return []
+
+    def get_etag(self, request):
+        return make_etag(
+            *(model_version(model) for model in self.etag_models),
+            *self.get_etag_parts(),
+            request.get_full_path(),
+            request.accepted_media_type,
+        )
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.etag = None
+        if request.method in ('GET', 'HEAD') and self.action in self.conditional_actions:
+            self.etag = self.get_etag(request)
+            if etag_matches(request, self.etag):
+                raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) and response.status_code in (200, 304):
+            apply_cache_policy(response, self.etag)
+        return response
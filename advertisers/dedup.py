@@ -0,0 +1,139 @@
+"""
+Frequency capping for tracking beacons
+
+Page refreshes and retries send the same impression or click again and
+again. Before events reach the ingestion buffer, each one is keyed by
+(event type, ad, visitor) — the visitor being the client IP plus user
+agent — and dropped if that key was already seen within
+ANALYTICS_DEDUP_WINDOW seconds.
+
+Seen keys live in a time-bucketed Bloom filter: the window is split into
+ANALYTICS_DEDUP_BUCKETS slices with one fixed-size filter each, and the
+oldest slice is discarded as time moves on. Memory per process is
+therefore fixed (see ``memory_bytes``) however many visitors arrive. A
+Bloom filter never forgets a key it holds, so repeats are always caught;
+the price is that about ANALYTICS_DEDUP_ERROR_RATE of first-time events
+are mistaken for repeats, and more once a slice sees more than its share
+of ANALYTICS_DEDUP_CAPACITY keys.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+_MASK = (1 << 64) - 1
+
+
+class BloomFilter:
+    """Fixed-size bit array probed at ``hashes`` positions per key"""
+
+    def __init__(self, size, hashes):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray((size + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate):
+        """Smallest filter holding ``capacity`` keys at ``error_rate`` false positives"""
+        size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        return cls(size, max(1, round(size / capacity * math.log(2))))
+
+    def positions(self, digest):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:16], 'little') | 1
+        return [((first + i * second) & _MASK) % self.size for i in range(self.hashes)]
+
+    def contains(self, positions):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def add(self, positions):
+        bits = self.bits
+        for p in positions:
+            bits[p >> 3] |= 1 << (p & 7)
+
+
+class TimeBucketedBloomFilter:
+    """
+    Keys seen within roughly the last ``window`` seconds: between
+    ``window - window / buckets`` and ``window``, depending on where in the
+    current slice the key was added.
+    """
+
+    def __init__(self, window, capacity, error_rate, buckets=4, clock=time.monotonic):
+        self.span = window / buckets
+        self.buckets = buckets
+        # Each slice is sized for its share of the keys in one window
+        template = BloomFilter.for_capacity(max(1, capacity // buckets), error_rate)
+        self.size, self.hashes = template.size, template.hashes
+        self.clock = clock
+        self._filters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def memory_bytes(self):
+        return self.buckets * ((self.size + 7) // 8)
+
+    def _current(self):
+        slot = int(self.clock() // self.span)
+        while self._filters and self._filters[0][0] <= slot - self.buckets:
+            self._filters.popleft()
+        if not self._filters or self._filters[-1][0] != slot:
+            self._filters.append((slot, BloomFilter(self.size, self.hashes)))
+        return self._filters[-1][1]
+
+    def check_and_add(self, key):
+        """True if ``key`` was already seen in the window; remembers it either way"""
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        with self._lock:
+            current = self._current()
+            positions = current.positions(digest)
+            if any(bloom.contains(positions) for _, bloom in self._filters):
+                return True
+            current.add(positions)
+            return False
+
+
+class EventDeduplicator:
+    """Drops repeated beacon events per (event type, ad, visitor)"""
+
+    def __init__(self):
+        self._filter = None
+        self._lock = threading.Lock()
+
+    def _get_filter(self):
+        if self._filter is None:
+            with self._lock:
+                if self._filter is None:
+                    self._filter = TimeBucketedBloomFilter(
+                        window=settings.ANALYTICS_DEDUP_WINDOW,
+                        capacity=settings.ANALYTICS_DEDUP_CAPACITY,
+                        error_rate=settings.ANALYTICS_DEDUP_ERROR_RATE,
+                        buckets=settings.ANALYTICS_DEDUP_BUCKETS,
+                    )
+        return self._filter
+
+    @staticmethod
+    def event_key(event):
+        return '|'.join(str(event.get(field) or '') for field in (
+            'event_type', 'ad_id', 'ip_address', 'user_agent'
+        ))
+
+    def admit(self, events):
+        """The events not seen before within the window, in order"""
+        if not getattr(settings, 'ANALYTICS_DEDUP_WINDOW', 0):
+            return list(events)
+        bloom = self._get_filter()
+        return [event for event in events if not bloom.check_and_add(self.event_key(event))]
+
+    def reset(self):
+        """Forget everything, e.g. after the settings change"""
+        with self._lock:
+            self._filter = None
+
+
+event_deduplicator = EventDeduplicator()
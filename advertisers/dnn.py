@@ -0,0 +1,201 @@
+"""
+Client for the DNN click-statistics API
+
+Keeps one pooled HTTP session per process, caches responses for up to
+DNN_CACHE_MAX_FLYERS flyers (least recently used dropped first) with
+stale-while-revalidate, and trips a circuit breaker after repeated
+failures so dashboard requests fall back to local counters immediately
+instead of waiting on a slow upstream.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after ``failure_threshold`` consecutive failures.
+    Open -> half-open after ``reset_timeout`` seconds, letting one probe through.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow_request(self):
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class DNNClient:
+    """
+    Cached, circuit-broken access to ``DNN_API_URL/clicks/statistics``
+    """
+
+    def __init__(self, base_url=None, timeout=None, ttl=None, stale_ttl=None,
+                 failure_threshold=None, reset_timeout=None, max_flyers=None):
+        self._base_url = base_url
+        self.timeout = timeout or getattr(settings, 'DNN_API_TIMEOUT', 3)
+        self.ttl = ttl or getattr(settings, 'DNN_CACHE_TTL', 60)
+        self.stale_ttl = stale_ttl or getattr(settings, 'DNN_CACHE_STALE_TTL', 300)
+        self.max_flyers = max_flyers or getattr(settings, 'DNN_CACHE_MAX_FLYERS', 1000)
+        self.breaker = CircuitBreaker(
+            failure_threshold or getattr(settings, 'DNN_BREAKER_FAILURES', 5),
+            reset_timeout or getattr(settings, 'DNN_BREAKER_RESET', 30),
+        )
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._cache = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'errors': 0, 'short_circuits': 0}
+
+    @property
+    def base_url(self):
+        return self._base_url or getattr(settings, 'DNN_API_URL', 'http://webflyers.uk/api')
+
+    def get_click_statistics(self, flyer_id):
+        """
+        Return DNN click data for a flyer, or None when it is unavailable
+        and nothing usable is cached
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(flyer_id)
+            if cached:
+                self._cache.move_to_end(flyer_id)
+
+        if cached:
+            data, fetched_at = cached
+            age = now - fetched_at
+            if age < self.ttl:
+                self._count('hits')
+                return data
+            if age < self.ttl + self.stale_ttl:
+                self._count('stale_hits')
+                self._refresh_in_background(flyer_id)
+                return data
+
+        self._count('misses')
+        return self._fetch(flyer_id)
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self._counters)
+            cached_flyers = len(self._cache)
+        lookups = counters['hits'] + counters['stale_hits'] + counters['misses']
+        served = counters['hits'] + counters['stale_hits']
+        return {
+            **counters,
+            'cached_flyers': cached_flyers,
+            'hit_rate': round(served / lookups, 4) if lookups else 0.0,
+            'breaker_state': self.breaker.state,
+            'breaker_failures': self.breaker.failures,
+        }
+
+    def reset(self):
+        """Drop cached data, counters and breaker state"""
+        with self._lock:
+            self._cache.clear()
+            self._refreshing.clear()
+            for key in self._counters:
+                self._counters[key] = 0
+        self.breaker.record_success()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _fetch(self, flyer_id):
+        if not self.breaker.allow_request():
+            self._count('short_circuits')
+            return None
+
+        succeeded = False
+        try:
+            response = self.session.get(
+                f"{self.base_url}/clicks/statistics",
+                params={'flyer_id': flyer_id},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            data = response.json()
+            succeeded = True
+        except (requests.RequestException, ValueError) as e:
+            self._count('errors')
+            print(f"⚠️ DNN statistics request failed: {e}")
+            return None
+        finally:
+            # Always settles the breaker, so a probe that raised anything
+            # else cannot leave it half-open for good
+            if succeeded:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+        with self._lock:
+            self._cache[flyer_id] = (data, time.monotonic())
+            self._cache.move_to_end(flyer_id)
+            while len(self._cache) > self.max_flyers:
+                self._cache.popitem(last=False)
+        return data
+
+    def _refresh_in_background(self, flyer_id):
+        with self._lock:
+            if flyer_id in self._refreshing:
+                return
+            self._refreshing.add(flyer_id)
+
+        def refresh():
+            try:
+                self._fetch(flyer_id)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(flyer_id)
+
+        threading.Thread(target=refresh, name=f'dnn-refresh-{flyer_id}', daemon=True).start()
+
+
+dnn_client = DNNClient()
@@ -0,0 +1,180 @@
+"""
+Per-user event pub/sub for the Server-Sent Events stream
+
+Sync code (signals, moderation) publishes events for a user after the
+transaction commits. Stream connections subscribe with an asyncio queue
+on their event loop; ``publish`` hands events over with
+``call_soon_threadsafe``, so it is safe to call from any worker thread.
+
+The broker class is chosen by EVENT_BROKER. ``InProcessBroker`` only
+reaches connections in the same process. ``RedisBroker`` fans events out
+through Redis pub/sub so every node sees them.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    """One stream connection's queue of pending events"""
+
+    def __init__(self, user_id, max_queue):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+    def offer(self, event):
+        # Runs on the subscriber's loop. A client too slow to keep up loses events
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+
+class InProcessBroker:
+    """
+    Delivers events to subscribers in this process only
+    """
+
+    def __init__(self, max_queue=None):
+        self.max_queue = max_queue or getattr(settings, 'EVENT_STREAM_QUEUE_SIZE', 100)
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        """Register the calling event loop for a user's events"""
+        subscription = Subscription(user_id, self.max_queue)
+        with self._lock:
+            self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, user_id, event):
+        self.deliver(user_id, event)
+
+    def deliver(self, user_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # Loop already closed; its stream will unsubscribe itself
+                pass
+
+
+class RedisBroker(InProcessBroker):
+    """
+    Publishes through Redis so subscribers on every node receive events.
+    A listener thread per process forwards Redis messages to local queues.
+    """
+    channel_prefix = 'advertiser_events:'
+
+    def __init__(self, url=None, max_queue=None):
+        super().__init__(max_queue)
+        try:
+            import redis
+        except ImportError as e:
+            raise ImproperlyConfigured(
+                'RedisBroker needs the redis package; install it from requirements.txt '
+                'or set EVENT_BROKER to advertisers.events.InProcessBroker'
+            ) from e
+        self.url = url or settings.REDIS_URL
+        if not self.url:
+            raise ImproperlyConfigured('RedisBroker needs REDIS_URL')
+        self._redis_module = redis
+        self._redis = None
+        self._listener_pid = None
+
+    def _client(self):
+        if self._redis is None:
+            self._redis = self._redis_module.Redis.from_url(self.url)
+        return self._redis
+
+    def subscribe(self, user_id):
+        self._ensure_listener()
+        return super().subscribe(user_id)
+
+    def publish(self, user_id, event):
+        self._client().publish(f'{self.channel_prefix}{user_id}', json.dumps(event))
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+        threading.Thread(target=self._listen, name='event-broker', daemon=True).start()
+
+    def _listen(self):
+        # Resubscribes after a dropped connection, backing off up to 30 seconds
+        delay = 1
+        while True:
+            try:
+                pubsub = self._client().pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f'{self.channel_prefix}*')
+                delay = 1
+                for message in pubsub.listen():
+                    channel = message['channel'].decode()
+                    user_id = int(channel[len(self.channel_prefix):])
+                    self.deliver(user_id, json.loads(message['data']))
+            except Exception as e:
+                print(f"⚠️ Event broker lost Redis, retrying in {delay}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.EVENT_BROKER)()
+        return _broker
+
+
+def publish_event(user_id, event_type, data):
+    """Send an event to a user's open streams once the transaction commits"""
+    event = {'type': event_type, 'data': data}
+    transaction.on_commit(lambda: get_broker().publish(user_id, event))
+
+
+def publish_notifications(notifications):
+    from .serializers import NotificationSerializer
+
+    for notification in notifications:
+        publish_event(
+            notification.user_id, 'notification',
+            dict(NotificationSerializer(notification).data)
+        )
+
+
+def publish_ad_status(ad, previous_status):
+    publish_event(ad.user_id, 'ad_status', {
+        'ad_id': ad.id,
+        'title': ad.title,
+        'status': ad.status,
+        'previous_status': previous_status,
+    })
@@ -0,0 +1,82 @@
+"""
+HyperLogLog cardinality sketches
+
+A sketch estimates how many distinct values were added to it within about
+``1.04 / sqrt(2 ** precision)`` (1.6% at the default precision 12) using
+one byte per register. Sketches of the same precision merge losslessly by
+taking the register-wise maximum, so daily sketches can be combined into
+the reach of any date range.
+
+``to_bytes`` writes only the non-zero registers while that is smaller, so
+the many sketches with few visitors (small ads, rare countries) take a
+few bytes rather than 4 KB.
+"""
+import hashlib
+import math
+
+DEFAULT_PRECISION = 12
+_DENSE = 1
+_SPARSE = 2
+
+
+class HyperLogLog:
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError('precision must be between 4 and 16')
+        self.precision = precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << precision)
+
+    def add(self, value):
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        x = int.from_bytes(digest, 'big')
+        bits = 64 - self.precision
+        index = x >> bits
+        # Position of the first 1-bit in the remaining bits, counted from 1
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Fold ``other`` into this sketch; afterwards it counts the union"""
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge sketches of different precision')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range: linear counting is more accurate
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def to_bytes(self):
+        nonzero = [(i, r) for i, r in enumerate(self.registers) if r]
+        if len(nonzero) * 3 < len(self.registers):
+            body = b''.join(i.to_bytes(2, 'big') + bytes([r]) for i, r in nonzero)
+            return bytes([_SPARSE, self.precision]) + body
+        return bytes([_DENSE, self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        encoding, precision, body = data[0], data[1], data[2:]
+        if encoding == _DENSE:
+            return cls(precision, body)
+        if encoding != _SPARSE:
+            raise ValueError(f'Unknown sketch encoding {encoding}')
+        sketch = cls(precision)
+        for offset in range(0, len(body), 3):
+            sketch.registers[int.from_bytes(body[offset:offset + 2], 'big')] = body[offset + 2]
+        return sketch
+
+    @classmethod
+    def union(cls, sketches, precision=DEFAULT_PRECISION):
+        result = cls(precision)
+        for sketch in sketches:
+            result.merge(sketch)
+        return result
@@ -0,0 +1,173 @@
+"""
+Thumbnail and placement-size image variants
+
+Once an image upload has passed its virus scan it is handed to a process
+pool that renders a thumbnail plus a WebP variant (1x and 2x) for every
+placement size listed in ``AdPlacement.dimensions``. Pillow work runs in
+separate processes, so it never holds the GIL of a request worker. Those
+processes are started by a fork server (spawned where there is none), not
+forked from a worker that may hold locks, threads and DB connections. The
+resulting paths are written back to ``UploadedFile.thumbnail_path`` and
+``UploadedFile.variants``.
+"""
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .storage import share_results, variants_dir
+
+THUMBNAIL_SIZE = (320, 320)
+DENSITIES = (1, 2)
+_DIMENSIONS_RE = re.compile(r'^\s*(\d+)\s*[xX×]\s*(\d+)\s*$')
+
+
+def parse_dimensions(value):
+    """'300x250' -> (300, 250); None for anything unparseable"""
+    match = _DIMENSIONS_RE.match(value or '')
+    if not match:
+        return None
+    width, height = int(match.group(1)), int(match.group(2))
+    if not width or not height:
+        return None
+    return width, height
+
+
+def placement_sizes():
+    """Distinct (width, height) boxes of all active placements"""
+    from .models import AdPlacement
+
+    sizes = set()
+    for value in AdPlacement.objects.filter(is_active=True).values_list('dimensions', flat=True):
+        size = parse_dimensions(value)
+        if size:
+            sizes.add(size)
+    return sorted(sizes)
+
+
+def render_variants(source_path, output_dir, sizes, quality=80):
+    """
+    Render the thumbnail and every size variant of one image.
+
+    Runs inside a pool process, so it only takes and returns plain data.
+    Returns ``(width, height, {name: filename})``. Variants are never
+    upscaled and a 2x variant is skipped when the source is too small.
+    """
+    from PIL import Image, ImageOps
+
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {}
+
+    with Image.open(source_path) as img:
+        img = ImageOps.exif_transpose(img)
+        width, height = img.size
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'transparency' in img.info or img.mode in ('LA', 'PA') else 'RGB')
+
+        def save(name, box):
+            variant = img.copy()
+            variant.thumbnail(box, Image.LANCZOS)
+            filename = f'{name}.webp'
+            variant.save(os.path.join(output_dir, filename), 'WEBP', quality=quality, method=4)
+            outputs[name] = filename
+
+        save('thumbnail', THUMBNAIL_SIZE)
+        for box_width, box_height in sizes:
+            for density in DENSITIES:
+                box = (box_width * density, box_height * density)
+                if density > 1 and width < box[0] and height < box[1]:
+                    continue
+                save(f'{box_width}x{box_height}@{density}x', box)
+
+    return width, height, outputs
+
+
+def _pool_context():
+    """Start method for render processes; never a plain fork of a request worker"""
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+class ImageVariantPipeline:
+    """
+    Process pool rendering image variants in the background
+    """
+
+    def __init__(self, processes=None):
+        self.processes = processes or getattr(settings, 'IMAGE_VARIANT_PROCESSES', 2)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._outstanding = 0
+
+    def submit(self, file_id):
+        """Render variants for an upload once the current transaction commits"""
+        transaction.on_commit(lambda: self._submit(file_id))
+
+    def join(self):
+        """Block until every submitted file has been processed and saved"""
+        with self._idle:
+            self._idle.wait_for(lambda: self._outstanding == 0)
+
+    def _submit(self, file_id):
+        from .models import UploadedFile
+
+        uploaded_file = UploadedFile.objects.select_related('blob').filter(pk=file_id).first()
+        if uploaded_file is None or not uploaded_file.file_type.startswith('image/'):
+            return
+
+        # Variants of stored blobs are shared by every upload of the same content
+        key = uploaded_file.blob.sha256 if uploaded_file.blob_id else file_id
+        source = os.path.join(settings.MEDIA_ROOT, 'uploads', uploaded_file.stored_filename)
+        future = self._get_executor().submit(
+            render_variants, source, variants_dir(key), placement_sizes(),
+            getattr(settings, 'IMAGE_VARIANT_QUALITY', 80)
+        )
+        with self._lock:
+            self._outstanding += 1
+        future.add_done_callback(
+            lambda f: self._finish(file_id, uploaded_file.blob_id, key, f)
+        )
+
+    def _finish(self, file_id, blob_id, key, future):
+        from .models import UploadedFile
+
+        try:
+            width, height, outputs = future.result()
+            url_prefix = f'{settings.MEDIA_URL.rstrip("/")}/variants/{key}/'
+            variants = {name: url_prefix + filename for name, filename in outputs.items()}
+            results = {
+                'width': width,
+                'height': height,
+                'thumbnail_path': variants.pop('thumbnail'),
+                'variants': variants,
+            }
+            if blob_id:
+                share_results(blob_id, **results)
+            else:
+                UploadedFile.objects.filter(pk=file_id).update(**results)
+        except Exception as e:
+            print(f"⚠️ Image variants for file {file_id} failed: {e}")
+        finally:
+            connection.close()
+            with self._idle:
+                self._outstanding -= 1
+                self._idle.notify_all()
+
+    def _get_executor(self):
+        # Created on first use in each process: a forked worker cannot reuse its parent's pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=_pool_context()
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+
+image_pipeline = ImageVariantPipeline()
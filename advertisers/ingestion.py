@@ -0,0 +1,152 @@
+"""
+Buffered ingestion of impression/click events
+
+Beacon requests only append to an in-process buffer. A background writer
+flushes the buffer with one bulk INSERT and one counter UPDATE per ad,
+either when it reaches ANALYTICS_BUFFER_MAX_EVENTS or every
+ANALYTICS_BUFFER_FLUSH_MS milliseconds, whichever comes first.
+
+A batch whose write fails because the database is unreachable goes back
+to the front of the buffer and is retried with the next flush; a batch
+that fails for any other reason is dropped, so it cannot block the rest. While writes keep failing the buffer holds
+at most ANALYTICS_BUFFER_MAX_PENDING events; the oldest are dropped
+beyond that.
+"""
+import atexit
+import os
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, connection, transaction
+from django.db.models import F
+
+from .models import Ad, Analytics
+from .useragents import user_agents
+
+
+class AnalyticsBuffer:
+    """
+    Thread-safe event buffer with a periodic background flusher
+    """
+
+    def __init__(self, max_events=None, flush_ms=None, max_pending=None):
+        self.max_events = max_events or getattr(settings, 'ANALYTICS_BUFFER_MAX_EVENTS', 500)
+        self.flush_ms = flush_ms or getattr(settings, 'ANALYTICS_BUFFER_FLUSH_MS', 1000)
+        self.max_pending = max_pending or getattr(settings, 'ANALYTICS_BUFFER_MAX_PENDING', 50000)
+        self._events = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add(self, events):
+        """Queue a list of event dicts; flush inline if the buffer is full"""
+        self._ensure_writer()
+        with self._lock:
+            self._events.extend(events)
+            full = len(self._events) >= self.max_events
+        if full:
+            self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._events)
+
+    def flush(self):
+        """Write all buffered events. Returns the number of rows inserted."""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            if not events:
+                return 0
+            try:
+                return write_events(events)
+            except (OperationalError, InterfaceError):
+                self._requeue(events)
+                raise
+            except Exception:
+                print(f"⚠️ Analytics batch of {len(events)} events dropped")
+                raise
+
+    def _requeue(self, events):
+        """Put a failed batch back ahead of newer events, within max_pending"""
+        with self._lock:
+            self._events[:0] = events
+            overflow = len(self._events) - self.max_pending
+            if overflow > 0:
+                del self._events[:overflow]
+        if overflow > 0:
+            print(f"⚠️ Analytics buffer full, dropped {overflow} oldest events")
+
+    def _ensure_writer(self):
+        # Gunicorn forks workers after import, so start one writer per process
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name='analytics-writer', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_ms / 1000)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Analytics flush failed: {e}")
+            finally:
+                connection.close()
+
+
+def write_events(events):
+    """
+    Bulk insert analytics events and apply per-ad counter deltas.
+    Events referencing unknown ads are dropped. User-agent strings are
+    stored once in user_agents and referenced by ID.
+    """
+    ad_ids = {event['ad_id'] for event in events}
+    known = set(Ad.objects.filter(pk__in=ad_ids).values_list('pk', flat=True))
+    agent_ids = user_agents.resolve(
+        event['user_agent'] for event in events if event.get('user_agent')
+    )
+
+    rows = []
+    deltas = defaultdict(lambda: {'impression': 0, 'click': 0})
+    for event in events:
+        if event['ad_id'] not in known:
+            continue
+        fields = dict(event)
+        fields['user_agent_id'] = agent_ids.get(fields.pop('user_agent', None))
+        rows.append(Analytics(**fields))
+        deltas[event['ad_id']][event['event_type']] += 1
+
+    if not rows:
+        return 0
+
+    try:
+        with transaction.atomic():
+            Analytics.objects.bulk_create(rows, batch_size=500)
+            for ad_id, counts in deltas.items():
+                Ad.objects.filter(pk=ad_id).update(
+                    total_impressions=F('total_impressions') + counts['impression'],
+                    total_clicks=F('total_clicks') + counts['click'],
+                )
+    except Exception:
+        # A cached user_agents ID may point at a row that no longer exists
+        user_agents.forget(agent_ids)
+        raise
+
+    # Dashboards are not invalidated here: with live traffic this runs every
+    # second, so cached statistics pick up new counts when they expire
+    return len(rows)
+
+
+analytics_buffer = AnalyticsBuffer()
+atexit.register(analytics_buffer.flush)
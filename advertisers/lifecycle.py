@@ -0,0 +1,220 @@
+"""
+Date-driven ad and booking lifecycle
+
+``run_lifecycle`` is meant to run every minute (``manage.py run_lifecycle``
+from cron, or ``--loop``). Each run:
+
+* moves ads approved → live from their start_date, and approved/live →
+  expired once end_date has passed
+* moves bookings confirmed → active from their start_date, and
+  confirmed/active → completed once end_date has passed
+* sends booking reminder, start and end notifications and sets
+  ``reminder_sent``, ``start_notification_sent`` and
+  ``end_notification_sent``
+
+Every step claims rows in batches: candidates are locked with SKIP LOCKED
+where the database supports it and changed with one UPDATE that re-checks
+the condition, in the same transaction as the notifications they cause.
+Several nodes can run at once without handling a row twice, and a second
+run on the same day finds nothing left to do.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .events import publish_ad_status
+from .notifications import notifications_created
+from .occupancy import occupancy_index
+from .outbox import queue_emails
+from .serving import serving_index
+from .stats_cache import invalidate_user_stats
+
+BOOKINGS_URL = 'http://localhost:5173/dashboard/bookings'
+
+
+def _claim(queryset, batch_size, fields, **changes):
+    """
+    Lock up to ``batch_size`` rows of ``queryset`` and apply ``changes`` to
+    them. Must run inside a transaction. Returns the rows this call changed,
+    as they were.
+    """
+    candidates = queryset.order_by('pk')
+    if connection.features.has_select_for_update_skip_locked:
+        # The rows are locked to this runner, so one UPDATE claims them all
+        rows = list(candidates.select_for_update(skip_locked=True).only('pk', *fields)[:batch_size])
+        if rows:
+            queryset.filter(pk__in=[row.pk for row in rows]).update(**changes)
+        return rows
+    # Unlocked candidates may be claimed by a concurrent runner too; keep
+    # only the rows whose guarded UPDATE this runner won
+    return [
+        row for row in candidates.only('pk', *fields)[:batch_size]
+        if queryset.filter(pk=row.pk).update(**changes)
+    ]
+
+
+def _advance_ads(queryset, status, batch_size):
+    """Set ``status`` on every ad in ``queryset``. Returns the number moved."""
+    moved = 0
+    while True:
+        with transaction.atomic():
+            ads = _claim(
+                queryset, batch_size, ('user_id', 'title', 'status'),
+                status=status, updated_at=timezone.now()
+            )
+            for ad in ads:
+                previous, ad.status = ad.status, status
+                publish_ad_status(ad, previous)
+        # QuerySet.update skips post_save, so drop cached dashboards here
+        invalidate_user_stats(*{ad.user_id for ad in ads})
+        moved += len(ads)
+        if len(ads) < batch_size:
+            return moved
+
+
+def _advance_bookings(queryset, status, batch_size):
+    """Set ``status`` on every booking in ``queryset``. Returns the number moved."""
+    moved = 0
+    while True:
+        with transaction.atomic():
+            bookings = _claim(
+                queryset, batch_size, ('user_id', 'placement_id'),
+                status=status, updated_at=timezone.now()
+            )
+        invalidate_user_stats(*{booking.user_id for booking in bookings})
+        # Completed bookings stop blocking their placement
+        for placement_id in {booking.placement_id for booking in bookings}:
+            occupancy_index.invalidate(placement_id)
+        moved += len(bookings)
+        if len(bookings) < batch_size:
+            return moved
+
+
+def booking_notice(kind, booking):
+    """``(Notification, (subject, body, recipients))`` for one booking (unsaved)"""
+    from .models import Notification
+
+    ad, placement = booking.ad, booking.placement
+    if kind == 'reminder':
+        notification_type = 'booking_reminder'
+        title = 'Booking Starts Soon'
+        message = (
+            f'Your booking for "{ad.title}" on {placement.placement_name} '
+            f'starts on {booking.start_date:%Y-%m-%d}.'
+        )
+    elif kind == 'started':
+        notification_type = 'booking_started'
+        title = 'Booking Started'
+        message = (
+            f'Your booking for "{ad.title}" on {placement.placement_name} '
+            f'is now running until {booking.end_date:%Y-%m-%d}.'
+        )
+    else:  # ended
+        notification_type = 'booking_completed'
+        title = 'Booking Completed'
+        message = (
+            f'Your booking for "{ad.title}" on {placement.placement_name} '
+            f'ended on {booking.end_date:%Y-%m-%d}.'
+        )
+
+    notification = Notification(
+        user_id=booking.user_id,
+        title=title,
+        message=message,
+        notification_type=notification_type,
+        related_ad=ad,
+        related_booking=booking
+    )
+    body = f"""
+Hello {booking.user.first_name or booking.user.username},
+
+{message}
+
+Placement: {placement.placement_name}
+Dates: {booking.start_date:%Y-%m-%d} to {booking.end_date:%Y-%m-%d}
+
+View your bookings: {BOOKINGS_URL}
+
+---
+AdPortal Team
+                """
+    email = (f'[AdPortal] {title}: "{ad.title}"', body, [booking.user.email])
+    return notification, email
+
+
+def _notify_bookings(queryset, kind, flag, batch_size):
+    """Send ``kind`` notices for ``queryset`` and set ``flag``. Returns the number sent."""
+    from .models import Booking, Notification
+
+    sent = 0
+    while True:
+        with transaction.atomic():
+            claimed = _claim(queryset, batch_size, (), **{flag: True})
+            bookings = Booking.objects.select_related('user', 'ad', 'placement').filter(
+                pk__in=[booking.pk for booking in claimed]
+            ) if claimed else []
+            notices = [booking_notice(kind, booking) for booking in bookings]
+            if notices:
+                notifications_created(Notification.objects.bulk_create(
+                    [notification for notification, _ in notices], batch_size=500
+                ))
+                queue_emails(email for _, email in notices)
+        sent += len(claimed)
+        if len(claimed) < batch_size:
+            return sent
+
+
+def run_lifecycle(today=None, batch_size=500):
+    """Apply every date-driven transition and notice due ``today``. Returns counts."""
+    from .models import Ad, Booking
+
+    today = today or timezone.localdate()
+    reminder_days = getattr(settings, 'BOOKING_REMINDER_DAYS', 1)
+    end_notice_days = getattr(settings, 'BOOKING_END_NOTICE_GRACE_DAYS', 3)
+    started = Q(start_date__isnull=True) | Q(start_date__lte=today)
+    not_ended = Q(end_date__isnull=True) | Q(end_date__gte=today)
+
+    counts = {
+        'ads_expired': _advance_ads(
+            Ad.objects.filter(status__in=['approved', 'live'], end_date__lt=today),
+            'expired', batch_size
+        ),
+        'ads_live': _advance_ads(
+            Ad.objects.filter(started & not_ended, status='approved'),
+            'live', batch_size
+        ),
+        'bookings_completed': _advance_bookings(
+            Booking.objects.filter(status__in=['confirmed', 'active'], end_date__lt=today),
+            'completed', batch_size
+        ),
+        'bookings_active': _advance_bookings(
+            Booking.objects.filter(status='confirmed', start_date__lte=today, end_date__gte=today),
+            'active', batch_size
+        ),
+        'reminders_sent': _notify_bookings(
+            Booking.objects.filter(
+                status='confirmed', reminder_sent=False,
+                start_date__gt=today, start_date__lte=today + timedelta(days=reminder_days)
+            ),
+            'reminder', 'reminder_sent', batch_size
+        ),
+        'start_notices_sent': _notify_bookings(
+            Booking.objects.filter(status='active', start_notification_sent=False),
+            'started', 'start_notification_sent', batch_size
+        ),
+        # Bounded so bookings completed long before this ran are not announced
+        'end_notices_sent': _notify_bookings(
+            Booking.objects.filter(
+                status='completed', end_notification_sent=False,
+                end_date__gte=today - timedelta(days=end_notice_days)
+            ),
+            'ended', 'end_notification_sent', batch_size
+        ),
+    }
+    # Status UPDATEs send no signals, so the serving index is told here
+    if any(counts[step] for step in ('ads_expired', 'ads_live', 'bookings_completed', 'bookings_active')):
+        serving_index.invalidate()
+    return counts
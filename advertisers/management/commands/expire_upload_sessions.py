@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from advertisers.resumable import expire_sessions
+
+
+class Command(BaseCommand):
+    help = 'Discards resumable upload sessions that have been idle too long'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=int, default=None,
+            help='Idle time before a session expires (default: RESUMABLE_UPLOAD_EXPIRY_HOURS)'
+        )
+
+    def handle(self, *args, **options):
+        max_age = timedelta(hours=options['hours']) if options['hours'] is not None else None
+        count = expire_sessions(max_age)
+        self.stdout.write(self.style.SUCCESS(f'Discarded {count} expired upload sessions.'))
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from advertisers.storage import collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Deletes stored upload blobs that no uploaded file references any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-minutes', type=int, default=60,
+            help='Only delete blobs unreferenced for at least this long (default: 60)'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report what would be deleted without deleting anything'
+        )
+
+    def handle(self, *args, **options):
+        removed, freed = collect_garbage(
+            grace=timedelta(minutes=options['grace_minutes']),
+            dry_run=options['dry_run']
+        )
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {removed} unreferenced blobs ({freed // 1024} KB).'
+        ))
@@ -0,0 +1,20 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from advertisers.search import SEARCH_SPECS, get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the portable full-text index for ads, FAQs and case studies'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        if not backend.maintains_index:
+            self.stdout.write(
+                f'{type(backend).__name__} searches the database natively; nothing to rebuild.'
+            )
+            return
+
+        for label, spec in SEARCH_SPECS.items():
+            count = backend.rebuild(apps.get_model(label), spec)
+            self.stdout.write(self.style.SUCCESS(f'Indexed {count} {spec.document_type} documents.'))
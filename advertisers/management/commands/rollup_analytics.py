@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from advertisers.rollups import fold_daily_rollups, get_watermark, rebuild_reach_sketches
+
+
+class Command(BaseCommand):
+    help = 'Folds raw analytics events since the last watermark into daily rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild-reach', action='store_true',
+            help='Re-sketch unique reach for every day already folded'
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running as a worker instead of folding once'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=3600,
+            help='Seconds to sleep between folds (default: 3600)'
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild_reach']:
+            written = rebuild_reach_sketches()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} reach sketches.'))
+
+        while True:
+            self.fold()
+            if not options['loop']:
+                break
+            connection.close()
+            time.sleep(options['interval'])
+
+    def fold(self):
+        previous = get_watermark()
+        written = fold_daily_rollups()
+        current = get_watermark()
+
+        if written or previous != current:
+            self.stdout.write(self.style.SUCCESS(
+                f'Folded events up to {current} into {written} rollup rows.'
+            ))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'Rollups already up to date ({current}).'
+            ))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from advertisers.lifecycle import run_lifecycle
+
+
+class Command(BaseCommand):
+    help = 'Advances ad and booking statuses by date and sends booking notices'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Rows claimed per transaction (default: 500)'
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running as a worker instead of running once'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=60,
+            help='Seconds to sleep between runs (default: 60)'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            counts = run_lifecycle(batch_size=options['batch_size'])
+            changed = {step: count for step, count in counts.items() if count}
+            if changed:
+                self.stdout.write(', '.join(f'{step}: {count}' for step, count in changed.items()))
+
+            if not options['loop']:
+                break
+            connection.close()
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS('Lifecycle run complete.'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from advertisers.models import UploadedFile
+from advertisers.scanning import ClamdSession, scan_uploaded_file
+
+
+class Command(BaseCommand):
+    help = 'Scans uploads still pending a virus scan (e.g. after a restart or a full queue)'
+
+    def handle(self, *args, **options):
+        pending = UploadedFile.objects.filter(
+            virus_scan_status='pending'
+        ).order_by('created_at').values_list('id', flat=True)
+
+        session = ClamdSession.from_settings()
+        results = {}
+        try:
+            for file_id in pending.iterator():
+                result = scan_uploaded_file(file_id, session)
+                if result:
+                    results[result] = results.get(result, 0) + 1
+        finally:
+            session.close()
+
+        summary = ', '.join(f'{count} {result}' for result, count in results.items()) or 'nothing to scan'
+        self.stdout.write(self.style.SUCCESS(f'Scanned pending files: {summary}.'))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from advertisers.outbox import deliver_pending
+
+
+class Command(BaseCommand):
+    help = 'Sends queued outbox emails over a single mail connection per batch'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Emails claimed and sent per connection (default: 100)'
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running as a worker instead of draining once'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help='Seconds to sleep between polls when the outbox is empty (default: 5)'
+        )
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = deliver_pending(options['batch_size'])
+            total_sent += sent
+            total_failed += failed
+            if sent or failed:
+                self.stdout.write(f'Sent {sent} emails, {failed} failed.')
+
+            if sent + failed < options['batch_size']:
+                if not options['loop']:
+                    break
+                connection.close()
+                time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Outbox drained: {total_sent} sent, {total_failed} failed.'
+        ))
@@ -0,0 +1,58 @@
+"""
+Cache for the public marketing overview payload
+
+The landing page payload changes a few times a month, so the serialized
+response is cached under a global version number. Saving or deleting any
+marketing model bumps the version via signals. A cached payload also
+expires at the next promotional banner ``start_date``/``end_date``, so
+time-windowed banners appear and disappear on schedule without a write.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Min, Q
+from django.utils import timezone
+
+_VERSION_KEY = 'marketing_overview_version'
+
+
+def _get_version():
+    return cache.get_or_set(_VERSION_KEY, time.time_ns() // 1000, timeout=None)
+
+
+def next_banner_boundary(now):
+    """Earliest upcoming start or end among active banners, or None"""
+    from .models import PromotionalBanner
+
+    boundaries = PromotionalBanner.objects.filter(is_active=True).aggregate(
+        next_start=Min('start_date', filter=Q(start_date__gt=now)),
+        next_end=Min('end_date', filter=Q(end_date__gte=now)),
+    )
+    upcoming = [boundary for boundary in boundaries.values() if boundary is not None]
+    return min(upcoming) if upcoming else None
+
+
+def get_marketing_overview(compute):
+    """Return the cached overview payload, computing it on a miss"""
+    key = f'marketing_overview:{_get_version()}'
+    data = cache.get(key)
+    if data is None:
+        now = timezone.now()
+        data = compute(now)
+        timeout = getattr(settings, 'MARKETING_OVERVIEW_CACHE_TTL', 3600)
+        boundary = next_banner_boundary(now)
+        if boundary is not None:
+            # end_date is inclusive, so the banner goes away just after it
+            timeout = min(timeout, max(1, math.ceil((boundary - now).total_seconds())))
+        cache.set(key, data, timeout=timeout)
+    return data
+
+
+def invalidate_marketing_overview():
+    try:
+        cache.incr(_VERSION_KEY)
+    except ValueError:
+        # No version stored yet, so nothing is cached
+        pass
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0004_event_venue_remove_ad_ad_category_ad_ad_type_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('processed_until', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'rollup_watermarks',
+            },
+        ),
+        migrations.CreateModel(
+            name='AnalyticsDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('event_type', models.CharField(choices=[('impression', 'Impression'), ('click', 'Click')], max_length=20)),
+                ('device_type', models.CharField(blank=True, default='', max_length=50)),
+                ('country', models.CharField(blank=True, default='', max_length=100)),
+                ('count', models.IntegerField(default=0)),
+                ('ad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='advertisers.ad')),
+            ],
+            options={
+                'db_table': 'analytics_daily_rollups',
+                'ordering': ['day'],
+                'constraints': [models.UniqueConstraint(fields=('ad', 'day', 'event_type', 'device_type', 'country'), name='unique_analytics_daily_rollup')],
+            },
+        ),
+    ]
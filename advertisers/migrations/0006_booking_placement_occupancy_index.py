@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0005_analytics_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['placement', 'status', 'start_date', 'end_date'], name='bookings_placeme_8ae6b8_idx'),
+        ),
+    ]
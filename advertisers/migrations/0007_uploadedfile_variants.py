@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0006_booking_placement_occupancy_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
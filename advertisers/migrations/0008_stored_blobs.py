@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0007_uploadedfile_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('stored_filename', models.CharField(max_length=255)),
+                ('size_bytes', models.BigIntegerField()),
+                ('ref_count', models.IntegerField(default=0)),
+                ('virus_scan_status', models.CharField(default='pending', max_length=20)),
+                ('virus_scan_date', models.DateTimeField(blank=True, null=True)),
+                ('width', models.IntegerField(blank=True, null=True)),
+                ('height', models.IntegerField(blank=True, null=True)),
+                ('thumbnail_path', models.CharField(blank=True, max_length=500, null=True)),
+                ('variants', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'stored_blobs',
+                'indexes': [models.Index(fields=['ref_count', 'last_used_at'], name='stored_blob_ref_cou_32b7dc_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='uploads', to='advertisers.storedblob'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0010_email_outbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'is_read'], name='notificatio_user_id_a4dd5c_idx'),
+        ),
+    ]
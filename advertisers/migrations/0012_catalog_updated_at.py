@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0011_notification_user_is_read_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='packagefeature',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='pricingfeature',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0012_catalog_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='analytics',
+            name='analytics_event_t_8c248c_idx',
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['created_at', 'id'], name='ads_created_a0b732_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='ads_user_id_476235_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analytics',
+            index=models.Index(fields=['event_timestamp', 'id'], name='analytics_event_t_fc79e7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='notificatio_user_id_66dee4_idx'),
+        ),
+    ]
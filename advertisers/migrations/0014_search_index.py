@@ -0,0 +1,68 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:21
+
+from django.db import migrations, models
+
+# Mirrors advertisers.search.SEARCH_SPECS and SEARCH_CONFIG
+NATIVE_SEARCH_FIELDS = {
+    'ad': ['title', 'short_description'],
+    'faq': ['question', 'answer'],
+    'casestudy': ['title', 'company_name', 'summary'],
+}
+
+
+def _native_indexes(apps, schema_editor):
+    for model_name, fields in NATIVE_SEARCH_FIELDS.items():
+        model = apps.get_model('advertisers', model_name)
+        yield model, fields, f'{model._meta.db_table}_search'
+
+
+def create_native_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    quote = schema_editor.quote_name
+    for model, fields, name in _native_indexes(apps, schema_editor):
+        if vendor == 'postgresql':
+            from django.contrib.postgres.indexes import GinIndex
+            from django.contrib.postgres.search import SearchVector
+
+            schema_editor.add_index(model, GinIndex(SearchVector(*fields, config='english'), name=name))
+        elif vendor == 'mysql':
+            columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+            schema_editor.execute(
+                f'CREATE FULLTEXT INDEX {quote(name)} ON {quote(model._meta.db_table)} ({columns})'
+            )
+
+
+def drop_native_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    quote = schema_editor.quote_name
+    for model, fields, name in _native_indexes(apps, schema_editor):
+        if vendor == 'postgresql':
+            schema_editor.execute(f'DROP INDEX IF EXISTS {quote(name)}')
+        elif vendor == 'mysql':
+            schema_editor.execute(f'DROP INDEX {quote(name)} ON {quote(model._meta.db_table)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0013_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_type', models.CharField(max_length=20)),
+                ('object_id', models.PositiveIntegerField()),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.FloatField()),
+            ],
+            options={
+                'db_table': 'search_terms',
+                'indexes': [models.Index(fields=['document_type', 'term'], name='search_term_documen_5092b9_idx')],
+                'unique_together': {('document_type', 'object_id', 'term')},
+            },
+        ),
+        migrations.RunPython(create_native_search_indexes, drop_native_search_indexes),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0014_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['status', 'start_date'], name='ads_status_f527c7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['status', 'end_date'], name='ads_status_bfb797_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['status', 'start_date'], name='bookings_status_f0ab31_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['status', 'end_date'], name='bookings_status_9dea1a_idx'),
+        ),
+    ]
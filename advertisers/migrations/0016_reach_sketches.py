@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0015_lifecycle_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsReachSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('country', models.CharField(blank=True, default='', max_length=100)),
+                ('sketch', models.BinaryField()),
+                ('ad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reach_sketches', to='advertisers.ad')),
+            ],
+            options={
+                'db_table': 'analytics_reach_sketches',
+                'ordering': ['day'],
+                'constraints': [models.UniqueConstraint(fields=('ad', 'day', 'country'), name='unique_analytics_reach_sketch')],
+            },
+        ),
+    ]
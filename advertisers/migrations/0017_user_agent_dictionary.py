@@ -0,0 +1,134 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:33
+
+import hashlib
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Mirrors advertisers.useragents as of this migration, so later changes to
+# the live parser do not change what this migration writes
+MAX_USER_AGENT_LENGTH = 1000
+BATCH_SIZE = 2000
+
+BOT_RE = re.compile(
+    r'bot\b|bot/|crawl|spider|slurp|scrape|archiver|facebookexternalhit|embedly|preview|'
+    r'headless|phantomjs|lighthouse|pingdom|uptime|monitor|curl/|wget/|python-|java/|'
+    r'go-http-client|okhttp|axios/|node-fetch|libwww|httpclient|postman',
+    re.IGNORECASE
+)
+TABLET_RE = re.compile(r'ipad|tablet|kindle|silk/|playbook|(android(?!.*mobile))', re.IGNORECASE)
+MOBILE_RE = re.compile(r'mobi|iphone|ipod|android|windows phone|blackberry|opera mini', re.IGNORECASE)
+BROWSERS = [
+    ('Edge', re.compile(r'edg(e|a|ios)?/', re.IGNORECASE)),
+    ('Opera', re.compile(r'opr/|opera', re.IGNORECASE)),
+    ('Samsung Internet', re.compile(r'samsungbrowser/', re.IGNORECASE)),
+    ('Firefox', re.compile(r'firefox/|fxios/', re.IGNORECASE)),
+    ('Chrome', re.compile(r'chrome/|crios/|chromium/', re.IGNORECASE)),
+    ('Safari', re.compile(r'version/[\d.]+.*safari/', re.IGNORECASE)),
+    ('Internet Explorer', re.compile(r'msie |trident/', re.IGNORECASE)),
+]
+OPERATING_SYSTEMS = [
+    ('iOS', re.compile(r'iphone|ipad|ipod', re.IGNORECASE)),
+    ('Android', re.compile(r'android', re.IGNORECASE)),
+    ('Windows', re.compile(r'windows', re.IGNORECASE)),
+    ('ChromeOS', re.compile(r'cros', re.IGNORECASE)),
+    ('macOS', re.compile(r'mac os x|macintosh', re.IGNORECASE)),
+    ('Linux', re.compile(r'linux', re.IGNORECASE)),
+]
+
+
+def _first_match(patterns, user_agent):
+    return next((name for name, pattern in patterns if pattern.search(user_agent)), 'Other')
+
+
+def parse_user_agent(text):
+    """Field values of the user_agents row for ``text``"""
+    user_agent = text[:MAX_USER_AGENT_LENGTH]
+    is_bot = not user_agent.strip() or bool(BOT_RE.search(user_agent))
+    if is_bot:
+        device_type = 'bot'
+    elif TABLET_RE.search(user_agent):
+        device_type = 'tablet'
+    elif MOBILE_RE.search(user_agent):
+        device_type = 'mobile'
+    else:
+        device_type = 'desktop'
+    return {
+        'ua_hash': hashlib.blake2b(user_agent.encode(), digest_size=16).hexdigest(),
+        'user_agent': user_agent,
+        'device_type': device_type,
+        'browser': _first_match(BROWSERS, user_agent),
+        'os': _first_match(OPERATING_SYSTEMS, user_agent),
+        'is_bot': is_bot,
+    }
+
+
+def link_user_agents(apps, schema_editor):
+    """Move each distinct user-agent string into user_agents and point events at it"""
+    Analytics = apps.get_model('advertisers', 'Analytics')
+    UserAgent = apps.get_model('advertisers', 'UserAgent')
+
+    texts = Analytics.objects.exclude(user_agent=None).values_list('user_agent', flat=True).distinct().order_by()
+    parsed = {text: parse_user_agent(text) for text in texts.iterator()}
+    if not parsed:
+        return
+    UserAgent.objects.bulk_create(
+        [UserAgent(**fields) for fields in parsed.values()], batch_size=500, ignore_conflicts=True
+    )
+    ids = dict(UserAgent.objects.values_list('ua_hash', 'pk'))
+    agent_ids = {text: ids[fields['ua_hash']] for text, fields in parsed.items()}
+
+    # Walk events in primary-key order so each batch is one index range scan
+    events = Analytics.objects.exclude(user_agent=None).order_by('pk').only('pk', 'user_agent')
+    last_pk = None
+    while True:
+        batch = events.filter(pk__gt=last_pk) if last_pk is not None else events
+        batch = list(batch[:BATCH_SIZE])
+        if not batch:
+            return
+        for event in batch:
+            event.user_agent_ref_id = agent_ids[event.user_agent]
+        Analytics.objects.bulk_update(batch, ['user_agent_ref'], batch_size=500)
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0016_reach_sketches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ua_hash', models.CharField(max_length=32, unique=True)),
+                ('user_agent', models.TextField(blank=True)),
+                ('device_type', models.CharField(max_length=50)),
+                ('browser', models.CharField(max_length=50)),
+                ('os', models.CharField(max_length=50)),
+                ('is_bot', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'user_agents',
+            },
+        ),
+        migrations.AddField(
+            model_name='analytics',
+            name='user_agent_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='events', to='advertisers.useragent'),
+        ),
+        migrations.RunPython(link_user_agents, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='analytics',
+            name='user_agent',
+        ),
+        migrations.RenameField(
+            model_name='analytics',
+            old_name='user_agent_ref',
+            new_name='user_agent',
+        ),
+    ]
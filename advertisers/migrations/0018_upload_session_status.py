@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0017_user_agent_dictionary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='status',
+            field=models.CharField(choices=[('uploading', 'Uploading'), ('finalizing', 'Finalizing')], default='uploading', max_length=20),
+        ),
+    ]
@@ -1,5 +1,9 @@
+import uuid
+from decimal import Decimal
+
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from django.utils.text import slugify
 from ckeditor.fields import RichTextField
 
@@ -183,6 +187,12 @@ class Ad(models.Model):
             models.Index(fields=['status']),
             models.Index(fields=['start_date', 'end_date']),
             models.Index(fields=['category']),
+            # Lifecycle transitions: status plus the date that triggers them
+            models.Index(fields=['status', 'start_date']),
+            models.Index(fields=['status', 'end_date']),
+            # Keyset pagination: admins over all ads, advertisers over their own
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['user', 'created_at', 'id']),
         ]
     
     def __str__(self):
@@ -196,6 +206,38 @@ class Ad(models.Model):
         return 0
 
 
+class StoredBlob(models.Model):
+    """
+    One stored copy of upload content, addressed by its SHA-256.
+    Scan and image results live here so duplicate uploads reuse them.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    stored_filename = models.CharField(max_length=255)  # relative to MEDIA_ROOT/uploads
+    size_bytes = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    
+    # Results shared by every upload of this content
+    virus_scan_status = models.CharField(max_length=20, default='pending')
+    virus_scan_date = models.DateTimeField(blank=True, null=True)
+    width = models.IntegerField(blank=True, null=True)
+    height = models.IntegerField(blank=True, null=True)
+    thumbnail_path = models.CharField(max_length=500, blank=True, null=True)
+    variants = models.JSONField(default=dict, blank=True)
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'stored_blobs'
+        indexes = [
+            models.Index(fields=['ref_count', 'last_used_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count} refs)"
+
+
 class UploadedFile(models.Model):
     """
     Images, logos, PDFs uploaded by advertisers
@@ -209,6 +251,7 @@ class UploadedFile(models.Model):
     
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='uploaded_files')
     ad = models.ForeignKey(Ad, on_delete=models.SET_NULL, null=True, blank=True, related_name='files')
+    blob = models.ForeignKey(StoredBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='uploads')
     
     # File Information
     original_filename = models.CharField(max_length=255)
@@ -221,6 +264,7 @@ class UploadedFile(models.Model):
     width = models.IntegerField(blank=True, null=True)
     height = models.IntegerField(blank=True, null=True)
     thumbnail_path = models.CharField(max_length=500, blank=True, null=True)
+    variants = models.JSONField(default=dict, blank=True)  # e.g. {'300x250@1x': '/media/variants/1/300x250@1x.webp'}
     
     # Security
     virus_scan_status = models.CharField(max_length=20, choices=SCAN_STATUS_CHOICES, default='pending')
@@ -241,6 +285,41 @@ class UploadedFile(models.Model):
         return f"{self.original_filename} ({self.virus_scan_status})"
 
 
+class UploadSession(models.Model):
+    """
+    A resumable upload in progress. Chunks are appended to a temp file
+    until ``received_bytes`` reaches ``total_size``, then finalized into
+    an UploadedFile.
+    """
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('finalizing', 'Finalizing'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    ad = models.ForeignKey(Ad, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    
+    # File Information
+    original_filename = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=50)
+    total_size = models.BigIntegerField()
+    received_bytes = models.BigIntegerField(default=0)
+    # Claimed by exactly one finalize request
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'upload_sessions'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.original_filename} ({self.received_bytes}/{self.total_size})"
+
+
 class Booking(models.Model):
     """
     Calendar bookings for ad placements (CALENDAR FUNCTIONALITY HERE)
@@ -287,6 +366,10 @@ class Booking(models.Model):
         indexes = [
             models.Index(fields=['start_date', 'end_date']),
             models.Index(fields=['status']),
+            models.Index(fields=['placement', 'status', 'start_date', 'end_date']),
+            # Lifecycle transitions: status plus the date that triggers them
+            models.Index(fields=['status', 'start_date']),
+            models.Index(fields=['status', 'end_date']),
         ]
     
     def __str__(self):
@@ -302,12 +385,31 @@ class Booking(models.Model):
             self.total_price = self.price_per_day * self.total_days
         
         if not self.final_price:
-            discount_amount = (self.total_price * self.discount_percentage) / 100
+            discount_amount = (Decimal(self.total_price) * Decimal(str(self.discount_percentage))) / 100
             self.final_price = self.total_price - discount_amount
         
         super().save(*args, **kwargs)
 
 
+class UserAgent(models.Model):
+    """
+    Each distinct user-agent string seen by analytics, parsed once
+    """
+    ua_hash = models.CharField(max_length=32, unique=True)  # blake2b of user_agent
+    user_agent = models.TextField(blank=True)
+    device_type = models.CharField(max_length=50)  # mobile, tablet, desktop, bot
+    browser = models.CharField(max_length=50)
+    os = models.CharField(max_length=50)
+    is_bot = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'user_agents'
+    
+    def __str__(self):
+        return f"{self.browser} on {self.os} ({self.device_type})"
+
+
 class Analytics(models.Model):
     """
     Click and impression tracking for ads
@@ -324,7 +426,9 @@ class Analytics(models.Model):
     
     # Visitor Information
     ip_address = models.CharField(max_length=45, blank=True, null=True)
-    user_agent = models.TextField(blank=True, null=True)
+    user_agent = models.ForeignKey(
+        UserAgent, on_delete=models.SET_NULL, null=True, blank=True, related_name='events'
+    )
     device_type = models.CharField(max_length=50, blank=True, null=True)  # mobile, tablet, desktop
     browser = models.CharField(max_length=50, blank=True, null=True)
     
@@ -343,13 +447,77 @@ class Analytics(models.Model):
         ordering = ['-event_timestamp']
         indexes = [
             models.Index(fields=['ad', 'event_type']),
-            models.Index(fields=['event_timestamp']),
+            models.Index(fields=['event_timestamp', 'id']),
         ]
     
     def __str__(self):
         return f"{self.event_type} - {self.ad.title} at {self.event_timestamp}"
 
 
+class AnalyticsDailyRollup(models.Model):
+    """
+    Pre-aggregated analytics counts per ad, day, event type, device and country
+    """
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name='daily_rollups')
+    day = models.DateField()
+    event_type = models.CharField(max_length=20, choices=Analytics.EVENT_TYPES)
+    device_type = models.CharField(max_length=50, blank=True, default='')
+    country = models.CharField(max_length=100, blank=True, default='')
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'analytics_daily_rollups'
+        ordering = ['day']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['ad', 'day', 'event_type', 'device_type', 'country'],
+                name='unique_analytics_daily_rollup'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.ad_id} {self.day} {self.event_type}: {self.count}"
+
+
+class AnalyticsReachSketch(models.Model):
+    """
+    HyperLogLog sketch of an ad's unique visitors on one day, overall
+    (country '') or from one country
+    """
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name='reach_sketches')
+    day = models.DateField()
+    country = models.CharField(max_length=100, blank=True, default='')
+    sketch = models.BinaryField()
+    
+    class Meta:
+        db_table = 'analytics_reach_sketches'
+        ordering = ['day']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['ad', 'day', 'country'],
+                name='unique_analytics_reach_sketch'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.ad_id} {self.day} {self.country or 'all'}"
+
+
+class RollupWatermark(models.Model):
+    """
+    Tracks how far raw analytics have been folded into rollup tables
+    """
+    name = models.CharField(max_length=50, unique=True)
+    processed_until = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'rollup_watermarks'
+    
+    def __str__(self):
+        return f"{self.name} @ {self.processed_until}"
+
+
 class Message(models.Model):
     """
     Support messages and communication
@@ -452,6 +620,10 @@ class Notification(models.Model):
     class Meta:
         db_table = 'notifications'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'is_read']),
+            models.Index(fields=['user', 'created_at', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.title} - {'Read' if self.is_read else 'Unread'}"
@@ -497,6 +669,64 @@ class AuditLog(models.Model):
         return f"{self.action} by {self.user.username if self.user else 'System'} at {self.created_at}"
 
 
+class OutboxEmail(models.Model):
+    """
+    Email written in the same transaction as the change it reports and
+    delivered later by the send_outbox_emails worker
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+    
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    recipients = models.JSONField(default=list)
+    
+    # Delivery
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    sent_at = models.DateTimeField(blank=True, null=True)
+    
+    # Timestamp
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'email_outbox'
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.subject} ({self.status})"
+
+
+class SearchTerm(models.Model):
+    """
+    Inverted index posting: one term of one searchable document.
+    Used for full-text search on databases without native support.
+    """
+    document_type = models.CharField(max_length=20)  # 'ad', 'faq', 'casestudy'
+    object_id = models.PositiveIntegerField()
+    term = models.CharField(max_length=64)
+    weight = models.FloatField()
+    
+    class Meta:
+        db_table = 'search_terms'
+        unique_together = ['document_type', 'object_id', 'term']
+        indexes = [
+            models.Index(fields=['document_type', 'term']),
+        ]
+    
+    def __str__(self):
+        return f"{self.term} in {self.document_type} {self.object_id}"
+
+
 # ============================================================================
 # NEW MARKETING MODELS (Requirement #5)
 # ============================================================================
@@ -657,6 +887,7 @@ class PricingFeature(models.Model):
     )
     order = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'pricing_features'
@@ -791,6 +1022,7 @@ class PackageFeature(models.Model):
         help_text="e.g., '5 users' instead of just checkmark"
     )
     order = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'package_features'
@@ -0,0 +1,192 @@
+"""
+Ad review decisions
+
+Single approve/reject and bulk moderation share the notification and
+email wording defined here. ``moderate_ads`` applies one decision to many
+ads with a single UPDATE, one bulk INSERT of notifications and one queued
+email per advertiser.
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .events import publish_ad_status
+from .notifications import notifications_created
+from .outbox import queue_emails
+from .stats_cache import invalidate_user_stats
+
+DECISIONS = {
+    'approve': 'approved',
+    'reject': 'rejected',
+}
+DEFAULT_REJECTION_REASON = 'No reason provided'
+
+
+def ad_status_notification(ad, status, reason=None):
+    """In-app Notification for a review decision (unsaved)"""
+    from .models import Notification
+
+    if status == 'approved':
+        title = 'Ad Approved'
+        message = f'Your ad "{ad.title}" has been approved and is now live!'
+    else:
+        title = 'Ad Rejected'
+        message = f'Your ad "{ad.title}" has been rejected. Reason: {reason}'
+    return Notification(
+        user_id=ad.user_id,
+        title=title,
+        message=message,
+        notification_type=f'ad_{status}',
+        related_ad=ad
+    )
+
+
+def ad_status_email(ad, status, reason=None):
+    """(subject, message) telling an advertiser about one review decision"""
+    if status == 'approved':
+        subject = f'[AdPortal] Your Ad "{ad.title}" Has Been Approved!'
+        message = f"""
+Hello {ad.user.first_name or ad.user.username},
+
+Great news! Your advertisement has been approved and is now live:
+
+Title: {ad.title}
+Status: Approved ✅
+Approved on: {timezone.now().strftime('%Y-%m-%d %H:%M')}
+
+You can now book advertising slots for this ad in the calendar.
+
+View your ad: http://localhost:5173/ads/{ad.id}
+
+Thank you for using AdPortal!
+
+---
+AdPortal Team
+                """
+    else:  # rejected
+        subject = f'[AdPortal] Update Required for "{ad.title}"'
+        message = f"""
+Hello {ad.user.first_name or ad.user.username},
+
+Your advertisement requires some updates before it can be approved:
+
+Title: {ad.title}
+Status: Needs Revision ⚠️
+
+Reason:
+{reason}
+
+What to do next:
+1. Log in to your account
+2. Go to "My Ads"
+3. Edit your ad and address the feedback
+4. Resubmit for review
+
+Edit your ad: http://localhost:5173/ads/{ad.id}/edit
+
+If you have questions, please contact our support team.
+
+---
+AdPortal Team
+                """
+    return subject, message
+
+
+def ad_status_digest(user, ads, status, reason=None):
+    """(subject, message) covering several ads of one advertiser"""
+    if len(ads) == 1:
+        return ad_status_email(ads[0], status, reason)
+
+    titles = '\n'.join(f'- {ad.title}' for ad in ads)
+    if status == 'approved':
+        subject = f'[AdPortal] {len(ads)} of Your Ads Have Been Approved!'
+        message = f"""
+Hello {user.first_name or user.username},
+
+Great news! These advertisements have been approved and are now live:
+
+{titles}
+
+You can now book advertising slots for them in the calendar.
+
+View your ads: http://localhost:5173/dashboard/ads
+
+Thank you for using AdPortal!
+
+---
+AdPortal Team
+                """
+    else:  # rejected
+        subject = f'[AdPortal] Update Required for {len(ads)} Ads'
+        message = f"""
+Hello {user.first_name or user.username},
+
+These advertisements require some updates before they can be approved:
+
+{titles}
+
+Reason:
+{reason}
+
+Edit them from "My Ads": http://localhost:5173/dashboard/ads
+
+If you have questions, please contact our support team.
+
+---
+AdPortal Team
+                """
+    return subject, message
+
+
+def moderate_ads(ad_ids, decision, reviewer, reason=None):
+    """
+    Approve or reject many ads awaiting review. Returns the IDs that were
+    updated; unknown IDs and ads in any other status are left alone.
+    """
+    from .models import Ad, Notification
+
+    status = DECISIONS[decision]
+    if status == 'rejected':
+        reason = reason or DEFAULT_REJECTION_REASON
+    now = timezone.now()
+
+    with transaction.atomic():
+        # Locked so a concurrent decision cannot move an ad after it is read;
+        # MySQL cannot limit the lock to the ads table and locks their users too
+        lock_of = ('self',) if connection.features.has_select_for_update_of else ()
+        ads = list(
+            Ad.objects.select_related('user').select_for_update(of=lock_of).filter(
+                pk__in=ad_ids, status='pending_review'
+            ).order_by('user_id', 'id')
+        )
+        if not ads:
+            return []
+
+        changes = {
+            'status': status,
+            'reviewed_by': reviewer,
+            'reviewed_at': now,
+            'updated_at': now,
+        }
+        if status == 'rejected':
+            changes['rejection_reason'] = reason
+        Ad.objects.filter(pk__in=[ad.pk for ad in ads]).update(**changes)
+        for ad in ads:
+            previous, ad.status = ad.status, status
+            publish_ad_status(ad, previous)
+
+        notifications_created(Notification.objects.bulk_create(
+            [ad_status_notification(ad, status, reason) for ad in ads],
+            batch_size=500
+        ))
+
+        by_user = {}
+        for ad in ads:
+            by_user.setdefault(ad.user_id, (ad.user, []))[1].append(ad)
+        queue_emails(
+            (*ad_status_digest(user, user_ads, status, reason), [user.email])
+            for user, user_ads in by_user.values()
+        )
+
+    # QuerySet.update skips post_save, so drop cached dashboards here
+    invalidate_user_stats(*by_user)
+    return [ad.pk for ad in ads]
@@ -0,0 +1,92 @@
+"""
+Per-user unread notification counter
+
+The number of unread notifications per user is kept in the cache and
+adjusted on every create, read and delete, so the bell badge never has
+to list or count notifications. A missing or evicted counter is rebuilt
+with one indexed COUNT on (user, is_read).
+
+Every change is pushed to the user's open event streams as an
+``unread_count`` event once it commits, so the badge updates without the
+client polling.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _key(user_id):
+    return f'unread_notifications:{user_id}'
+
+
+def _timeout():
+    return getattr(settings, 'NOTIFICATION_COUNT_CACHE_TTL', 3600)
+
+
+def unread_count(user_id):
+    """Cached number of unread notifications for a user"""
+    from .models import Notification
+
+    count = cache.get(_key(user_id))
+    if count is None:
+        count = Notification.objects.filter(user_id=user_id, is_read=False).count()
+        cache.add(_key(user_id), count, timeout=_timeout())
+    return count
+
+
+def _adjust(user_id, delta):
+    try:
+        value = cache.incr(_key(user_id), delta)
+    except ValueError:
+        # Not cached: the next read counts from the database
+        return
+    if value < 0:
+        cache.delete(_key(user_id))
+
+
+def _publish_counts(user_ids):
+    """Send each user's current count to their event streams"""
+    from .events import get_broker
+
+    broker = get_broker()
+    for user_id in user_ids:
+        broker.publish(user_id, {'type': 'unread_count', 'data': {'unread_count': unread_count(user_id)}})
+
+
+def adjust_unread(counts):
+    """
+    Apply ``{user_id: delta}`` once the current transaction commits.
+    Used directly by code that bulk-creates or bulk-updates notifications.
+    """
+    counts = {user_id: delta for user_id, delta in counts.items() if delta}
+    if not counts:
+        return
+
+    def apply():
+        for user_id, delta in counts.items():
+            _adjust(user_id, delta)
+        _publish_counts(counts)
+
+    transaction.on_commit(apply)
+
+
+def notifications_created(notifications):
+    """
+    Count and publish notifications saved with bulk_create, which sends
+    no signals
+    """
+    from .events import publish_notifications
+
+    adjust_unread(Counter(n.user_id for n in notifications if not n.is_read))
+    publish_notifications(notifications)
+
+
+def reset_unread(user_id):
+    """Everything is read now"""
+    def apply():
+        cache.set(_key(user_id), 0, timeout=_timeout())
+        _publish_counts([user_id])
+
+    transaction.on_commit(apply)
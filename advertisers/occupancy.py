@@ -0,0 +1,239 @@
+"""
+In-memory occupancy index for ad placements
+
+Each placement gets an interval tree of its confirmed/active bookings so
+availability and conflict checks are answered in O(log n + k) without
+querying the bookings table. A placement is available for a range while
+fewer than ``max_concurrent_ads`` bookings overlap on every day of it. Trees are built lazily from the database and
+dropped whenever a booking for the placement is saved or deleted. A
+per-placement version number in the shared cache lets other worker
+processes notice the change too.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+
+BLOCKING_STATUSES = ('confirmed', 'active')
+ONE_DAY = timedelta(days=1)
+
+
+def peak_concurrency(intervals, start, end):
+    """
+    Largest number of intervals covering any single day in [start, end].
+    ``intervals`` are (start, end) pairs of closed date ranges.
+    """
+    deltas = {}
+    for item_start, item_end in intervals:
+        item_start, item_end = max(item_start, start), min(item_end, end)
+        if item_start > item_end:
+            continue
+        deltas[item_start] = deltas.get(item_start, 0) + 1
+        deltas[item_end + ONE_DAY] = deltas.get(item_end + ONE_DAY, 0) - 1
+
+    peak = depth = 0
+    for day in sorted(deltas):
+        depth += deltas[day]
+        peak = max(peak, depth)
+    return peak
+
+
+class IntervalTree:
+    """
+    Static augmented interval tree over closed date ranges.
+
+    Intervals are sorted by start and laid out as an implicit balanced BST
+    (the middle element of each slice is the root). Each node stores the
+    largest end date in its subtree so non-overlapping subtrees are pruned.
+    ``capacity`` is how many intervals may overlap on one day.
+    """
+
+    def __init__(self, intervals=(), capacity=1):
+        # intervals: iterable of (start, end, key)
+        self.capacity = capacity
+        self._items = sorted(intervals, key=lambda item: (item[0], item[1]))
+        self._max_end = [None] * len(self._items)
+        self._build(0, len(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        max_end = self._items[mid][1]
+        for child in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child is not None and child > max_end:
+                max_end = child
+        self._max_end[mid] = max_end
+        return max_end
+
+    def overlapping(self, start, end):
+        """Keys of all intervals intersecting [start, end]"""
+        return [key for _, _, key in self._overlapping_items(start, end)]
+
+    def overlaps(self, start, end):
+        found = []
+        self._search(0, len(self._items), start, end, found, stop_at_first=True)
+        return bool(found)
+
+    def has_capacity(self, start, end, exclude=None):
+        """True if one more interval fits on every day of [start, end]"""
+        if self.capacity <= 1 and exclude is None:
+            return not self.overlaps(start, end)
+        hits = [
+            (item_start, item_end)
+            for item_start, item_end, key in self._overlapping_items(start, end)
+            if key != exclude
+        ]
+        return peak_concurrency(hits, start, end) < self.capacity
+
+    def free_windows(self, start, end, length, limit):
+        """
+        First ``limit`` gaps inside [start, end] with spare capacity on every
+        day that can hold ``length`` days, found in one sweep over the
+        start-sorted intervals. Each gap is returned as (gap_start, gap_end).
+        """
+        deltas = {}
+        for item_start, item_end, _ in self._items:
+            if item_start > end:
+                break
+            if item_end < start:
+                continue
+            item_start = max(item_start, start)
+            deltas[item_start] = deltas.get(item_start, 0) + 1
+            deltas[item_end + ONE_DAY] = deltas.get(item_end + ONE_DAY, 0) - 1
+
+        windows = []
+        depth = 0
+        free_from = start
+        for day in sorted(deltas):
+            if day > end:
+                break
+            new_depth = depth + deltas[day]
+            if depth < self.capacity <= new_depth:
+                # Free run ends the day before
+                if (day - free_from).days >= length:
+                    windows.append((free_from, day - ONE_DAY))
+                    if len(windows) >= limit:
+                        return windows
+            elif new_depth < self.capacity <= depth:
+                free_from = day
+            depth = new_depth
+
+        if depth < self.capacity and (end - free_from).days + 1 >= length:
+            windows.append((free_from, end))
+        return windows
+
+    def _overlapping_items(self, start, end):
+        found = []
+        self._search(0, len(self._items), start, end, found, stop_at_first=False)
+        return found
+
+    def _search(self, lo, hi, start, end, found, stop_at_first):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        if self._max_end[mid] < start:
+            return
+        self._search(lo, mid, start, end, found, stop_at_first)
+        if stop_at_first and found:
+            return
+        item = self._items[mid]
+        if item[0] > end:
+            # Everything to the right starts even later
+            return
+        if item[1] >= start:
+            found.append(item)
+            if stop_at_first:
+                return
+        self._search(mid + 1, hi, start, end, found, stop_at_first)
+
+
+class PlacementOccupancyIndex:
+    """
+    Process-local cache of one IntervalTree per placement
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._trees = {}
+        self._lock = threading.Lock()
+
+    def tree(self, placement_id):
+        return self.trees([placement_id])[placement_id]
+
+    def trees(self, placement_ids):
+        """Trees for several placements, building any stale ones in one query"""
+        versions = cache.get_many([_version_key(pid) for pid in placement_ids])
+        now = time.monotonic()
+        result, stale = {}, {}
+        with self._lock:
+            for placement_id in placement_ids:
+                version = versions.get(_version_key(placement_id), 0)
+                entry = self._trees.get(placement_id)
+                if entry and entry[1] == version and now - entry[2] < self.max_age:
+                    result[placement_id] = entry[0]
+                else:
+                    stale[placement_id] = version
+
+        if stale:
+            built = self._build(stale)
+            with self._lock:
+                for placement_id, version in stale.items():
+                    self._trees[placement_id] = (built[placement_id], version, now)
+            result.update(built)
+        return result
+
+    def conflicts(self, placement_id, start_date, end_date, exclude=None):
+        """IDs of blocking bookings overlapping the date range"""
+        return [
+            booking_id
+            for booking_id in self.tree(placement_id).overlapping(start_date, end_date)
+            if booking_id != exclude
+        ]
+
+    def is_available(self, placement_id, start_date, end_date, exclude=None):
+        """True if the placement has room for one more ad on every day"""
+        return self.tree(placement_id).has_capacity(start_date, end_date, exclude=exclude)
+
+    def invalidate(self, placement_id):
+        with self._lock:
+            self._trees.pop(placement_id, None)
+        try:
+            cache.incr(_version_key(placement_id))
+        except ValueError:
+            cache.set(_version_key(placement_id), time.time_ns() // 1000, timeout=None)
+
+    def clear(self):
+        with self._lock:
+            self._trees.clear()
+
+    def _build(self, placement_ids):
+        from .models import AdPlacement, Booking
+
+        capacities = dict(
+            AdPlacement.objects.filter(
+                id__in=list(placement_ids)
+            ).values_list('id', 'max_concurrent_ads')
+        )
+        intervals = {placement_id: [] for placement_id in placement_ids}
+        rows = Booking.objects.filter(
+            placement_id__in=list(placement_ids),
+            status__in=BLOCKING_STATUSES
+        ).values_list('placement_id', 'start_date', 'end_date', 'id')
+        for placement_id, start_date, end_date, booking_id in rows:
+            intervals[placement_id].append((start_date, end_date, booking_id))
+        return {
+            placement_id: IntervalTree(items, capacity=capacities.get(placement_id, 1))
+            for placement_id, items in intervals.items()
+        }
+
+
+def _version_key(placement_id):
+    return f'placement_occupancy_version:{placement_id}'
+
+
+occupancy_index = PlacementOccupancyIndex()
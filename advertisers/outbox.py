@@ -0,0 +1,139 @@
+"""
+Transactional email outbox
+
+Views call ``queue_email`` inside the transaction that makes the change, so
+an email exists exactly when the change commits and no request waits on
+SMTP. The ``send_outbox_emails`` worker claims due rows in batches and
+sends them over one reused mail connection. Failures are retried with
+exponential backoff up to EMAIL_OUTBOX_MAX_ATTEMPTS.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+def queue_email(subject, body, recipients, from_email=None):
+    """Add an email to the outbox. Returns None if there is nobody to send to."""
+    from .models import OutboxEmail
+
+    recipients = [recipient for recipient in recipients if recipient]
+    if not recipients:
+        return None
+    return OutboxEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        recipients=recipients
+    )
+
+
+def queue_emails(emails):
+    """Add many ``(subject, body, recipients)`` emails with one bulk insert"""
+    from .models import OutboxEmail
+
+    rows = [
+        OutboxEmail(
+            subject=subject,
+            body=body,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            recipients=[recipient for recipient in recipients if recipient]
+        )
+        for subject, body, recipients in emails
+    ]
+    return OutboxEmail.objects.bulk_create(
+        [row for row in rows if row.recipients], batch_size=500
+    )
+
+
+def retry_delay(attempts):
+    base = getattr(settings, 'EMAIL_OUTBOX_BACKOFF_SECONDS', 60)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 6 * 60 * 60))
+
+
+def claim_batch(batch_size):
+    """
+    Take up to ``batch_size`` due emails. Claimed rows are leased into the
+    future, so a concurrent worker skips them and a crashed worker's rows
+    come back once the lease runs out.
+    """
+    from .models import OutboxEmail
+
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'EMAIL_OUTBOX_LEASE_SECONDS', 300))
+    with transaction.atomic():
+        due = OutboxEmail.objects.filter(
+            status='pending', next_attempt_at__lte=now
+        ).order_by('next_attempt_at')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        batch = list(due[:batch_size])
+        OutboxEmail.objects.filter(
+            pk__in=[email.pk for email in batch]
+        ).update(next_attempt_at=now + lease)
+    return batch
+
+
+def _record_failure(email, error):
+    from .models import OutboxEmail
+
+    attempts = email.attempts + 1
+    max_attempts = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+    OutboxEmail.objects.filter(pk=email.pk).update(
+        attempts=attempts,
+        status='failed' if attempts >= max_attempts else 'pending',
+        next_attempt_at=timezone.now() + retry_delay(attempts),
+        last_error=str(error)[:1000]
+    )
+
+
+def deliver_pending(batch_size=100):
+    """Send one batch of due emails. Returns ``(sent, failed)``."""
+    from .models import OutboxEmail
+
+    batch = claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    mail = get_connection()
+    try:
+        mail.open()
+    except Exception as e:
+        print(f"⚠️ Mail server unavailable: {e}")
+        for email in batch:
+            _record_failure(email, e)
+        return 0, len(batch)
+
+    sent = failed = 0
+    try:
+        for email in batch:
+            message = EmailMessage(
+                email.subject, email.body, email.from_email, email.recipients,
+                connection=mail
+            )
+            try:
+                mail.send_messages([message])
+            except Exception as e:
+                _record_failure(email, e)
+                failed += 1
+                # The server may have dropped us; start a fresh connection
+                mail.close()
+                try:
+                    mail.open()
+                except Exception:
+                    pass
+                continue
+
+            OutboxEmail.objects.filter(pk=email.pk).update(
+                status='sent',
+                sent_at=timezone.now(),
+                attempts=F('attempts') + 1,
+                last_error=''
+            )
+            sent += 1
+    finally:
+        mail.close()
+    return sent, failed
@@ -0,0 +1,150 @@
+"""
+Pagination classes
+
+``KeysetPagination`` pages newest-first on a unique (created_at, id)
+ordering. The cursor holds the position of the last row shown, so every
+page is an index range scan with ``LIMIT page_size + 1``: no OFFSET and no
+COUNT(*), however far back the client scrolls. Views using it need a
+composite index on the ordering fields, led by any column they always
+filter on (e.g. ``user``).
+
+Requests that pass ``?ordering=`` or ``?search=`` fall back to page
+numbers, so sorting by other fields and ranked search results keep
+working on the views that allow them.
+
+``CappedCountPaginator`` is for admin changelists over very large tables,
+where Django's paginator would count every matching row.
+"""
+import base64
+import json
+from collections import OrderedDict
+from functools import cached_property
+
+from django.core.paginator import Paginator
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    ordering = ('created_at', 'id')
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    fallback_class = PageNumberPagination
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.fallback = None
+        if {api_settings.ORDERING_PARAM, api_settings.SEARCH_PARAM} & request.query_params.keys():
+            self.fallback = self.fallback_class()
+            return self.fallback.paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, queryset.model)
+
+        first, second = self.ordering
+        if reverse:
+            queryset = queryset.order_by(first, second)
+        else:
+            queryset = queryset.order_by(f'-{first}', f'-{second}')
+        if position is not None:
+            op = 'gt' if reverse else 'lt'
+            queryset = queryset.filter(
+                Q(**{f'{first}__{op}': position[0]})
+                | Q(**{first: position[0], f'{second}__{op}': position[1]})
+            )
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request, model):
+        """``((created_at, id), reverse)`` from the request, or ``(None, False)``"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position = tuple(
+                model._meta.get_field(name).to_python(value)
+                for name, value in zip(self.ordering, data['p'], strict=True)
+            )
+            return position, bool(data.get('r'))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def cursor_value(value):
+        # Full precision: DjangoJSONEncoder would cut datetimes to milliseconds
+        return value.isoformat() if hasattr(value, 'isoformat') else value
+
+    def encode_cursor(self, row, reverse):
+        data = {'p': [self.cursor_value(getattr(row, name)) for name in self.ordering]}
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data).encode())
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded.decode())
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class CappedCountPaginator(Paginator):
+    """
+    Counts at most ``count_cap`` rows, so an admin changelist over a huge
+    table costs a bounded scan. Rows past the cap are reached by filtering.
+    """
+    count_cap = 10000
+
+    @cached_property
+    def count(self):
+        return self.object_list[:self.count_cap].count()
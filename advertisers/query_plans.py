@@ -0,0 +1,44 @@
+"""
+Per-action queryset plans for viewsets
+
+Nested serializers read related rows for every object they render, so a
+plain queryset costs one query per row per relation. A viewset lists the
+joins, prefetches and annotations each action's serializer needs in
+``query_plans``; actions without an entry use the ``'default'`` plan.
+
+    query_plans = {
+        'list': QueryPlan(select_related=['user'], annotate={'reply_count': Count('replies')}),
+        'default': QueryPlan(select_related=['user__profile'], prefetch_related=['replies']),
+    }
+"""
+
+
+class QueryPlan:
+    """Joins, prefetches and annotations for one action"""
+
+    def __init__(self, select_related=(), prefetch_related=(), annotate=None):
+        self.select_related = list(select_related)
+        self.prefetch_related = list(prefetch_related)
+        self.annotate = annotate or {}
+
+    def apply(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        if self.annotate:
+            queryset = queryset.annotate(**self.annotate)
+        return queryset
+
+
+class QueryPlanMixin:
+    """Applies the current action's QueryPlan in ``get_queryset``"""
+    query_plans = {}
+
+    def get_query_plan(self):
+        return self.query_plans.get(self.action) or self.query_plans.get('default')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        plan = self.get_query_plan()
+        return plan.apply(queryset) if plan else queryset
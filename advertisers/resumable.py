@@ -0,0 +1,122 @@
+"""
+Resumable chunked uploads
+
+A client opens an UploadSession, PUTs the file in chunks at explicit byte
+offsets and finalizes it. Each chunk is copied from the request stream to
+a temp file in small reads, so nothing is buffered in memory and
+FILE_UPLOAD_MAX_MEMORY_SIZE / DATA_UPLOAD_MAX_MEMORY_SIZE do not apply.
+After a dropped connection the client asks for the current offset and
+continues from there.
+"""
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+READ_SIZE = 64 * 1024
+
+
+class OffsetMismatch(Exception):
+    """The chunk does not start where the session currently ends"""
+
+    def __init__(self, expected):
+        super().__init__(f'Expected offset {expected}')
+        self.expected = expected
+
+
+class ChunkTooLarge(Exception):
+    """The chunk would go past the declared size or the chunk size limit"""
+
+
+def session_path(session):
+    return os.path.join(settings.RESUMABLE_UPLOAD_ROOT, f'{session.pk}.part')
+
+
+def write_chunk(session, stream, offset, length):
+    """
+    Copy ``length`` bytes from ``stream`` into the session file at
+    ``offset``. Returns the new offset.
+    """
+    from .models import UploadSession
+
+    if offset != session.received_bytes:
+        raise OffsetMismatch(session.received_bytes)
+    if length > settings.RESUMABLE_UPLOAD_CHUNK_SIZE or offset + length > session.total_size:
+        raise ChunkTooLarge(
+            f'Chunks may be at most {settings.RESUMABLE_UPLOAD_CHUNK_SIZE} bytes '
+            f'and must not go past {session.total_size} bytes.'
+        )
+
+    path = session_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Stage the body in a private file: the network read is slow, and a
+    # racing duplicate chunk must not touch the session file
+    with tempfile.TemporaryFile(dir=os.path.dirname(path)) as staged:
+        written = 0
+        while written < length:
+            data = stream.read(min(READ_SIZE, length - written))
+            if not data:
+                break
+            staged.write(data)
+            written += len(data)
+        staged.seek(0)
+
+        with transaction.atomic():
+            # Locks the session row until commit; a racing chunk at the same
+            # offset waits here, then finds the offset moved and loses
+            updated = UploadSession.objects.filter(
+                pk=session.pk, received_bytes=offset, status='uploading'
+            ).update(received_bytes=offset + written, updated_at=timezone.now())
+            if not updated:
+                session.refresh_from_db(fields=['received_bytes'])
+                raise OffsetMismatch(session.received_bytes)
+            with open(path, 'r+b' if os.path.exists(path) else 'wb') as destination:
+                destination.seek(offset)
+                shutil.copyfileobj(staged, destination, READ_SIZE)
+                # A short or interrupted body leaves only what actually arrived
+                destination.truncate(offset + written)
+
+    session.received_bytes = offset + written
+    return session.received_bytes
+
+
+class SessionFile(File):
+    """
+    The assembled session file, presented like a Django upload. Exposing
+    ``temporary_file_path`` lets storage move it instead of copying it.
+    """
+
+    def __init__(self, session):
+        super().__init__(open(session_path(session), 'rb'), name=session.original_filename)
+        self.content_type = session.file_type
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def discard(session):
+    """Delete a session and whatever part of its file is left"""
+    try:
+        os.remove(session_path(session))
+    except FileNotFoundError:
+        pass
+    session.delete()
+
+
+def expire_sessions(max_age=None):
+    """Discard sessions idle for longer than ``max_age``. Returns the count."""
+    from .models import UploadSession
+
+    if max_age is None:
+        max_age = timedelta(hours=settings.RESUMABLE_UPLOAD_EXPIRY_HOURS)
+    stale = UploadSession.objects.filter(updated_at__lt=timezone.now() - max_age)
+    count = 0
+    for session in stale.iterator():
+        discard(session)
+        count += 1
+    return count
@@ -0,0 +1,288 @@
+"""
+Daily analytics rollups
+
+Raw Analytics rows older than the watermark are folded into
+AnalyticsDailyRollup by the ``rollup_analytics`` management command.
+Statistics read the rollups and merge in the raw tail since the watermark,
+so their cost depends on the number of days an ad has run rather than the
+number of events it has received.
+
+Unique reach is folded the same way into AnalyticsReachSketch: one
+HyperLogLog sketch of impression visitors (IP plus user agent) per ad and
+day, overall and per country. The reach of any date range is the merge
+of its daily sketches and the raw tail.
+"""
+from collections import defaultdict
+from datetime import datetime, time
+
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .hll import HyperLogLog
+from .models import Analytics, AnalyticsDailyRollup, AnalyticsReachSketch, RollupWatermark
+
+DAILY_ROLLUP = 'analytics_daily'
+
+
+def start_of_today():
+    today = timezone.localdate()
+    return timezone.make_aware(datetime.combine(today, time.min))
+
+
+def get_watermark(name=DAILY_ROLLUP):
+    watermark = RollupWatermark.objects.filter(name=name).first()
+    return watermark.processed_until if watermark else None
+
+
+def merge_rollup_rows(model, rows, key_fields, update_fields, combine):
+    """
+    Insert per-(ad, day) rollup rows, folding each into the stored row with
+    the same key if there is one: ``combine(stored, new)`` updates
+    ``stored`` in place. Callers hold the watermark lock, so this
+    read-modify-write needs no upsert, which MySQL cannot aim at a unique
+    constraint.
+    """
+    if not rows:
+        return
+
+    def key(row):
+        return tuple(getattr(row, field) for field in key_fields)
+
+    stored = {
+        key(row): row
+        for row in model.objects.filter(
+            ad_id__in={row.ad_id for row in rows}, day__in={row.day for row in rows}
+        )
+    }
+    created, updated = [], []
+    for row in rows:
+        current = stored.get(key(row))
+        if current is None:
+            created.append(row)
+        else:
+            combine(current, row)
+            updated.append(current)
+    model.objects.bulk_create(created, batch_size=500)
+    model.objects.bulk_update(updated, update_fields, batch_size=500)
+
+
+def _add_counts(stored, row):
+    stored.count += row.count
+
+
+def fold_daily_rollups(cutoff=None):
+    """
+    Fold raw events between the watermark and ``cutoff`` (default: start of
+    today) into the daily rollup table. Counts for a day that is already
+    partly folded are added to its rows. Returns the number of rollup rows
+    written.
+    """
+    cutoff = cutoff or start_of_today()
+
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.get_or_create(name=DAILY_ROLLUP)
+        watermark = RollupWatermark.objects.select_for_update().get(pk=watermark.pk)
+
+        if watermark.processed_until and watermark.processed_until >= cutoff:
+            return 0
+
+        events = Analytics.objects.filter(event_timestamp__lt=cutoff)
+        if watermark.processed_until:
+            events = events.filter(event_timestamp__gte=watermark.processed_until)
+
+        grouped = events.annotate(day=TruncDate('event_timestamp')).values(
+            'ad_id', 'day', 'event_type', 'device_type', 'country'
+        ).annotate(count=Count('id')).order_by()
+
+        # Nulls never collide in a unique constraint, so store them as ''
+        totals = defaultdict(int)
+        for row in grouped:
+            key = (
+                row['ad_id'], row['day'], row['event_type'],
+                row['device_type'] or '', row['country'] or ''
+            )
+            totals[key] += row['count']
+
+        rows = [
+            AnalyticsDailyRollup(
+                ad_id=ad_id, day=day, event_type=event_type,
+                device_type=device_type, country=country, count=count
+            )
+            for (ad_id, day, event_type, device_type, country), count in totals.items()
+        ]
+        merge_rollup_rows(
+            AnalyticsDailyRollup, rows,
+            key_fields=['ad_id', 'day', 'event_type', 'device_type', 'country'],
+            update_fields=['count'], combine=_add_counts,
+        )
+
+        fold_reach_sketches(events)
+
+        watermark.processed_until = cutoff
+        watermark.save(update_fields=['processed_until', 'updated_at'])
+
+    return len(rows)
+
+
+def visitor_key(ip_address, user_agent):
+    return f'{ip_address or ""}|{user_agent or ""}'
+
+
+def _reach_sketches(events):
+    """``{(ad_id, day, country): HyperLogLog}`` of impression visitors in ``events``"""
+    sketches = defaultdict(HyperLogLog)
+    rows = events.filter(event_type='impression').annotate(
+        day=TruncDate('event_timestamp')
+    ).values_list('ad_id', 'day', 'country', 'ip_address', 'user_agent__user_agent').distinct().order_by()
+    for ad_id, day, country, ip_address, user_agent in rows.iterator(chunk_size=5000):
+        visitor = visitor_key(ip_address, user_agent)
+        sketches[ad_id, day, ''].add(visitor)
+        if country:
+            sketches[ad_id, day, country].add(visitor)
+    return sketches
+
+
+def _merge_sketches(stored, row):
+    sketch = HyperLogLog.from_bytes(stored.sketch).merge(HyperLogLog.from_bytes(row.sketch))
+    stored.sketch = sketch.to_bytes()
+
+
+def fold_reach_sketches(events):
+    """Merge the visitors of ``events`` into the stored daily sketches"""
+    sketches = _reach_sketches(events)
+    merge_rollup_rows(
+        AnalyticsReachSketch,
+        [
+            AnalyticsReachSketch(ad_id=ad_id, day=day, country=country, sketch=sketch.to_bytes())
+            for (ad_id, day, country), sketch in sketches.items()
+        ],
+        key_fields=['ad_id', 'day', 'country'],
+        update_fields=['sketch'], combine=_merge_sketches,
+    )
+    return len(sketches)
+
+
+def rebuild_reach_sketches():
+    """
+    Re-sketch every raw event before the watermark, e.g. for days folded
+    before reach was tracked. Returns the number of sketches written.
+    """
+    with transaction.atomic():
+        watermark = RollupWatermark.objects.select_for_update().filter(name=DAILY_ROLLUP).first()
+        if not watermark or not watermark.processed_until:
+            return 0
+        AnalyticsReachSketch.objects.all().delete()
+        return fold_reach_sketches(
+            Analytics.objects.filter(event_timestamp__lt=watermark.processed_until)
+        )
+
+
+def ad_reach(ad, start_date=None, end_date=None, watermark=None):
+    """
+    Estimated unique visitors of an ad between two dates (inclusive, open
+    ended if None): overall, per day and for the top countries
+    """
+    days = defaultdict(HyperLogLog)
+    countries = defaultdict(HyperLogLog)
+
+    def add(day, country, sketch):
+        (countries[country] if country else days[day]).merge(sketch)
+
+    if watermark:
+        sketches = AnalyticsReachSketch.objects.filter(
+            ad=ad, day__lt=timezone.localdate(watermark)
+        )
+        if start_date:
+            sketches = sketches.filter(day__gte=start_date)
+        if end_date:
+            sketches = sketches.filter(day__lte=end_date)
+        for day, country, data in sketches.values_list('day', 'country', 'sketch'):
+            add(day, country, HyperLogLog.from_bytes(data))
+
+    tail = Analytics.objects.filter(ad=ad)
+    if watermark:
+        tail = tail.filter(event_timestamp__gte=watermark)
+    if start_date:
+        tail = tail.filter(event_timestamp__date__gte=start_date)
+    if end_date:
+        tail = tail.filter(event_timestamp__date__lte=end_date)
+    for (_, day, country), sketch in _reach_sketches(tail).items():
+        add(day, country, sketch)
+
+    by_country = sorted(
+        ((country, sketch.count()) for country, sketch in countries.items()),
+        key=lambda item: item[1], reverse=True
+    )
+    return {
+        'unique_visitors': HyperLogLog.union(days.values()).count(),
+        'unique_visitors_by_date': [
+            {'date': day, 'count': sketch.count()} for day, sketch in sorted(days.items())
+        ],
+        'reach_by_country': [
+            {'country': country, 'unique_visitors': count} for country, count in by_country[:10]
+        ],
+    }
+
+
+def ad_statistics(ad, start_date=None, end_date=None):
+    """
+    Impressions/clicks by date, device and country breakdowns and unique
+    reach for an ad, built from the daily rollups and sketches and the raw
+    events since the watermark. Dates are inclusive; None leaves that end
+    of the range open.
+    """
+    by_date = {'impression': defaultdict(int), 'click': defaultdict(int)}
+    devices = defaultdict(int)
+    countries = defaultdict(int)
+
+    def add(day, event_type, device_type, country, count):
+        if event_type in by_date:
+            by_date[event_type][day] += count
+        devices[device_type or None] += count
+        countries[country or None] += count
+
+    watermark = get_watermark()
+
+    if watermark:
+        rollups = AnalyticsDailyRollup.objects.filter(
+            ad=ad, day__lt=timezone.localdate(watermark)
+        )
+        if start_date:
+            rollups = rollups.filter(day__gte=start_date)
+        if end_date:
+            rollups = rollups.filter(day__lte=end_date)
+        for row in rollups.values_list('day', 'event_type', 'device_type', 'country', 'count'):
+            add(*row)
+
+    tail = Analytics.objects.filter(ad=ad)
+    if watermark:
+        tail = tail.filter(event_timestamp__gte=watermark)
+    if start_date:
+        tail = tail.filter(event_timestamp__date__gte=start_date)
+    if end_date:
+        tail = tail.filter(event_timestamp__date__lte=end_date)
+    tail = tail.annotate(day=TruncDate('event_timestamp')).values_list(
+        'day', 'event_type', 'device_type', 'country'
+    ).annotate(count=Count('id')).order_by()
+    for row in tail:
+        add(*row)
+
+    def series(counts):
+        return [
+            {'event_timestamp__date': day, 'count': count}
+            for day, count in sorted(counts.items())
+        ]
+
+    def breakdown(counts, field, limit=None):
+        items = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+        return [{field: key, 'count': count} for key, count in items[:limit]]
+
+    return {
+        'impressions_by_date': series(by_date['impression']),
+        'clicks_by_date': series(by_date['click']),
+        'device_breakdown': breakdown(devices, 'device_type'),
+        'country_breakdown': breakdown(countries, 'country', limit=10),
+        **ad_reach(ad, start_date, end_date, watermark),
+    }
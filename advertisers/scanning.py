@@ -0,0 +1,251 @@
+"""
+Background virus scanning for uploaded files
+
+Uploads are saved with ``virus_scan_status='pending'`` and handed to a
+bounded pool of worker threads. Each worker keeps one clamd connection open
+in an IDSESSION and streams files through INSTREAM, so a scan costs no
+connection setup and never runs inside the upload request. Infected files
+are moved to QUARANTINE_ROOT after the fact.
+"""
+import os
+import queue
+import shutil
+import socket
+import struct
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ClamdError(Exception):
+    """clamd could not be reached or returned an unexpected reply"""
+
+
+class ClamdSession:
+    """
+    One persistent clamd connection using the IDSESSION protocol
+    """
+
+    def __init__(self, socket_path=None, host=None, port=None, timeout=None):
+        self.socket_path = socket_path
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._sock = None
+        self._buffer = b''
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            socket_path=getattr(settings, 'CLAMD_SOCKET', '/var/run/clamav/clamd.ctl'),
+            host=getattr(settings, 'CLAMD_HOST', None),
+            port=getattr(settings, 'CLAMD_PORT', 3310),
+            timeout=getattr(settings, 'CLAMD_TIMEOUT', 60),
+        )
+
+    def connect(self):
+        try:
+            if self.host:
+                sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            else:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+            sock.sendall(b'zIDSESSION\0')
+        except OSError as e:
+            raise ClamdError(f'Cannot connect to clamd: {e}')
+        self._sock = sock
+        self._buffer = b''
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.sendall(b'zEND\0')
+            except OSError:
+                pass
+            self._sock.close()
+            self._sock = None
+
+    def scan_file(self, path):
+        """
+        Stream a file to clamd. Returns ('clean'|'infected', threat_or_None).
+        Reconnects once if the session was dropped.
+        """
+        for attempt in range(2):
+            if self._sock is None:
+                self.connect()
+            try:
+                with open(path, 'rb') as f:
+                    return self._instream(f)
+            except (OSError, ClamdError):
+                self.close()
+                if attempt:
+                    raise
+        raise ClamdError('unreachable')
+
+    def _instream(self, fileobj):
+        try:
+            self._sock.sendall(b'zINSTREAM\0')
+            for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+                self._sock.sendall(struct.pack('!L', len(chunk)) + chunk)
+            self._sock.sendall(struct.pack('!L', 0))
+            reply = self._read_reply()
+        except OSError as e:
+            raise ClamdError(f'clamd connection failed: {e}')
+
+        # Session replies look like "<id>: stream: OK" or "<id>: stream: <name> FOUND"
+        result = reply.split(': ', 1)[-1]
+        if result.endswith('FOUND'):
+            return ('infected', result[len('stream: '):-len(' FOUND')].strip())
+        if result.endswith('OK'):
+            return ('clean', None)
+        raise ClamdError(f'Unexpected clamd reply: {reply}')
+
+    def _read_reply(self):
+        while b'\0' not in self._buffer:
+            data = self._sock.recv(4096)
+            if not data:
+                raise ClamdError('clamd closed the connection')
+            self._buffer += data
+        reply, self._buffer = self._buffer.split(b'\0', 1)
+        return reply.decode('utf-8', 'replace')
+
+
+def quarantine_file(uploaded_file):
+    """Move an infected upload out of MEDIA_ROOT so it is no longer served"""
+    source = os.path.join(settings.MEDIA_ROOT, 'uploads', uploaded_file.stored_filename)
+    quarantine_dir = getattr(settings, 'QUARANTINE_ROOT', os.path.join(settings.BASE_DIR, 'quarantine'))
+    os.makedirs(quarantine_dir, exist_ok=True)
+    if os.path.exists(source):
+        shutil.move(source, os.path.join(quarantine_dir, os.path.basename(uploaded_file.stored_filename)))
+    uploaded_file.file_path = ''
+
+
+def scan_uploaded_file(file_id, session):
+    """
+    Scan one UploadedFile with the given session and record the result.
+    The result is shared with every other upload of the same stored blob.
+    """
+    from .models import Notification, UploadedFile
+    from .notifications import notifications_created
+    from .storage import share_results
+
+    uploaded_file = UploadedFile.objects.filter(pk=file_id).first()
+    if uploaded_file is None or uploaded_file.virus_scan_status != 'pending':
+        return None
+
+    path = os.path.join(settings.MEDIA_ROOT, 'uploads', uploaded_file.stored_filename)
+    try:
+        scan_status, threat = session.scan_file(path)
+    except (ClamdError, OSError) as e:
+        print(f"⚠️ WARNING: Virus scan failed: {e}")
+        scan_status, threat = 'failed', None
+
+    uploaded_file.virus_scan_status = scan_status
+    uploaded_file.virus_scan_date = timezone.now()
+    update_fields = ['virus_scan_status', 'virus_scan_date']
+
+    affected = [uploaded_file]
+    if uploaded_file.blob_id:
+        affected += UploadedFile.objects.filter(
+            blob_id=uploaded_file.blob_id, virus_scan_status='pending'
+        ).exclude(pk=uploaded_file.pk)
+
+    if scan_status == 'infected':
+        print(f"❌ File infected: {threat}")
+        quarantine_file(uploaded_file)
+        update_fields.append('file_path')
+        notifications_created(Notification.objects.bulk_create([
+            Notification(
+                user_id=infected.user_id,
+                title='File Rejected',
+                message=f'"{infected.original_filename}" was removed because it contains malware ({threat}).',
+                notification_type='file_infected',
+                related_ad_id=infected.ad_id
+            )
+            for infected in affected
+        ]))
+
+    if uploaded_file.blob_id:
+        share_results(uploaded_file.blob_id, **{
+            field: getattr(uploaded_file, field) for field in update_fields
+        })
+    else:
+        uploaded_file.save(update_fields=update_fields)
+
+    if scan_status != 'infected':
+        from .imaging import image_pipeline
+        image_pipeline.submit(uploaded_file.id)
+    return scan_status
+
+
+class ScanWorkerPool:
+    """
+    Bounded queue of file IDs drained by a fixed number of scan threads
+    """
+
+    def __init__(self, workers=None, max_queue=None):
+        self.workers = workers or getattr(settings, 'VIRUS_SCAN_WORKERS', 2)
+        self.max_queue = max_queue or getattr(settings, 'VIRUS_SCAN_QUEUE_SIZE', 100)
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, file_id):
+        """
+        Queue a file for scanning once the current transaction commits.
+        Files that do not fit in the queue stay pending for scan_pending_files.
+        """
+        def enqueue():
+            self._ensure_workers()
+            try:
+                self._queue.put_nowait(file_id)
+            except queue.Full:
+                print(f"⚠️ Scan queue full; file {file_id} left pending")
+
+        transaction.on_commit(enqueue)
+
+    def join(self):
+        """Block until every queued file has been scanned"""
+        self._queue.join()
+
+    def _ensure_workers(self):
+        # Threads do not survive a fork, so start them per process
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._threads = [
+                threading.Thread(target=self._run, name=f'virus-scan-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def _run(self):
+        session = None
+        work = self._queue
+        while True:
+            file_id = work.get()
+            if session is None or not session.connected:
+                session = ClamdSession.from_settings()
+            try:
+                scan_uploaded_file(file_id, session)
+            except Exception as e:
+                print(f"⚠️ Scan of file {file_id} crashed: {e}")
+            finally:
+                connection.close()
+                work.task_done()
+
+
+scan_pool = ScanWorkerPool()
@@ -0,0 +1,261 @@
+"""
+Full-text search for ads, FAQs and case studies
+
+Every query term is prefix-matched and all terms must match. Results are
+ranked with title-like fields weighted above body text. The work is done
+by one of three backends, picked from the database vendor unless
+SEARCH_BACKEND names one:
+
+* ``PostgresSearchBackend``: ``to_tsvector`` matched against a GIN
+  expression index built from the same SearchVector.
+* ``MySQLSearchBackend``: ``MATCH ... AGAINST`` in boolean mode over a
+  FULLTEXT index.
+* ``IndexedSearchBackend``: a portable inverted index in the
+  ``search_terms`` table, one row per (document, term). Rows are kept in
+  step by save/delete signals and rebuilt with ``rebuild_search_index``.
+
+The native indexes are created by migration 0014 on their own vendor only.
+"""
+import math
+import re
+from collections import Counter
+from functools import reduce
+from operator import add, or_
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, FloatField, Func, IntegerField, Max, OuterRef, Q, Subquery, Sum, When
+from django.utils.html import strip_tags
+from django.utils.module_loading import import_string
+from rest_framework import filters
+
+# Text search configuration; must match the GIN indexes in migration 0014
+SEARCH_CONFIG = 'english'
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+
+STOP_WORDS = frozenset("""
+    a an and are as at be but by for from has have in is it its of on or
+    that the this to was were will with
+""".split())
+
+_WORD = re.compile(r'\w+')
+
+
+class SearchSpec:
+    """Searchable fields of one model, with relative weights 1-3"""
+
+    def __init__(self, document_type, fields):
+        self.document_type = document_type
+        self.fields = fields
+
+
+SEARCH_SPECS = {
+    'advertisers.ad': SearchSpec('ad', {'title': 3, 'short_description': 1}),
+    'advertisers.faq': SearchSpec('faq', {'question': 3, 'answer': 1}),
+    'advertisers.casestudy': SearchSpec('casestudy', {'title': 3, 'company_name': 2, 'summary': 1}),
+}
+
+
+def get_spec(model):
+    return SEARCH_SPECS.get(model._meta.label_lower)
+
+
+def tokenize(text):
+    """Lowercased words of plain or HTML text, without stop words"""
+    words = _WORD.findall(strip_tags(text or '').lower())
+    return [word[:MAX_TERM_LENGTH] for word in words if len(word) > 1 and word not in STOP_WORDS]
+
+
+def query_terms(query):
+    """Distinct search terms of a user query, in order"""
+    return list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+
+
+def document_terms(instance, spec):
+    """``{term: weight}``: field weight times a damped term frequency"""
+    weights = Counter()
+    for field, field_weight in spec.fields.items():
+        for term, count in Counter(tokenize(getattr(instance, field))).items():
+            weights[term] += field_weight * (1 + math.log(count))
+    return weights
+
+
+def prefix_q(field, prefix):
+    # A range rather than LIKE 'x%' so every database can use the index
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + '\U0010ffff'})
+
+
+class IndexedSearchBackend:
+    """Inverted index in the search_terms table; works on any database"""
+    maintains_index = True
+
+    def search(self, queryset, spec, terms):
+        from .models import SearchTerm
+
+        postings = SearchTerm.objects.filter(document_type=spec.document_type).filter(
+            reduce(or_, (prefix_q('term', term) for term in terms))
+        )
+        # Every query term has to match at least one indexed term
+        matched = reduce(add, (
+            Max(Case(When(prefix_q('term', term), then=1), default=0, output_field=IntegerField()))
+            for term in terms
+        ))
+        documents = postings.values('object_id').annotate(
+            rank=Sum('weight'), matched=matched
+        ).filter(matched=len(terms))
+
+        return queryset.filter(
+            pk__in=documents.values('object_id')
+        ).annotate(search_rank=Subquery(
+            documents.filter(object_id=OuterRef('pk')).values('rank'),
+            output_field=FloatField()
+        ))
+
+    def index(self, instance, spec):
+        """Bring one document's postings up to date, writing only what changed"""
+        from .models import SearchTerm
+
+        weights = document_terms(instance, spec)
+        postings = SearchTerm.objects.filter(document_type=spec.document_type, object_id=instance.pk)
+        existing = dict(postings.values_list('term', 'weight'))
+        stale = [term for term, weight in existing.items() if not math.isclose(weights.get(term, 0), weight)]
+        fresh = [term for term, weight in weights.items() if not math.isclose(existing.get(term, 0), weight)]
+        if not stale and not fresh:
+            return
+
+        with transaction.atomic():
+            if stale:
+                postings.filter(term__in=stale).delete()
+            SearchTerm.objects.bulk_create([
+                SearchTerm(
+                    document_type=spec.document_type, object_id=instance.pk,
+                    term=term, weight=weights[term]
+                )
+                for term in fresh
+            ], batch_size=500)
+
+    def remove(self, instance, spec):
+        from .models import SearchTerm
+
+        SearchTerm.objects.filter(document_type=spec.document_type, object_id=instance.pk).delete()
+
+    def rebuild(self, model, spec, chunk_size=1000):
+        """Re-index every row of a model. Returns the number of documents."""
+        from .models import SearchTerm
+
+        SearchTerm.objects.filter(document_type=spec.document_type).delete()
+        count = 0
+        batch = []
+        for instance in model._default_manager.only('pk', *spec.fields).iterator(chunk_size=chunk_size):
+            batch.extend(
+                SearchTerm(
+                    document_type=spec.document_type, object_id=instance.pk,
+                    term=term, weight=weight
+                )
+                for term, weight in document_terms(instance, spec).items()
+            )
+            count += 1
+            if len(batch) >= 5000:
+                SearchTerm.objects.bulk_create(batch, batch_size=1000)
+                batch = []
+        SearchTerm.objects.bulk_create(batch, batch_size=1000)
+        return count
+
+
+class PostgresSearchBackend:
+    """tsvector search backed by GIN expression indexes"""
+    maintains_index = False
+    weight_labels = {3: 'A', 2: 'B', 1: 'C'}
+
+    def search(self, queryset, spec, terms):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        # Same expression as the GIN index, so the planner can use it
+        document = SearchVector(*spec.fields, config=SEARCH_CONFIG)
+        weighted = reduce(add, (
+            SearchVector(field, weight=self.weight_labels[weight], config=SEARCH_CONFIG)
+            for field, weight in spec.fields.items()
+        ))
+        query = SearchQuery(
+            ' & '.join(f'{term}:*' for term in terms), search_type='raw', config=SEARCH_CONFIG
+        )
+        return queryset.annotate(search_document=document).filter(
+            search_document=query
+        ).annotate(search_rank=SearchRank(weighted, query))
+
+
+class MatchAgainst(Func):
+    """MySQL ``MATCH (columns) AGAINST (query IN BOOLEAN MODE)`` relevance"""
+    template = 'MATCH (%(expressions)s) AGAINST (%%s IN BOOLEAN MODE)'
+    output_field = FloatField()
+
+    def __init__(self, *fields, query):
+        super().__init__(*fields)
+        self.query = query
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = super().as_sql(compiler, connection, **extra_context)
+        return sql, (*params, self.query)
+
+
+class MySQLSearchBackend:
+    """FULLTEXT search in boolean mode"""
+    maintains_index = False
+
+    def search(self, queryset, spec, terms):
+        # Column list must match the FULLTEXT index exactly
+        relevance = MatchAgainst(*spec.fields, query=' '.join(f'+{term}*' for term in terms))
+        return queryset.annotate(search_rank=relevance).filter(search_rank__gt=0)
+
+
+VENDOR_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'mysql': MySQLSearchBackend,
+}
+
+
+def get_backend():
+    path = getattr(settings, 'SEARCH_BACKEND', '')
+    if path:
+        return import_string(path)()
+    return VENDOR_BACKENDS.get(connection.vendor, IndexedSearchBackend)()
+
+
+def search(queryset, query):
+    """
+    Rows of ``queryset`` matching ``query``, best first, annotated with
+    ``search_rank``. Returns None when the query has no usable terms.
+    """
+    spec = get_spec(queryset.model)
+    terms = query_terms(query)
+    if spec is None or not terms:
+        return None
+    return get_backend().search(queryset, spec, terms).order_by('-search_rank', '-pk')
+
+
+def index_document(instance, update_fields=None):
+    spec = get_spec(type(instance))
+    if spec is None or (update_fields is not None and not set(update_fields) & set(spec.fields)):
+        return
+    backend = get_backend()
+    if backend.maintains_index:
+        backend.index(instance, spec)
+
+
+def remove_document(instance):
+    spec = get_spec(type(instance))
+    backend = get_backend()
+    if spec is not None and backend.maintains_index:
+        backend.remove(instance, spec)
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    ``?search=`` through the full-text backend instead of ``icontains``.
+    Results come best match first unless ``?ordering=`` is given.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        results = search(queryset, request.query_params.get(self.search_param, ''))
+        return queryset if results is None else results
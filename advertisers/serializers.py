@@ -1,15 +1,18 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import (
     # Your existing imports...
     PricingPackage, AdPlacement, Ad, UploadedFile,
     Booking, Analytics, Message, MessageReply,
-    Notification, AuditLog,
+    Notification, AuditLog, UploadSession,
     # ADD THESE NEW ONES:
     PlatformBenefit, FAQ, Testimonial, CaseStudy,
     PricingFeature, EnhancedPricingPackage, PackageFeature,
     PromotionalBanner, PlatformStatistic
 )
 from accounts.serializers import UserSerializer
+from .allocator import PlacementFullError, allocate_booking, update_booking
+from .occupancy import occupancy_index
 
 
 class PricingPackageSerializer(serializers.ModelSerializer):
@@ -40,11 +43,32 @@ class UploadedFileSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = [
             'id', 'user', 'stored_filename', 'file_path', 'file_type',  # ← ADD file_type HERE
-            'file_size_kb', 'width', 'height', 'thumbnail_path',
+            'file_size_kb', 'width', 'height', 'thumbnail_path', 'variants',
             'virus_scan_status', 'virus_scan_date', 'created_at'
         ]
 
 
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Serializer for resumable upload sessions"""
+    ad = serializers.PrimaryKeyRelatedField(required=False, allow_null=True, queryset=Ad.objects.all())
+    
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'ad', 'original_filename', 'file_type',
+            'total_size', 'received_bytes', 'status', 'created_at'
+        ]
+        read_only_fields = ['id', 'received_bytes', 'status', 'created_at']
+    
+    def validate_total_size(self, value):
+        limit = settings.RESUMABLE_UPLOAD_MAX_SIZE
+        if value <= 0:
+            raise serializers.ValidationError("File is empty.")
+        if value > limit:
+            raise serializers.ValidationError(f"Files may be at most {limit // (1024 * 1024)} MB.")
+        return value
+
+
 class AdSerializer(serializers.ModelSerializer):
     """Serializer for ads"""
     user = UserSerializer(read_only=True)
@@ -76,6 +100,7 @@ class AdListSerializer(serializers.ModelSerializer):
     """Lightweight serializer for ad listings"""
     user_name = serializers.CharField(source='user.username', read_only=True)
     company_name = serializers.CharField(source='user.company_name', read_only=True)
+    thumbnail_path = serializers.SerializerMethodField()
     
     class Meta:
         model = Ad
@@ -83,8 +108,16 @@ class AdListSerializer(serializers.ModelSerializer):
             'id', 'title', 'short_description', 'status',
             'start_date', 'end_date', 'total_clicks',
             'total_impressions', 'is_featured', 'user_name',
-            'company_name', 'created_at'
+            'company_name', 'thumbnail_path', 'created_at'
         ]
+    
+    def get_thumbnail_path(self, obj):
+        # Primary image first; uses prefetched files when available
+        files = sorted(obj.files.all(), key=lambda f: not f.is_primary)
+        for uploaded_file in files:
+            if uploaded_file.thumbnail_path:
+                return uploaded_file.thumbnail_path
+        return None
 
 
 class BookingSerializer(serializers.ModelSerializer):
@@ -115,21 +148,16 @@ class BookingSerializer(serializers.ModelSerializer):
             
             # Check for booking conflicts
             placement_id = attrs.get('placement_id')
+            if placement_id is None and self.instance:
+                placement_id = self.instance.placement_id
             start_date = attrs['start_date']
             end_date = attrs['end_date']
             
-            conflicts = Booking.objects.filter(
-                placement_id=placement_id,
-                status__in=['confirmed', 'active'],
-                start_date__lte=end_date,
-                end_date__gte=start_date
-            )
-            
             # Exclude current booking if updating
-            if self.instance:
-                conflicts = conflicts.exclude(pk=self.instance.pk)
+            exclude = self.instance.pk if self.instance else None
             
-            if conflicts.exists():
+            # Fast pre-check; the allocator re-checks under lock on save
+            if not occupancy_index.is_available(placement_id, start_date, end_date, exclude=exclude):
                 raise serializers.ValidationError({
                     "dates": "This placement is already booked for the selected dates."
                 })
@@ -143,19 +171,72 @@ class BookingSerializer(serializers.ModelSerializer):
         
         # Get objects
         ad = Ad.objects.get(id=ad_id)
-        placement = AdPlacement.objects.get(id=placement_id)
-        
-        # Set price per day from placement
-        validated_data['price_per_day'] = placement.base_price_per_day
         
-        # Create booking
-        booking = Booking.objects.create(
-            ad=ad,
-            placement=placement,
-            **validated_data
-        )
-        
-        return booking
+        # Create booking under the placement lock; price per day comes from the placement
+        try:
+            return allocate_booking(
+                placement_id,
+                validated_data.pop('start_date'),
+                validated_data.pop('end_date'),
+                ad=ad,
+                **validated_data
+            )
+        except AdPlacement.DoesNotExist:
+            raise serializers.ValidationError({"placement_id": "Placement not found."})
+        except PlacementFullError as e:
+            raise serializers.ValidationError({"dates": str(e)})
+    
+    def update(self, instance, validated_data):
+        validated_data.pop('ad_id', None)
+        validated_data.pop('placement_id', None)
+        try:
+            return update_booking(instance, **validated_data)
+        except PlacementFullError as e:
+            raise serializers.ValidationError({"dates": str(e)})
+
+
+class DateRangeSerializer(serializers.Serializer):
+    """A closed date range"""
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    
+    def validate(self, attrs):
+        if attrs['end_date'] < attrs['start_date']:
+            raise serializers.ValidationError({
+                "end_date": "End date must be after start date."
+            })
+        return attrs
+
+
+class FreeWindowsRequestSerializer(DateRangeSerializer):
+    """Search horizon plus the window length and how many to return"""
+    length_days = serializers.IntegerField(min_value=1)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=5)
+
+
+class BatchAvailabilitySerializer(serializers.Serializer):
+    """Several placements checked against several date ranges at once"""
+    placement_ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=50
+    )
+    ranges = DateRangeSerializer(many=True, required=False, max_length=50)
+    free_windows = FreeWindowsRequestSerializer(required=False)
+    
+    def validate(self, attrs):
+        if not attrs.get('ranges') and not attrs.get('free_windows'):
+            raise serializers.ValidationError(
+                "Provide ranges, free_windows or both."
+            )
+        return attrs
+
+
+class BulkModerationSerializer(serializers.Serializer):
+    """One review decision applied to many ads"""
+    ad_ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=1000
+    )
+    decision = serializers.ChoiceField(choices=['approve', 'reject'])
+    reason = serializers.CharField(required=False, allow_blank=True)
 
 
 class BookingCalendarSerializer(serializers.ModelSerializer):
@@ -175,6 +256,7 @@ class BookingCalendarSerializer(serializers.ModelSerializer):
 class AnalyticsSerializer(serializers.ModelSerializer):
     """Serializer for analytics"""
     ad_title = serializers.CharField(source='ad.title', read_only=True)
+    user_agent = serializers.CharField(source='user_agent.user_agent', read_only=True, default=None)
     
     class Meta:
         model = Analytics
@@ -182,6 +264,18 @@ class AnalyticsSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'event_timestamp']
 
 
+class AnalyticsEventSerializer(serializers.Serializer):
+    """Serializer for a single tracking beacon event"""
+    # Bounded so a bogus ID cannot overflow the lookup in write_events
+    ad_id = serializers.IntegerField(min_value=1, max_value=2**31 - 1)
+    event_type = serializers.ChoiceField(choices=Analytics.EVENT_TYPES)
+    device_type = serializers.CharField(max_length=50, required=False, allow_blank=True, allow_null=True)
+    browser = serializers.CharField(max_length=50, required=False, allow_blank=True, allow_null=True)
+    country = serializers.CharField(max_length=100, required=False, allow_blank=True, allow_null=True)
+    city = serializers.CharField(max_length=100, required=False, allow_blank=True, allow_null=True)
+    referrer_url = serializers.CharField(max_length=500, required=False, allow_blank=True, allow_null=True)
+
+
 class MessageReplySerializer(serializers.ModelSerializer):
     """Serializer for message replies"""
     user = UserSerializer(read_only=True)
@@ -207,7 +301,8 @@ class MessageSerializer(serializers.ModelSerializer):
 class MessageListSerializer(serializers.ModelSerializer):
     """Lightweight serializer for message listings"""
     user_name = serializers.CharField(source='user.username', read_only=True)
-    reply_count = serializers.IntegerField(source='replies.count', read_only=True)
+    # Annotated with Count('replies') by MessageViewSet
+    reply_count = serializers.IntegerField(read_only=True)
     
     class Meta:
         model = Message
@@ -0,0 +1,211 @@
+"""
+In-memory live-ad serving index
+
+Answers "which ad renders in placement X right now" without a query. The
+index maps each active placement code to a ``PlacementRotation``: the ads
+with a confirmed/active booking covering today, ordered featured first,
+then by ``priority_order``. Each pick is a weighted random choice by
+bisection over precomputed cumulative weights, so featured and
+higher-priority ads are shown more often while every booked ad rotates in.
+
+The whole index is built with three queries and swapped in as one object,
+so a reader always sees a complete snapshot. A snapshot is replaced:
+
+* when an ad, booking or placement is saved or deleted (signals mark it
+  stale locally and bump a version in the shared cache, which other processes
+  check at most every SERVING_INDEX_CHECK_INTERVAL seconds)
+* at the next local midnight, when bookings start and end
+* after SERVING_INDEX_MAX_AGE seconds, to pick up bulk updates
+
+While one thread rebuilds, others keep serving the previous snapshot.
+"""
+import random
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime, time as dtime, timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from .imaging import parse_dimensions
+from .occupancy import BLOCKING_STATUSES
+
+SERVABLE_AD_STATUSES = ('approved', 'live')
+_VERSION_KEY = 'serving_index_version'
+
+
+def ad_weight(ad):
+    """Relative share of impressions: priority plus one, boosted when featured"""
+    weight = 1 + max(ad.priority_order, 0)
+    if ad.is_featured:
+        weight *= getattr(settings, 'SERVING_FEATURED_WEIGHT', 3)
+    return weight
+
+
+class PlacementRotation:
+    """Live ads of one placement with their rotation weights"""
+    __slots__ = ('ads', 'cumulative')
+
+    def __init__(self, ads, weights):
+        self.ads = tuple(ads)
+        self.cumulative = tuple(accumulate(weights))
+
+    def __len__(self):
+        return len(self.ads)
+
+    def pick(self):
+        """One ad payload chosen in proportion to its weight, or None"""
+        if not self.ads:
+            return None
+        point = random.random() * self.cumulative[-1]
+        return self.ads[bisect_right(self.cumulative, point)]
+
+
+class ServingSnapshot:
+    __slots__ = ('rotations', 'version', 'expires_at', 'stale')
+
+    def __init__(self, rotations, version, expires_at):
+        self.rotations = rotations
+        self.version = version
+        self.expires_at = expires_at
+        # Set on local changes; served until its replacement is ready
+        self.stale = False
+
+
+def _next_midnight():
+    """Epoch seconds of the next local midnight"""
+    tomorrow = timezone.localdate() + timedelta(days=1)
+    return timezone.make_aware(datetime.combine(tomorrow, dtime.min)).timestamp()
+
+
+def _ad_payload(ad, placement, image):
+    url = None
+    if image is not None:
+        size = parse_dimensions(placement.dimensions)
+        variant = f'{size[0]}x{size[1]}@1x' if size else None
+        url = image.variants.get(variant) or image.file_path
+    return {
+        'id': ad.id,
+        'title': ad.title,
+        'short_description': ad.short_description,
+        'call_to_action': ad.call_to_action,
+        'website_url': ad.website_url,
+        'image_url': url,
+        'alt_text': (image.alt_text if image is not None else None) or ad.title,
+        'is_featured': ad.is_featured,
+    }
+
+
+def build_rotations(today):
+    """``{placement_code: PlacementRotation}`` for every active placement"""
+    from .models import AdPlacement, Booking, UploadedFile
+
+    placements = {placement.pk: placement for placement in AdPlacement.objects.filter(is_active=True)}
+    bookings = Booking.objects.filter(
+        placement_id__in=list(placements),
+        status__in=BLOCKING_STATUSES,
+        start_date__lte=today,
+        end_date__gte=today,
+        ad__status__in=SERVABLE_AD_STATUSES,
+    ).filter(
+        Q(ad__start_date__isnull=True) | Q(ad__start_date__lte=today),
+        Q(ad__end_date__isnull=True) | Q(ad__end_date__gte=today),
+    ).select_related('ad').order_by('placement_id', '-ad__is_featured', '-ad__priority_order', 'ad_id')
+
+    by_placement = {}
+    for booking in bookings:
+        ads = by_placement.setdefault(booking.placement_id, {})
+        # Several bookings of one ad on a placement rotate it once
+        ads.setdefault(booking.ad_id, booking.ad)
+
+    ad_ids = {ad_id for ads in by_placement.values() for ad_id in ads}
+    images = {}
+    files = UploadedFile.objects.filter(
+        ad_id__in=ad_ids, virus_scan_status='clean', file_type__startswith='image/'
+    ).order_by('ad_id', '-is_primary', 'created_at') if ad_ids else []
+    for image in files:
+        images.setdefault(image.ad_id, image)
+
+    rotations = {}
+    for placement_id, placement in placements.items():
+        ads = list(by_placement.get(placement_id, {}).values())
+        rotations[placement.placement_code] = PlacementRotation(
+            [_ad_payload(ad, placement, images.get(ad.id)) for ad in ads],
+            [ad_weight(ad) for ad in ads]
+        )
+    return rotations
+
+
+class ServingIndex:
+    """Process-wide snapshot of live ads per placement code"""
+
+    def __init__(self, max_age=None, check_interval=None):
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._next_check = 0
+        self._build_lock = threading.Lock()
+
+    def rotation(self, placement_code):
+        """The placement's rotation, or None for an unknown/inactive placement"""
+        return self.snapshot().rotations.get(placement_code)
+
+    def pick(self, placement_code):
+        rotation = self.rotation(placement_code)
+        return rotation.pick() if rotation is not None else None
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        now = time.time()
+        if snapshot is not None and not snapshot.stale and now < snapshot.expires_at:
+            if now < self._next_check:
+                return snapshot
+            self._next_check = now + self._setting('check_interval', 'SERVING_INDEX_CHECK_INTERVAL', 1)
+            if cache.get(_VERSION_KEY, 0) == snapshot.version:
+                return snapshot
+
+        if not self._build_lock.acquire(blocking=snapshot is None):
+            # Someone else is rebuilding; the previous snapshot is still usable
+            return snapshot
+        try:
+            if self._snapshot is not snapshot and not self._snapshot.stale:
+                # Rebuilt while this thread waited for the lock
+                return self._snapshot
+            return self._rebuild()
+        finally:
+            self._build_lock.release()
+
+    def _setting(self, attribute, name, default):
+        value = getattr(self, attribute)
+        return value if value is not None else getattr(settings, name, default)
+
+    def _rebuild(self):
+        # Read the version first so a change during the build forces another
+        version = cache.get(_VERSION_KEY, 0)
+        rotations = build_rotations(timezone.localdate())
+        max_age = self._setting('max_age', 'SERVING_INDEX_MAX_AGE', 300)
+        now = time.time()
+        self._snapshot = ServingSnapshot(rotations, version, min(now + max_age, _next_midnight()))
+        self._next_check = now + self._setting('check_interval', 'SERVING_INDEX_CHECK_INTERVAL', 1)
+        return self._snapshot
+
+    def invalidate(self):
+        """
+        Have the next reader rebuild. Only the thread that takes the build
+        lock does so; the others keep serving the stale snapshot meanwhile.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            snapshot.stale = True
+        self._next_check = 0
+        try:
+            cache.incr(_VERSION_KEY)
+        except ValueError:
+            cache.set(_VERSION_KEY, time.time_ns() // 1000, timeout=None)
+
+
+serving_index = ServingIndex()
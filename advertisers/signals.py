@@ -0,0 +1,139 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .models import (
+    Ad, AdPlacement, Booking, CaseStudy, EnhancedPricingPackage, FAQ, Notification,
+    PackageFeature, PlatformBenefit, PlatformStatistic, PricingFeature, PricingPackage,
+    PromotionalBanner, Testimonial, UploadedFile
+)
+from .conditional import invalidate_model_version
+from .events import publish_ad_status, publish_notifications
+from .marketing_cache import invalidate_marketing_overview
+from .search import index_document, remove_document
+from .serving import serving_index
+from .notifications import adjust_unread
+from .occupancy import occupancy_index
+from .stats_cache import invalidate_user_stats
+from .storage import adjust_ref_count
+
+# Receivers for shared caches invalidate twice: immediately, and again on
+# commit so a reader cannot re-cache the pre-commit rows in between.
+
+
+@receiver([post_save, post_delete], sender=Ad)
+@receiver([post_save, post_delete], sender=Booking)
+def invalidate_dashboard_statistics(sender, instance, **kwargs):
+    """Drop cached dashboard statistics for the owner of a changed ad/booking"""
+    invalidate_user_stats(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Booking)
+def invalidate_placement_occupancy(sender, instance, **kwargs):
+    """Drop the booked placement's interval tree"""
+    placement_id = instance.placement_id
+    occupancy_index.invalidate(placement_id)
+    transaction.on_commit(lambda: occupancy_index.invalidate(placement_id))
+
+
+@receiver(post_save, sender=AdPlacement)
+def refresh_placement_capacity(sender, instance, **kwargs):
+    """max_concurrent_ads may have changed, so rebuild the placement's tree"""
+    occupancy_index.invalidate(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Ad)
+@receiver([post_save, post_delete], sender=Booking)
+@receiver([post_save, post_delete], sender=AdPlacement)
+@receiver([post_save, post_delete], sender=UploadedFile)
+def invalidate_serving_index(sender, **kwargs):
+    """Drop the live-ad serving index"""
+    serving_index.invalidate()
+    transaction.on_commit(serving_index.invalidate)
+
+
+@receiver(post_save, sender=UploadedFile)
+def reference_blob(sender, instance, created, **kwargs):
+    if created and instance.blob_id:
+        adjust_ref_count(instance.blob_id, 1)
+
+
+@receiver(post_delete, sender=UploadedFile)
+def release_blob(sender, instance, **kwargs):
+    """Unreferenced blobs are left for gc_blobs to delete"""
+    if instance.blob_id:
+        adjust_ref_count(instance.blob_id, -1)
+
+
+@receiver(post_save, sender=Notification)
+def count_new_notification(sender, instance, created, **kwargs):
+    if created and not instance.is_read:
+        adjust_unread({instance.user_id: 1})
+    if created:
+        publish_notifications([instance])
+
+
+@receiver(post_delete, sender=Notification)
+def uncount_deleted_notification(sender, instance, **kwargs):
+    if not instance.is_read:
+        adjust_unread({instance.user_id: -1})
+
+
+@receiver(post_init, sender=Ad)
+def remember_ad_status(sender, instance, **kwargs):
+    # __dict__ avoids loading a deferred field
+    instance._loaded_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=Ad)
+def publish_ad_status_change(sender, instance, created, **kwargs):
+    """Push status transitions to the advertiser's event stream"""
+    previous = None if created else instance._loaded_status
+    if previous != instance.status:
+        publish_ad_status(instance, previous)
+    instance._loaded_status = instance.status
+
+
+MARKETING_MODELS = [
+    PlatformBenefit, PlatformStatistic, Testimonial, CaseStudy,
+    EnhancedPricingPackage, PackageFeature, PricingFeature, PromotionalBanner,
+]
+
+
+def invalidate_marketing_content(sender, **kwargs):
+    """Drop the cached marketing overview"""
+    invalidate_marketing_overview()
+    transaction.on_commit(invalidate_marketing_overview)
+
+
+for model in MARKETING_MODELS:
+    post_save.connect(invalidate_marketing_content, sender=model)
+    post_delete.connect(invalidate_marketing_content, sender=model)
+
+
+CATALOG_MODELS = MARKETING_MODELS + [FAQ, PricingPackage, AdPlacement]
+
+
+def invalidate_catalog_etags(sender, **kwargs):
+    """Bump the ETag version of views that read this model"""
+    invalidate_model_version(sender)
+    transaction.on_commit(lambda: invalidate_model_version(sender))
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(invalidate_catalog_etags, sender=model)
+    post_delete.connect(invalidate_catalog_etags, sender=model)
+
+
+@receiver(post_save, sender=Ad)
+@receiver(post_save, sender=FAQ)
+@receiver(post_save, sender=CaseStudy)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    index_document(instance, update_fields)
+
+
+@receiver(post_delete, sender=Ad)
+@receiver(post_delete, sender=FAQ)
+@receiver(post_delete, sender=CaseStudy)
+def remove_from_search_index(sender, instance, **kwargs):
+    remove_document(instance)
@@ -0,0 +1,42 @@
+"""
+Per-user cache for dashboard statistics
+
+Each user has a version counter; every cached statistics payload is keyed
+by that version, so bumping it invalidates all of the user's dashboards at
+once. Writes to Ad, Booking and Payment bump the version via signals.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _version_key(user_id):
+    return f'user_stats_version:{user_id}'
+
+
+def _get_version(user_id):
+    # Seeded from the clock: if the counter is evicted, restarting at a fixed
+    # number could land on a version whose payloads are still cached
+    return cache.get_or_set(_version_key(user_id), time.time_ns() // 1000, timeout=None)
+
+
+def get_user_stats(user_id, kind, compute):
+    """Return cached statistics of ``kind`` for a user, computing on a miss"""
+    key = f'user_stats:{user_id}:{_get_version(user_id)}:{kind}'
+    data = cache.get(key)
+    if data is None:
+        data = compute()
+        cache.set(key, data, timeout=getattr(settings, 'USER_STATS_CACHE_TTL', 300))
+    return data
+
+
+def invalidate_user_stats(*user_ids):
+    for user_id in user_ids:
+        if user_id is None:
+            continue
+        try:
+            cache.incr(_version_key(user_id))
+        except ValueError:
+            # No version stored yet, so nothing is cached for this user
+            pass
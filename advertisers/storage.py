@@ -0,0 +1,184 @@
+"""
+Content-addressed storage for uploads
+
+Upload content is stored once per SHA-256 under
+``MEDIA_ROOT/uploads/<aa>/<sha256><ext>`` as a StoredBlob. UploadedFile rows
+reference the blob; a signal keeps ``StoredBlob.ref_count`` in step. Scan
+and image results are kept on the blob, so re-uploading known content is a
+metadata insert: no disk write, no virus scan and no image decode.
+Unreferenced blobs are removed by the ``gc_blobs`` command.
+
+Each upload's content is read once: large multipart uploads are hashed by
+``HashingTemporaryFileUploadHandler`` as they stream to their temp file,
+which is then moved into place, and in-memory uploads are hashed while
+they are written out.
+"""
+import hashlib
+import os
+import shutil
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+# Fields copied from a blob to every upload that references it
+SHARED_FIELDS = (
+    'virus_scan_status', 'virus_scan_date', 'width', 'height',
+    'thumbnail_path', 'variants',
+)
+
+
+def upload_path(stored_filename):
+    return os.path.join(settings.MEDIA_ROOT, 'uploads', stored_filename)
+
+
+def variants_dir(key):
+    return os.path.join(settings.MEDIA_ROOT, 'variants', str(key))
+
+
+class HashingTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Temp-file upload handler that records the SHA-256 as ``file.sha256``"""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.digest.hexdigest()
+        return file
+
+
+def hash_upload(file):
+    """SHA-256 of an uploaded file, read chunk by chunk"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def store_upload(file):
+    """
+    Return ``(blob, created)`` for an uploaded file. The file is only
+    written to disk when its content is not stored yet.
+    """
+    from .models import StoredBlob
+
+    size = file.size
+    partial_path = None
+    sha256 = getattr(file, 'sha256', None)
+    if sha256 is None:
+        if hasattr(file, 'temporary_file_path'):
+            # Resumable session file: hashed here, then moved rather than copied
+            sha256 = hash_upload(file)
+        else:
+            partial_path, sha256 = _spool(file)
+
+    blob = StoredBlob.objects.filter(sha256=sha256).first()
+    if blob is not None:
+        if partial_path is not None:
+            os.remove(partial_path)
+        # Keep the blob out of reach of gc_blobs until the new reference exists
+        StoredBlob.objects.filter(pk=blob.pk).update(last_used_at=timezone.now())
+        return blob, False
+
+    ext = os.path.splitext(file.name)[1].lower()
+    stored_filename = f'{sha256[:2]}/{sha256}{ext}'
+    path = upload_path(stored_filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if partial_path is None:
+        # Already on disk (large or resumable upload): move instead of copying
+        partial_path = f'{path}.{uuid.uuid4().hex}.part'
+        file_move_safe(file.temporary_file_path(), partial_path)
+    os.replace(partial_path, path)
+
+    try:
+        with transaction.atomic():
+            blob = StoredBlob.objects.create(
+                sha256=sha256,
+                stored_filename=stored_filename,
+                size_bytes=size
+            )
+        return blob, True
+    except IntegrityError:
+        # A concurrent upload of the same content created the blob first
+        blob = StoredBlob.objects.get(sha256=sha256)
+        if blob.stored_filename != stored_filename:
+            os.remove(path)
+        return blob, False
+
+
+def _spool(file):
+    """Write an in-memory upload to a part file, hashing it on the way"""
+    directory = upload_path('')
+    os.makedirs(directory, exist_ok=True)
+    partial_path = os.path.join(directory, f'{uuid.uuid4().hex}.part')
+    digest = hashlib.sha256()
+    with open(partial_path, 'wb') as destination:
+        for chunk in file.chunks():
+            digest.update(chunk)
+            destination.write(chunk)
+    return partial_path, digest.hexdigest()
+
+
+def shared_fields(blob):
+    return {field: getattr(blob, field) for field in SHARED_FIELDS}
+
+
+def share_results(blob_id, **fields):
+    """Record results on a blob and every upload that references it"""
+    from .models import StoredBlob, UploadedFile
+
+    blob_fields = {field: value for field, value in fields.items() if field in SHARED_FIELDS}
+    with transaction.atomic():
+        StoredBlob.objects.filter(pk=blob_id).update(**blob_fields)
+        UploadedFile.objects.filter(blob_id=blob_id).update(**fields)
+
+
+def adjust_ref_count(blob_id, delta):
+    from .models import StoredBlob
+
+    StoredBlob.objects.filter(pk=blob_id).update(
+        ref_count=F('ref_count') + delta,
+        last_used_at=timezone.now()
+    )
+
+
+def collect_garbage(grace=timedelta(hours=1), dry_run=False):
+    """
+    Delete blobs nobody has referenced for ``grace`` along with their
+    files and image variants. Returns ``(blobs_removed, bytes_freed)``.
+    """
+    from .models import StoredBlob
+
+    cutoff = timezone.now() - grace
+    candidates = StoredBlob.objects.filter(ref_count__lte=0, last_used_at__lt=cutoff)
+
+    removed = freed = 0
+    for blob_id in candidates.values_list('id', flat=True).iterator():
+        with transaction.atomic():
+            blob = StoredBlob.objects.select_for_update().filter(
+                pk=blob_id, ref_count__lte=0, last_used_at__lt=cutoff
+            ).first()
+            if blob is None or blob.uploads.exists():
+                continue
+            if not dry_run:
+                blob.delete()
+
+        if not dry_run:
+            if os.path.exists(upload_path(blob.stored_filename)):
+                os.remove(upload_path(blob.stored_filename))
+            shutil.rmtree(variants_dir(blob.sha256), ignore_errors=True)
+        removed += 1
+        freed += blob.size_bytes
+    return removed, freed
@@ -0,0 +1,72 @@
+"""
+Server-Sent Events endpoint
+
+``event_stream`` is a native async view. Under ASGI each open connection
+is just a coroutine waiting on its queue, so one event loop holds
+thousands of idle advertisers without tying up a worker thread each.
+Browsers' EventSource cannot send headers, so the JWT access token may
+also be passed as ``?token=``.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from .events import get_broker
+from .notifications import unread_count
+
+
+def format_event(event_type, data):
+    return f'event: {event_type}\ndata: {json.dumps(data)}\n\n'
+
+
+async def authenticate_stream(request):
+    """User from the Bearer header or ?token=, else the session user"""
+    auth = JWTAuthentication()
+    header = auth.get_header(request)
+    raw_token = auth.get_raw_token(header) if header else request.GET.get('token')
+    if raw_token:
+        try:
+            validated = auth.get_validated_token(raw_token)
+            return await sync_to_async(auth.get_user)(validated)
+        except (InvalidToken, AuthenticationFailed):
+            return None
+
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+async def event_stream(request):
+    """Stream notifications and ad status changes for the current user"""
+    user = await authenticate_stream(request)
+    if user is None:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    broker = get_broker()
+    subscription = broker.subscribe(user.id)
+    heartbeat = settings.EVENT_STREAM_HEARTBEAT
+
+    async def stream():
+        try:
+            yield 'retry: 5000\n\n'
+            count = await sync_to_async(unread_count)(user.id)
+            yield format_event('unread_count', {'unread_count': count})
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection
+                    yield ': keep-alive\n\n'
+                    continue
+                yield format_event(event['type'], event['data'])
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,3 +1,1790 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import os
+import random
+import shutil
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib import admin
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import QuerySet
+from django.test.utils import CaptureQueriesContext
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.models import User, UserProfile
+from payments.models import Payment
+from .allocator import PlacementFullError, allocate_booking
+from .dedup import TimeBucketedBloomFilter, event_deduplicator
+from .dnn import CircuitBreaker, DNNClient, dnn_client
+from .events import InProcessBroker, RedisBroker, get_broker
+from .hll import HyperLogLog
+from .imaging import image_pipeline
+from .ingestion import AnalyticsBuffer, write_events
+from .lifecycle import _claim, run_lifecycle
+from .marketing_cache import next_banner_boundary
+from .models import (
+    FAQ, Ad, AdPlacement, Analytics, AnalyticsDailyRollup, AnalyticsReachSketch, Booking,
+    EnhancedPricingPackage, Message, MessageReply, Notification, OutboxEmail, PackageFeature,
+    PlatformBenefit, PricingFeature, PricingPackage, PromotionalBanner, SearchTerm, StoredBlob,
+    UploadedFile, UploadSession, UserAgent
+)
+from .occupancy import IntervalTree, occupancy_index
+from .rollups import ad_reach, fold_daily_rollups, visitor_key
+from .outbox import deliver_pending, queue_email
+from .resumable import OffsetMismatch, session_path, write_chunk
+from .scanning import ClamdSession, scan_pool
+from .search import search
+from .serving import PlacementRotation, serving_index
+from .useragents import user_agents
+from .views import get_ad_statistics, get_client_ip
+
+
+class FakeDNNServer:
+    """
+    Local stand-in for the DNN API, serving /clicks/statistics
+    """
+
+    def __init__(self):
+        self.status = 200
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                body = json.dumps({'total_clicks': 42, 'clicks_today': 3}).encode()
+                self.send_response(server.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class DNNClientTests(SimpleTestCase):
+
+    def test_fresh_responses_are_served_from_cache(self):
+        with FakeDNNServer() as server:
+            client = DNNClient(base_url=server.url, ttl=60)
+            self.assertEqual(client.get_click_statistics(1)['total_clicks'], 42)
+            self.assertEqual(client.get_click_statistics(1)['total_clicks'], 42)
+
+        self.assertEqual(server.requests, 1)
+        self.assertEqual(client.metrics()['hit_rate'], 0.5)
+
+    def test_stale_response_is_returned_while_revalidating(self):
+        with FakeDNNServer() as server:
+            client = DNNClient(base_url=server.url, ttl=0.05, stale_ttl=60)
+            client.get_click_statistics(1)
+            time.sleep(0.1)
+
+            server.status = 500
+            self.assertEqual(client.get_click_statistics(1)['total_clicks'], 42)
+            for _ in range(50):
+                if server.requests == 2:
+                    break
+                time.sleep(0.02)
+
+        self.assertEqual(server.requests, 2)
+        self.assertEqual(client.metrics()['stale_hits'], 1)
+
+    def test_breaker_opens_after_repeated_failures(self):
+        with FakeDNNServer() as server:
+            server.status = 500
+            client = DNNClient(base_url=server.url, failure_threshold=3, reset_timeout=60)
+            for _ in range(5):
+                self.assertIsNone(client.get_click_statistics(1))
+
+        self.assertEqual(server.requests, 3)
+        metrics = client.metrics()
+        self.assertEqual(metrics['breaker_state'], CircuitBreaker.OPEN)
+        self.assertEqual(metrics['short_circuits'], 2)
+
+    def test_half_open_breaker_closes_after_successful_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow_request())
+        time.sleep(0.02)
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_probe_that_raises_unexpectedly_does_not_wedge_breaker(self):
+        client = DNNClient(base_url='http://dnn.invalid', failure_threshold=1, reset_timeout=0.01)
+        client.breaker.record_failure()
+        time.sleep(0.02)
+
+        with mock.patch.object(client.session, 'get', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                client.get_click_statistics(1)
+
+        time.sleep(0.02)
+        self.assertTrue(client.breaker.allow_request())
+
+    def test_response_cache_keeps_only_recent_flyers(self):
+        with FakeDNNServer() as server:
+            client = DNNClient(base_url=server.url, ttl=60, max_flyers=2)
+            client.get_click_statistics(1)
+            client.get_click_statistics(2)
+            client.get_click_statistics(1)
+            client.get_click_statistics(3)
+            client.get_click_statistics(1)
+
+        self.assertEqual(server.requests, 3)
+        self.assertEqual(client.metrics()['cached_flyers'], 2)
+
+
+class AdStatisticsViewTests(TestCase):
+
+    def setUp(self):
+        dnn_client.reset()
+        self.addCleanup(dnn_client.reset)
+        self.user = User.objects.create_user(username='adv', email='adv@example.com', password='pass')
+        self.ad = Ad.objects.create(user=self.user, title='Spring Sale', total_clicks=7)
+
+    def get_statistics(self):
+        request = APIRequestFactory().get(f'/api/advertisers/ads/{self.ad.id}/statistics/')
+        force_authenticate(request, user=self.user)
+        return get_ad_statistics(request, ad_id=self.ad.id)
+
+    def test_falls_back_to_local_counters_when_dnn_fails(self):
+        with FakeDNNServer() as server:
+            server.status = 503
+            with override_settings(DNN_API_URL=server.url):
+                response = self.get_statistics()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_clicks'], 7)
+
+    def test_uses_dnn_data_when_available(self):
+        with FakeDNNServer() as server:
+            with override_settings(DNN_API_URL=server.url):
+                response = self.get_statistics()
+
+        self.assertEqual(response.data['total_clicks'], 42)
+        self.assertEqual(response.data['clicks_today'], 3)
+
+
+class MyStatisticsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='adv', email='adv@example.com', password='pass')
+        Ad.objects.create(user=self.user, title='Live', status='live', total_impressions=200, total_clicks=10)
+        Ad.objects.create(user=self.user, title='Pending', status='pending_review')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_statistics_are_one_query_and_cached(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/advertisers/ads/my_statistics/')
+        self.assertEqual(response.data['total_ads'], 2)
+        self.assertEqual(response.data['active_ads'], 1)
+        self.assertEqual(response.data['pending_ads'], 1)
+        self.assertEqual(response.data['average_ctr'], 5.0)
+
+        with self.assertNumQueries(0):
+            self.client.get('/api/advertisers/ads/my_statistics/')
+
+    def test_ad_write_invalidates_cached_statistics(self):
+        self.client.get('/api/advertisers/ads/my_statistics/')
+        Ad.objects.create(user=self.user, title='Another', status='live')
+
+        response = self.client.get('/api/advertisers/ads/my_statistics/')
+        self.assertEqual(response.data['total_ads'], 3)
+        self.assertEqual(response.data['active_ads'], 2)
+
+    def test_evicted_version_does_not_revive_old_payloads(self):
+        self.client.get('/api/advertisers/ads/my_statistics/')
+        # The counter is evicted while payloads cached under it survive
+        cache.delete(f'user_stats_version:{self.user.id}')
+        Ad.objects.filter(user=self.user).update(status='live')
+
+        response = self.client.get('/api/advertisers/ads/my_statistics/')
+        self.assertEqual(response.data['active_ads'], 2)
+
+
+class AnalyticsRollupTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='adv', email='adv@example.com', password='pass')
+        self.ad = Ad.objects.create(user=self.user, title='Spring Sale', status='live')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.today = timezone.localdate()
+
+    def at(self, days_ago, hour):
+        day = self.today - timedelta(days=days_ago)
+        return timezone.make_aware(datetime.combine(day, datetime.min.time())) + timedelta(hours=hour)
+
+    def events(self, when, count, event_type='impression', device_type='mobile'):
+        rows = Analytics.objects.bulk_create([
+            Analytics(ad=self.ad, event_type=event_type, device_type=device_type, country='UK')
+            for _ in range(count)
+        ])
+        Analytics.objects.filter(pk__in=[row.pk for row in rows]).update(event_timestamp=when)
+
+    def test_fold_adds_to_rows_of_a_partly_folded_day(self):
+        self.events(self.at(2, 8), 3)
+        self.events(self.at(2, 20), 4)
+        self.events(self.at(2, 21), 2, event_type='click')
+
+        fold_daily_rollups(cutoff=self.at(2, 12))
+        self.assertEqual(AnalyticsDailyRollup.objects.get(event_type='impression').count, 3)
+
+        out = StringIO()
+        call_command('rollup_analytics', stdout=out)
+        self.assertIn('Folded events', out.getvalue())
+        counts = dict(AnalyticsDailyRollup.objects.values_list('event_type', 'count'))
+        self.assertEqual(counts, {'impression': 7, 'click': 2})
+
+        # Nothing left to fold
+        call_command('rollup_analytics', stdout=out)
+        self.assertIn('already up to date', out.getvalue())
+        self.assertEqual(AnalyticsDailyRollup.objects.get(event_type='impression').count, 7)
+
+    def test_statistics_merge_rollups_with_the_raw_tail(self):
+        self.events(self.at(3, 10), 5)
+        self.events(self.at(1, 10), 2, event_type='click', device_type='desktop')
+        call_command('rollup_analytics', stdout=StringIO())
+        # Raw events since the watermark are not folded yet
+        self.events(self.at(0, 0), 4)
+
+        data = self.client.get(f'/api/advertisers/ads/{self.ad.id}/statistics/').data
+        self.assertEqual(
+            [(row['event_timestamp__date'], row['count']) for row in data['impressions_by_date']],
+            [(self.today - timedelta(days=3), 5), (self.today, 4)]
+        )
+        self.assertEqual(sum(row['count'] for row in data['clicks_by_date']), 2)
+        self.assertEqual(
+            {row['device_type']: row['count'] for row in data['device_breakdown']},
+            {'mobile': 9, 'desktop': 2}
+        )
+        self.assertEqual(data['country_breakdown'], [{'country': 'UK', 'count': 11}])
+
+
+class IntervalTreeTests(SimpleTestCase):
+
+    def test_matches_brute_force_overlap(self):
+        rng = random.Random(7)
+        base = date(2025, 1, 1)
+        intervals = []
+        for key in range(200):
+            start = base + timedelta(days=rng.randint(0, 365))
+            intervals.append((start, start + timedelta(days=rng.randint(0, 20)), key))
+        tree = IntervalTree(intervals)
+
+        for _ in range(200):
+            start = base + timedelta(days=rng.randint(-10, 380))
+            end = start + timedelta(days=rng.randint(0, 15))
+            expected = {key for s, e, key in intervals if s <= end and e >= start}
+            self.assertEqual(set(tree.overlapping(start, end)), expected)
+            self.assertEqual(tree.overlaps(start, end), bool(expected))
+
+
+class PlacementAvailabilityTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        occupancy_index.clear()
+        self.user = User.objects.create_user(username='adv', email='adv@example.com', password='pass')
+        self.ad = Ad.objects.create(user=self.user, title='Spring Sale')
+        self.placement = AdPlacement.objects.create(
+            placement_name='Sidebar', placement_code='sidebar', base_price_per_day=10
+        )
+        self.client = APIClient()
+
+    def availability(self, start, end):
+        return self.client.get(
+            f'/api/advertisers/ad-placements/{self.placement.id}/availability/',
+            {'start_date': start, 'end_date': end}
+        ).data
+
+    def test_index_follows_booking_saves(self):
+        self.assertTrue(self.availability('2025-03-01', '2025-03-10')['is_available'])
+
+        booking = Booking.objects.create(
+            user=self.user, ad=self.ad, placement=self.placement,
+            start_date=date(2025, 3, 5), end_date=date(2025, 3, 8),
+            price_per_day=10, status='confirmed'
+        )
+        data = self.availability('2025-03-01', '2025-03-10')
+        self.assertFalse(data['is_available'])
+        self.assertEqual(data['conflicting_bookings'][0]['id'], booking.id)
+        self.assertTrue(self.availability('2025-03-09', '2025-03-10')['is_available'])
+
+        booking.status = 'cancelled'
+        booking.save()
+        self.assertTrue(self.availability('2025-03-01', '2025-03-10')['is_available'])
+
+    def test_free_range_needs_no_booking_query(self):
+        self.availability('2025-03-01', '2025-03-10')
+        # Only the placement lookup once the tree is warm
+        with self.assertNumQueries(1):
+            self.availability('2025-04-01', '2025-04-10')
+
+    def test_batch_availability_and_free_windows(self):
+        other = AdPlacement.objects.create(
+            placement_name='Footer', placement_code='footer', base_price_per_day=5
+        )
+        Booking.objects.create(
+            user=self.user, ad=self.ad, placement=self.placement,
+            start_date=date(2025, 3, 5), end_date=date(2025, 3, 8),
+            price_per_day=10, status='active'
+        )
+        response = self.client.post('/api/advertisers/ad-placements/batch_availability/', {
+            'placement_ids': [self.placement.id, other.id],
+            'ranges': [{'start_date': '2025-03-01', 'end_date': '2025-03-05'}],
+            'free_windows': {
+                'start_date': '2025-03-01', 'end_date': '2025-03-20',
+                'length_days': 5, 'limit': 3,
+            },
+        }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        results = {item['placement_id']: item for item in response.data['placements']}
+        self.assertFalse(results[self.placement.id]['ranges'][0]['is_available'])
+        self.assertTrue(results[other.id]['ranges'][0]['is_available'])
+
+        windows = results[self.placement.id]['free_windows']
+        self.assertEqual(len(windows), 1)
+        self.assertEqual(windows[0]['start_date'], date(2025, 3, 9))
+        self.assertEqual(windows[0]['end_date'], date(2025, 3, 13))
+        self.assertEqual(windows[0]['available_until'], date(2025, 3, 20))
+
+
+class BookingAllocatorTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        occupancy_index.clear()
+        self.user = User.objects.create_user(username='adv', email='adv@example.com', password='pass')
+        self.ad = Ad.objects.create(user=self.user, title='Spring Sale')
+        self.placement = AdPlacement.objects.create(
+            placement_name='Sidebar', placement_code='sidebar',
+            base_price_per_day=10, max_concurrent_ads=2
+        )
+
+    def allocate(self, start, end):
+        return allocate_booking(
+            self.placement.id, start, end,
+            user=self.user, ad=self.ad, status='confirmed'
+        )
+
+    def test_capacity_is_counted_per_day(self):
+        self.allocate(date(2025, 5, 1), date(2025, 5, 10))
+        self.allocate(date(2025, 5, 8), date(2025, 5, 12))
+        # Only 5/1-5/7 and 5/11-5/12 have a free slot
+        self.allocate(date(2025, 5, 1), date(2025, 5, 7))
+        with self.assertRaises(PlacementFullError):
+            self.allocate(date(2025, 5, 9), date(2025, 5, 9))
+        self.assertFalse(occupancy_index.is_available(self.placement.id, date(2025, 5, 5), date(2025, 5, 5)))
+        self.assertTrue(occupancy_index.is_available(self.placement.id, date(2025, 5, 11), date(2025, 5, 20)))
+
+    def test_no_overbooking_under_contention(self):
+        # SQLite ignores FOR UPDATE, so here this only exercises the
+        # process-local placement lock, not the database row lock
+        results = []
+        start_gate = threading.Barrier(12)
+
+        def worker():
+            try:
+                start_gate.wait()
+                self.allocate(date(2025, 6, 1), date(2025, 6, 7))
+                results.append('booked')
+            except PlacementFullError:
+                results.append('full')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count('booked'), 2)
+        self.assertEqual(results.count('full'), 10)
+        self.assertEqual(
+            Booking.objects.filter(placement=self.placement, status='confirmed').count(), 2
+        )
+
+
+    def test_failed_payment_leaves_booking_unconfirmed(self):
+        booking = Booking.objects.create(
+            user=self.user, ad=self.ad, placement=self.placement,
+            start_date=date(2025, 6, 1), end_date=date(2025, 6, 7), price_per_day=10, status='pending'
+        )
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch('payments.views.Payment.objects.create', side_effect=IntegrityError('boom')):
+            with self.assertRaises(IntegrityError):
+                client.post('/api/payments/payments/', {
+                    'booking_id': booking.id, 'amount': '70.00', 'payment_method': 'credit_card',
+                }, format='json')
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, 'pending')
+
+
+class FakeClamd:
+    """
+    Local clamd speaking the IDSESSION/INSTREAM protocol. Streams containing
+    "EICAR" are reported as infected.
+    """
+
+    def __init__(self):
+        self.connections = 0
+        self.scans = 0
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                server.connections += 1
+                stream = self.request.makefile('rb')
+                command_id = 0
+                while True:
+                    command = b''
+                    while not command.endswith(b'\0'):
+                        byte = stream.read(1)
+                        if not byte:
+                            return
+                        command += byte
+                    if command == b'zEND\0':
+                        return
+                    if command == b'zIDSESSION\0':
+                        continue
+                    command_id += 1
+                    server.scans += 1
+                    data = b''
+                    while True:
+                        size = struct.unpack('!L', stream.read(4))[0]
+                        if not size:
+                            break
+                        data += stream.read(size)
+                    if b'EICAR' in data:
+                        reply = f'{command_id}: stream: Eicar-Test-Signature FOUND\0'
+                    else:
+                        reply = f'{command_id}: stream: OK\0'
+                    self.request.sendall(reply.encode())
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ClamdSessionTests(SimpleTestCase):
+
+    def test_scans_share_one_connection(self):
+        with tempfile.TemporaryDirectory() as tmp, FakeClamd() as clamd:
+            clean_path = f'{tmp}/clean.txt'
+            infected_path = f'{tmp}/infected.txt'
+            with open(clean_path, 'wb') as f:
+                f.write(b'hello' * 50000)
+            with open(infected_path, 'wb') as f:
+                f.write(b'X5O!P%@AP EICAR')
+
+            session = ClamdSession(host='127.0.0.1', port=clamd.port, timeout=5)
+            try:
+                self.assertEqual(session.scan_file(clean_path), ('clean', None))
+                self.assertEqual(session.scan_file(infected_path), ('infected', 'Eicar-Test-Signature'))
+                self.assertEqual(session.scan_file(clean_path), ('clean', None))
+            finally:
+                session.close()
+
+        self.assertEqual(clamd.connections, 1)
+
+
+class UploadScanTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='adv', email='adv@example.com', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.media_root = tempfile.mkdtemp()
+        self.quarantine_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.quarantine_root, ignore_errors=True)
+
+    def upload(self, name, content):
+        return self.client.post(
+            '/api/advertisers/files/',
+            {'file': SimpleUploadedFile(name, content, content_type='text/plain'), 'original_filename': name},
+            format='multipart'
+        )
+
+    def test_upload_is_accepted_and_scanned_in_background(self):
+        with FakeClamd() as clamd, override_settings(
+            MEDIA_ROOT=self.media_root, QUARANTINE_ROOT=self.quarantine_root,
+            CLAMD_HOST='127.0.0.1', CLAMD_PORT=clamd.port
+        ):
+            clean = self.upload('brochure.txt', b'spring sale')
+            infected = self.upload('payload.txt', b'X5O!P%@AP EICAR')
+            self.assertEqual(clean.status_code, 202)
+            self.assertEqual(clean.data['virus_scan_status'], 'pending')
+            scan_pool.join()
+
+        clean_file = UploadedFile.objects.get(pk=clean.data['id'])
+        self.assertEqual(clean_file.virus_scan_status, 'clean')
+        self.assertTrue(os.path.exists(f'{self.media_root}/uploads/{clean_file.stored_filename}'))
+
+        infected_file = UploadedFile.objects.get(pk=infected.data['id'])
+        self.assertEqual(infected_file.virus_scan_status, 'infected')
+        self.assertEqual(infected_file.file_path, '')
+        self.assertFalse(os.path.exists(f'{self.media_root}/uploads/{infected_file.stored_filename}'))
+        self.assertTrue(os.path.exists(f'{self.quarantine_root}/{os.path.basename(infected_file.stored_filename)}'))
+        self.assertTrue(Notification.objects.filter(user=self.user, notification_type='file_infected').exists())
+
+        response = self.client.get(f'/api/advertisers/files/{infected_file.id}/scan_status/')
+        self.assertEqual(response.data['virus_scan_status'], 'infected')
+
+    def test_clean_image_gets_thumbnail_and_placement_variants(self):
+        AdPlacement.objects.create(
+            placement_name='Sidebar', placement_code='sidebar',
+            base_price_per_day=10, dimensions='300x250'
+        )
+        image = BytesIO()
+        Image.new('RGB', (1200, 900), 'navy').save(image, 'PNG')
+
+        with FakeClamd() as clamd, override_settings(
+            MEDIA_ROOT=self.media_root, CLAMD_HOST='127.0.0.1', CLAMD_PORT=clamd.port
+        ):
+            response = self.client.post('/api/advertisers/files/', {
+                'file': SimpleUploadedFile('banner.png', image.getvalue(), content_type='image/png'),
+                'original_filename': 'banner.png',
+            }, format='multipart')
+            scan_pool.join()
+            image_pipeline.join()
+        # Render processes are not forked from the request worker
+        self.assertNotEqual(image_pipeline._get_executor()._mp_context.get_start_method(), 'fork')
+
+        uploaded_file = UploadedFile.objects.get(pk=response.data['id'])
+        self.assertEqual((uploaded_file.width, uploaded_file.height), (1200, 900))
+        sha256 = uploaded_file.blob.sha256
+        self.assertEqual(uploaded_file.thumbnail_path, f'/media/variants/{sha256}/thumbnail.webp')
+        self.assertEqual(set(uploaded_file.variants), {'300x250@1x', '300x250@2x'})
+
+        variant_path = f'{self.media_root}/variants/{sha256}/300x250@1x.webp'
+        with Image.open(variant_path) as variant:
+            self.assertEqual(variant.format, 'WEBP')
+            self.assertEqual(variant.size, (300, 225))
+
+    def test_uploads_are_hashed_while_streamed_not_read_again(self):
+        large = b'0123456789abcdef' * (4 * 1024 * 1024 // 16)  # past FILE_UPLOAD_MAX_MEMORY_SIZE
+        with FakeClamd() as clamd, override_settings(
+            MEDIA_ROOT=self.media_root, CLAMD_HOST='127.0.0.1', CLAMD_PORT=clamd.port
+        ), mock.patch('advertisers.storage.hash_upload') as hash_upload:
+            responses = [self.upload('big.txt', large), self.upload('small.txt', b'spring sale')]
+            scan_pool.join()
+
+        hash_upload.assert_not_called()
+        for response, content in zip(responses, [large, b'spring sale']):
+            self.assertEqual(response.status_code, 202)
+            blob = StoredBlob.objects.get(pk=UploadedFile.objects.get(pk=response.data['id']).blob_id)
+            self.assertEqual(blob.sha256, hashlib.sha256(content).hexdigest())
+            with open(f'{self.media_root}/uploads/{blob.stored_filename}', 'rb') as f:
+                self.assertEqual(f.read(), content)
+        self.assertFalse([name for name in os.listdir(f'{self.media_root}/uploads') if name.endswith('.part')])
+
+    def test_duplicate_upload_reuses_stored_blob_and_scan(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='pass')
+        with FakeClamd() as clamd, override_settings(
+            MEDIA_ROOT=self.media_root, CLAMD_HOST='127.0.0.1', CLAMD_PORT=clamd.port
+        ):
+            first = self.upload('logo.txt', b'same logo bytes')
+            scan_pool.join()
+            self.client.force_authenticate(other)
+            second = self.upload('logo-copy.txt', b'same logo bytes')
+            scan_pool.join()
+
+        self.assertEqual(clamd.scans, 1)
+        self.assertEqual(second.data['virus_scan_status'], 'clean')
+        self.assertEqual(first.data['stored_filename'], second.data['stored_filename'])
+        blob = StoredBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+
+        UploadedFile.objects.all().delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 0)
+        blob_path = f'{self.media_root}/uploads/{blob.stored_filename}'
+        self.assertTrue(os.path.exists(blob_path))
+
+        with override_settings(MEDIA_ROOT=self.media_root):
+            call_command('gc_blobs', grace_minutes=0, stdout=StringIO())
+        self.assertFalse(StoredBlob.objects.exists())
+        self.assertFalse(os.path.exists(blob_path))
+
+    def test_resumable_upload_continues_from_last_offset(self):
+        content = b'%PDF-1.7 catalog ' * 4000
+        with FakeClamd() as clamd, override_settings(
+            MEDIA_ROOT=self.media_root, RESUMABLE_UPLOAD_ROOT=f'{self.media_root}/sessions',
+            RESUMABLE_UPLOAD_CHUNK_SIZE=30000, CLAMD_HOST='127.0.0.1', CLAMD_PORT=clamd.port
+        ):
+            started = self.client.post('/api/advertisers/files/uploads/', {
+                'original_filename': 'catalog.pdf', 'file_type': 'application/pdf',
+                'total_size': len(content),
+            }, format='json')
+            self.assertEqual(started.status_code, 201)
+            url = f"/api/advertisers/files/uploads/{started.data['id']}/"
+
+            def put(offset, data):
+                return self.client.generic(
+                    'PUT', url, data, content_type='application/offset+octet-stream',
+                    HTTP_UPLOAD_OFFSET=str(offset)
+                )
+
+            self.assertEqual(put(0, content[:30000]).data['received_bytes'], 30000)
+            # The connection dropped and the client retries from a stale offset
+            conflict = put(0, content[:30000])
+            self.assertEqual(conflict.status_code, 409)
+            self.assertEqual(conflict.data['offset'], 30000)
+            self.assertEqual(put(30000, content[30000:90000]).status_code, 413)
+
+            offset = self.client.get(url).data['received_bytes']
+            while offset < len(content):
+                offset = put(offset, content[offset:offset + 30000]).data['received_bytes']
+
+            finalized = self.client.post(f'{url}finalize/', {'alt_text': 'Catalog'}, format='json')
+            scan_pool.join()
+
+        self.assertEqual(finalized.status_code, 202)
+        uploaded_file = UploadedFile.objects.get(pk=finalized.data['id'])
+        self.assertEqual(uploaded_file.virus_scan_status, 'clean')
+        self.assertEqual(uploaded_file.original_filename, 'catalog.pdf')
+        with open(f'{self.media_root}/uploads/{uploaded_file.stored_filename}', 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(f'{self.media_root}/sessions'), [])
+
+    def test_second_finalize_of_a_session_conflicts(self):
+        session = UploadSession.objects.create(
+            user=self.user, original_filename='notes.txt', file_type='text/plain', total_size=5
+        )
+        with override_settings(RESUMABLE_UPLOAD_ROOT=f'{self.media_root}/sessions'):
+            write_chunk(session, BytesIO(b'hello'), 0, 5)
+            # Another request has claimed the session and is storing it
+            UploadSession.objects.filter(pk=session.pk).update(status='finalizing')
+            response = self.client.post(
+                f'/api/advertisers/files/uploads/{session.pk}/finalize/', {}, format='json'
+            )
+
+            self.assertEqual(response.status_code, 409)
+            self.assertFalse(UploadedFile.objects.exists())
+            self.assertTrue(os.path.exists(session_path(session)))
+
+    def test_racing_chunks_at_the_same_offset_keep_one_body(self):
+        session = UploadSession.objects.create(
+            user=self.user, original_filename='catalog.pdf', file_type='application/pdf', total_size=8
+        )
+        both_reading = threading.Barrier(2)
+        results = {}
+
+        class SlowBody(BytesIO):
+            # Both requests are mid-body before either one commits
+            def read(self, size=-1):
+                both_reading.wait(timeout=5)
+                return super().read(size)
+
+        def put(body):
+            try:
+                write_chunk(UploadSession.objects.get(pk=session.pk), SlowBody(body), 0, len(body))
+                results[body] = 'written'
+            except OffsetMismatch:
+                results[body] = 'conflict'
+            finally:
+                connection.close()
+
+        with override_settings(RESUMABLE_UPLOAD_ROOT=f'{self.media_root}/sessions'):
+            threads = [threading.Thread(target=put, args=[body]) for body in (b'AAAAAAAA', b'BBBBBBBB')]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(sorted(results.values()), ['conflict', 'written'])
+            winner = next(body for body, result in results.items() if result == 'written')
+            session.refresh_from_db()
+            self.assertEqual(session.received_bytes, 8)
+            with open(session_path(session), 'rb') as f:
+                self.assertEqual(f.read(), winner)
+
+
+class CountingEmailBackend(LocmemEmailBackend):
+    """locmem backend that counts connections and can fail on demand"""
+    opened = 0
+    failures = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        if CountingEmailBackend.failures:
+            CountingEmailBackend.failures -= 1
+            raise ConnectionResetError('SMTP connection reset')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='advertisers.tests.CountingEmailBackend')
+class EmailOutboxTests(TestCase):
+
+    def setUp(self):
+        CountingEmailBackend.opened = 0
+        CountingEmailBackend.failures = 0
+        self.admin = User.objects.create_user(
+            username='admin', email='admin@example.com', password='pass', is_staff=True
+        )
+        self.user = User.objects.create_user(username='adv', email='adv@example.com', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_review_emails_are_queued_and_sent_over_one_connection(self):
+        for title in ('Spring Sale', 'Summer Sale', 'Autumn Sale'):
+            ad = Ad.objects.create(user=self.user, title=title, status='pending_review')
+            response = self.client.post(f'/api/advertisers/ads/{ad.id}/approve/')
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxEmail.objects.filter(status='pending').count(), 3)
+
+        call_command('send_outbox_emails', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].to, ['adv@example.com'])
+        self.assertEqual(CountingEmailBackend.opened, 1)
+        self.assertEqual(OutboxEmail.objects.filter(status='sent').count(), 3)
+
+    def test_failed_email_is_retried_with_backoff(self):
+        email = queue_email('Hello', 'Body', ['adv@example.com'])
+        CountingEmailBackend.failures = 1
+
+        self.assertEqual(deliver_pending(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertIn('connection reset', email.last_error)
+        # Not due yet
+        self.assertEqual(deliver_pending(), (0, 0))
+
+        OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_pending(), (1, 0))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('sent', 2))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_bulk_moderation_batches_writes_and_emails_per_user(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='pass')
+        ads = [
+            Ad.objects.create(user=owner, title=f'Ad {i}', status='pending_review')
+            for i, owner in enumerate([self.user] * 3 + [other] * 2)
+        ]
+        ad_ids = [ad.id for ad in ads] + [999999]
+
+        # SELECT, UPDATE, two bulk INSERTs, plus the savepoint pair
+        with self.assertNumQueries(6):
+            response = self.client.post('/api/advertisers/ads/moderate/', {
+                'ad_ids': ad_ids, 'decision': 'reject', 'reason': 'Blurry logo',
+            }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 5)
+        self.assertEqual(response.data['skipped'], [999999])
+        self.assertEqual(Ad.objects.filter(status='rejected', rejection_reason='Blurry logo').count(), 5)
+        self.assertEqual(Notification.objects.filter(notification_type='ad_rejected').count(), 5)
+
+        emails = OutboxEmail.objects.order_by('recipients')
+        self.assertEqual([email.recipients for email in emails], [['adv@example.com'], ['other@example.com']])
+        self.assertIn('3 Ads', emails[0].subject)
+
+    def test_bulk_moderation_leaves_ads_not_pending_review_alone(self):
+        pending = Ad.objects.create(user=self.user, title='Pending', status='pending_review')
+        live = Ad.objects.create(user=self.user, title='Live', status='live')
+
+        response = self.client.post('/api/advertisers/ads/moderate/', {
+            'ad_ids': [pending.id, live.id], 'decision': 'reject',
+        }, format='json')
+
+        self.assertEqual(response.data['ad_ids'], [pending.id])
+        self.assertEqual(response.data['skipped'], [live.id])
+        live.refresh_from_db()
+        self.assertEqual(live.status, 'live')
+        self.assertIsNone(live.reviewed_at)
+        self.assertFalse(Notification.objects.filter(related_ad=live).exists())
+
+    def test_bulk_moderation_is_admin_only(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/advertisers/ads/moderate/', {
+            'ad_ids': [1], 'decision': 'approve',
+        }, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class UnreadNotificationCountTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='adv', email='adv@example.com', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def unread(self):
+        return self.client.get('/api/advertisers/notifications/unread_count/').data['unread_count']
+
+    def notify(self, title):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notification.objects.create(user=self.user, title=title, message='...')
+
+    def test_counter_follows_create_and_read(self):
+        first = self.notify('One')
+        self.notify('Two')
+        self.assertEqual(self.unread(), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.unread(), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/advertisers/notifications/{first.id}/mark_read/')
+            self.client.post(f'/api/advertisers/notifications/{first.id}/mark_read/')
+        self.assertEqual(self.unread(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/advertisers/notifications/mark_all_read/')
+        self.assertEqual(self.unread(), 0)
+
+    def test_counter_is_rebuilt_after_eviction(self):
+        self.notify('One')
+        cache.clear()
+        self.assertEqual(self.unread(), 1)
+
+    async def test_changes_are_pushed_to_event_streams(self):
+        subscription = get_broker().subscribe(self.user.id)
+        try:
+            await sync_to_async(self.notify)('One')
+            event = await asyncio.wait_for(subscription.queue.get(), timeout=2)
+            while event['type'] != 'unread_count':
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=2)
+            self.assertEqual(event['data'], {'unread_count': 1})
+        finally:
+            get_broker().unsubscribe(subscription)
+
+
+class EventStreamTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='adv', email='adv@example.com', password='pass')
+        self.ad = Ad.objects.create(user=self.user, title='Spring Sale', status='pending_review')
+
+    async def test_broker_delivers_events_published_from_other_threads(self):
+        broker = InProcessBroker()
+        subscription = broker.subscribe(self.user.id)
+        other = broker.subscribe(self.user.id + 1)
+        self.assertEqual(broker.connection_count(), 2)
+
+        threading.Thread(
+            target=broker.publish, args=[self.user.id, {'type': 'ping', 'data': {}}]
+        ).start()
+        event = await asyncio.wait_for(subscription.queue.get(), timeout=2)
+        self.assertEqual(event['type'], 'ping')
+        self.assertTrue(other.queue.empty())
+
+        broker.unsubscribe(subscription)
+        broker.unsubscribe(other)
+        self.assertEqual(broker.connection_count(), 0)
+
+    def approve(self):
+        self.ad.status = 'approved'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ad.save()
+
+    async def test_stream_sends_unread_count_then_status_changes(self):
+        token = str(AccessToken.for_user(self.user))
+        response = await self.async_client.get('/api/advertisers/events/stream/', {'token': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        chunks = response.streaming_content
+        try:
+            self.assertEqual(await anext(chunks), b'retry: 5000\n\n')
+            self.assertIn(b'event: unread_count', await anext(chunks))
+
+            await sync_to_async(self.approve)()
+            event = await asyncio.wait_for(anext(chunks), timeout=2)
+            self.assertTrue(event.startswith(b'event: ad_status\n'))
+            data = json.loads(event.split(b'data: ', 1)[1])
+            self.assertEqual(data['status'], 'approved')
+            self.assertEqual(data['previous_status'], 'pending_review')
+        finally:
+            await chunks.aclose()
+
+    def test_redis_broker_fails_fast_without_the_client(self):
+        with mock.patch.dict('sys.modules', {'redis': None}):
+            with self.assertRaises(ImproperlyConfigured):
+                RedisBroker(url='redis://localhost:6379/0')
+
+    def test_redis_listener_reconnects_after_errors(self):
+        class Stop(BaseException):
+            pass
+
+        redis_module = mock.MagicMock()
+        pubsub = redis_module.Redis.from_url.return_value.pubsub.return_value
+        message = {'channel': f'advertiser_events:{self.user.id}'.encode(), 'data': b'{"type": "ping"}'}
+        pubsub.listen.side_effect = [ConnectionError('reset'), iter([message]), ConnectionError('reset')]
+        with mock.patch.dict('sys.modules', {'redis': redis_module}):
+            broker = RedisBroker(url='redis://localhost:6379/0')
+        with mock.patch.object(broker, 'deliver') as deliver, \
+                mock.patch('advertisers.events.time.sleep', side_effect=[None, Stop]) as sleep:
+            with self.assertRaises(Stop):
+                broker._listen()
+        deliver.assert_called_once_with(self.user.id, {'type': 'ping'})
+        # The delay resets once a subscription succeeds
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [1, 1])
+
+    async def test_stream_requires_authentication(self):
+        response = await self.async_client.get('/api/advertisers/events/stream/', {'token': 'bogus'})
+        self.assertEqual(response.status_code, 401)
+
+
+class MarketingOverviewCacheTests(TestCase):
+    url = '/api/advertisers/marketing/overview/'
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        PlatformBenefit.objects.create(title='Reach', description='Millions of readers')
+        for name in ['Starter', 'Pro']:
+            package = EnhancedPricingPackage.objects.create(name=name, slug=name.lower(), price=10)
+            for order in range(3):
+                feature = PricingFeature.objects.create(name=f'{name} feature {order}', order=order)
+                PackageFeature.objects.create(package=package, feature=feature, order=order)
+
+    def test_overview_is_served_from_cache(self):
+        # Six lists, one prefetch of package features and the banner boundary lookup
+        with self.assertNumQueries(8):
+            first = self.client.get(self.url).data
+        self.assertEqual(len(first['pricing_packages'][0]['package_features']), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).data, first)
+
+    def test_content_writes_invalidate_the_cache(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            PlatformBenefit.objects.create(title='Insights', description='Live analytics')
+        self.assertEqual(len(self.client.get(self.url).data['benefits']), 2)
+
+        feature = PricingFeature.objects.get(name='Pro feature 0')
+        feature.name = 'Priority support'
+        with self.captureOnCommitCallbacks(execute=True):
+            feature.save()
+        names = [
+            item['feature_name']
+            for package in self.client.get(self.url).data['pricing_packages']
+            for item in package['package_features']
+        ]
+        self.assertIn('Priority support', names)
+
+    def test_cache_expires_at_next_banner_boundary(self):
+        now = timezone.now()
+        starts = now + timedelta(minutes=30)
+        PromotionalBanner.objects.create(
+            title='Later', message='Soon', start_date=starts, end_date=now + timedelta(days=1)
+        )
+        PromotionalBanner.objects.create(
+            title='Ended', message='Gone', end_date=now - timedelta(hours=1)
+        )
+        self.assertEqual(next_banner_boundary(now), starts)
+
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            self.assertEqual(self.client.get(self.url).data['active_banners'], [])
+        [timeout] = [
+            call.kwargs['timeout'] for call in cache_set.call_args_list
+            if call.args[0].startswith('marketing_overview:')
+        ]
+        self.assertTrue(30 * 60 - 60 < timeout <= 30 * 60)
+
+
+class ConditionalCatalogTests(TestCase):
+    url = '/api/advertisers/pricing-packages/'
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.package = PricingPackage.objects.create(
+            package_name='Basic', package_type='basic', price_monthly=10
+        )
+
+    def test_matching_etag_returns_304_without_queries(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=60', response['Cache-Control'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        # Query strings are part of the tag
+        self.assertNotEqual(self.client.get(self.url, {'page': 1})['ETag'], etag)
+
+    def test_writes_change_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.package.price_monthly = 12
+        with self.captureOnCommitCallbacks(execute=True):
+            self.package.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_banner_etag_follows_schedule(self):
+        banner = PromotionalBanner.objects.create(title='Sale', message='Now on')
+        etag = self.client.get('/api/advertisers/marketing/banners/')['ETag']
+
+        # Leaving the window changes the tag even though no signal fired
+        PromotionalBanner.objects.filter(pk=banner.pk).update(
+            end_date=timezone.now() - timedelta(minutes=1)
+        )
+        response = self.client.get('/api/advertisers/marketing/banners/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+
+    def test_categories_are_privately_cacheable(self):
+        user = User.objects.create_user(username='adv', password='pass')
+        self.client.force_authenticate(user)
+        etag = self.client.get('/api/advertisers/categories/')['ETag']
+        response = self.client.get('/api/advertisers/categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('private', response['Cache-Control'])
+
+
+class ListQueryCountTests(TestCase):
+    """
+    Query counts for list endpoints, seen by an admin so every advertiser's
+    rows are listed. Counts must not grow with the number of rows.
+    """
+    # The page itself, one query per prefetch and a COUNT unless keyset-paginated
+    list_queries = {
+        '/api/advertisers/ads/': 2,
+        '/api/advertisers/files/': 2,
+        '/api/advertisers/bookings/': 3,
+        '/api/advertisers/bookings/calendar/': 1,
+        '/api/advertisers/messages/': 2,
+        '/api/advertisers/notifications/': 1,
+        # Plus the three ETag version stamps, which the seeding invalidated
+        '/api/advertisers/marketing/enhanced-pricing/': 6,
+        '/api/payments/payments/': 1,
+        '/api/accounts/users/': 2,
+    }
+
+    def setUp(self):
+        cache.clear()
+        occupancy_index.clear()
+        self.admin = User.objects.create_user(
+            username='admin', email='admin@example.com', password='pass', is_staff=True
+        )
+        self.placement = AdPlacement.objects.create(
+            placement_name='Sidebar', placement_code='sidebar', base_price_per_day=10
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.seeded = 0
+
+    def seed(self, advertisers):
+        for _ in range(advertisers):
+            n = self.seeded = self.seeded + 1
+            user = User.objects.create_user(username=f'adv{n}', email=f'adv{n}@example.com', password='pass')
+            UserProfile.objects.create(user=user)
+            ad = Ad.objects.create(user=user, title=f'Ad {n}')
+            for i in range(2):
+                UploadedFile.objects.create(
+                    user=user, ad=ad, original_filename=f'{i}.png', stored_filename=f'{n}-{i}.png',
+                    file_path=f'/media/{n}-{i}.png', file_type='image/png', file_size_kb=1
+                )
+            day = date(2025, 1, 1) + timedelta(days=2 * n)
+            booking = Booking.objects.create(
+                user=user, ad=ad, placement=self.placement, start_date=day, end_date=day,
+                price_per_day=10, status='confirmed'
+            )
+            Payment.objects.create(user=user, booking=booking, amount=10, payment_method='credit_card')
+            message = Message.objects.create(user=user, subject='Help', message='...')
+            MessageReply.objects.create(message=message, user=self.admin, reply_text='On it')
+            Notification.objects.create(user=self.admin, title=f'Note {n}', message='...')
+            package = EnhancedPricingPackage.objects.create(name=f'Package {n}', slug=f'package-{n}', price=10)
+            feature = PricingFeature.objects.create(name=f'Feature {n}')
+            PackageFeature.objects.create(package=package, feature=feature)
+
+    def assertListQueries(self):
+        for url, expected in self.list_queries.items():
+            with self.subTest(url=url), self.assertNumQueries(expected):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_list_queries_do_not_grow_with_rows(self):
+        self.seed(2)
+        self.assertListQueries()
+        self.seed(3)
+        self.assertListQueries()
+
+    def test_reply_count_is_annotated(self):
+        self.seed(1)
+        MessageReply.objects.create(message=Message.objects.get(), user=self.admin, reply_text='Done')
+        self.assertEqual(self.client.get('/api/advertisers/messages/').data['results'][0]['reply_count'], 2)
+
+
+class KeysetPaginationTests(TestCase):
+    url = '/api/advertisers/notifications/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='adv', email='adv@example.com', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Notification.objects.bulk_create(
+            Notification(user=self.user, title=f'Note {i}', message='...') for i in range(7)
+        )
+        # Ties on created_at are broken by id
+        stamp = timezone.now()
+        Notification.objects.filter(pk__lte=Notification.objects.order_by('id')[3].pk).update(created_at=stamp)
+        self.newest_first = list(Notification.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def ids(self, response):
+        return [row['id'] for row in response.data['results']]
+
+    def test_pages_cover_every_row_once_in_both_directions(self):
+        pages = []
+        url, params = self.url, {'page_size': 3}
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                response = self.client.get(url, params)
+                pages.append(self.ids(response))
+                url, params = response.data['next'], None
+        self.assertEqual([i for page in pages for i in page], self.newest_first)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        for query in queries.captured_queries:
+            self.assertNotIn('COUNT(', query['sql'])
+            self.assertNotIn('OFFSET', query['sql'])
+
+        previous = self.client.get(response.data['previous'])
+        self.assertEqual(self.ids(previous), pages[1])
+        self.assertEqual(self.ids(self.client.get(previous.data['previous'])), pages[0])
+
+    def test_ordering_falls_back_to_page_numbers(self):
+        response = self.client.get(self.url, {'ordering': 'created_at'})
+        self.assertEqual(response.data['count'], 7)
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'nonsense'}).status_code, 404)
+
+
+class FullTextSearchTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='adv', email='adv@example.com', password='pass', is_staff=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.title_match = Ad.objects.create(
+            user=self.user, title='Spring garden sale', short_description='Plants and pots'
+        )
+        self.body_match = Ad.objects.create(
+            user=self.user, title='Weekend offer', short_description='Everything for your garden'
+        )
+        Ad.objects.create(user=self.user, title='Winter tyres', short_description='Fitted free')
+
+    def titles(self, query):
+        return [ad.title for ad in search(Ad.objects.all(), query)]
+
+    def test_ranks_title_matches_first_with_prefixes(self):
+        self.assertEqual(self.titles('gard'), ['Spring garden sale', 'Weekend offer'])
+        self.assertEqual(self.titles('GARDEN spr'), ['Spring garden sale'])
+        self.assertEqual(self.titles('garden tyres'), [])
+        self.assertIsNone(search(Ad.objects.all(), 'the of'))
+
+    def test_index_follows_saves_and_deletes(self):
+        self.title_match.title = 'Autumn bulbs'
+        self.title_match.save()
+        self.assertEqual(self.titles('spring'), [])
+        self.assertEqual(self.titles('bulb'), ['Autumn bulbs'])
+
+        # Saves that leave indexed fields alone write nothing
+        with self.assertNumQueries(1):
+            self.title_match.save(update_fields=['total_clicks'])
+
+        self.title_match.delete()
+        self.assertFalse(SearchTerm.objects.filter(document_type='ad', object_id=self.title_match.pk).exists())
+
+    def test_api_search_is_ranked(self):
+        response = self.client.get('/api/advertisers/ads/', {'search': 'garden'})
+        self.assertEqual(
+            [ad['id'] for ad in response.data['results']], [self.title_match.id, self.body_match.id]
+        )
+
+    def test_admin_search_also_matches_owner(self):
+        model_admin = admin.site._registry[Ad]
+        request = APIRequestFactory().get('/admin/advertisers/ad/')
+        results, _ = model_admin.get_search_results(request, Ad.objects.all(), 'spring')
+        self.assertEqual(list(results), [self.title_match])
+        results, _ = model_admin.get_search_results(request, Ad.objects.all(), 'adv')
+        self.assertEqual(results.count(), 3)
+
+    def test_html_is_not_indexed(self):
+        FAQ.objects.create(question='How do refunds work?', answer='<p><strong>Refunds</strong> take 5 days</p>')
+        self.assertFalse(search(FAQ.objects.all(), 'strong').exists())
+        self.assertEqual(search(FAQ.objects.all(), 'refund days').count(), 1)
+
+    def test_rebuild_command(self):
+        SearchTerm.objects.all().delete()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.titles('garden'), ['Spring garden sale', 'Weekend offer'])
+
+
+class LifecycleTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        occupancy_index.clear()
+        self.today = date(2025, 6, 10)
+        self.user = User.objects.create_user(username='adv', email='adv@example.com', password='pass')
+        self.placement = AdPlacement.objects.create(
+            placement_name='Sidebar', placement_code='sidebar', base_price_per_day=10,
+            max_concurrent_ads=10
+        )
+
+    def ad(self, status, start, end):
+        return Ad.objects.create(
+            user=self.user, title=f'{status} ad', status=status,
+            start_date=self.today + timedelta(days=start) if start is not None else None,
+            end_date=self.today + timedelta(days=end) if end is not None else None
+        )
+
+    def booking(self, status, start, end, ad=None):
+        return Booking.objects.create(
+            user=self.user, ad=ad or self.ad('live', None, None), placement=self.placement,
+            start_date=self.today + timedelta(days=start), end_date=self.today + timedelta(days=end),
+            price_per_day=10, status=status
+        )
+
+    def test_statuses_follow_dates(self):
+        starting = self.ad('approved', 0, 5)
+        open_ended = self.ad('approved', None, None)
+        not_yet = self.ad('approved', 1, 5)
+        ended = self.ad('live', -5, -1)
+        paused = self.ad('paused', -5, -1)
+
+        begun = self.booking('confirmed', -1, 3)
+        finished = self.booking('active', -5, -1)
+        missed = self.booking('confirmed', -5, -2)
+        pending = self.booking('pending', -1, 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            counts = run_lifecycle(self.today)
+
+        statuses = dict(Ad.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[starting.pk], 'live')
+        self.assertEqual(statuses[open_ended.pk], 'live')
+        self.assertEqual(statuses[not_yet.pk], 'approved')
+        self.assertEqual(statuses[ended.pk], 'expired')
+        self.assertEqual(statuses[paused.pk], 'paused')
+
+        statuses = dict(Booking.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[begun.pk], 'active')
+        self.assertEqual(statuses[finished.pk], 'completed')
+        self.assertEqual(statuses[missed.pk], 'completed')
+        self.assertEqual(statuses[pending.pk], 'pending')
+        self.assertEqual(
+            (counts['ads_live'], counts['ads_expired'], counts['bookings_active'], counts['bookings_completed']),
+            (2, 1, 1, 2)
+        )
+
+    def test_rows_claimed_by_another_runner_are_skipped(self):
+        mine = self.ad('approved', 0, 5)
+        theirs = self.ad('approved', 0, 5)
+        fetch_all = QuerySet._fetch_all
+
+        def fetch_then_race(queryset):
+            fetched = queryset._result_cache is not None
+            fetch_all(queryset)
+            if not fetched and queryset.model is Ad and queryset.query.is_sliced:
+                # A concurrent runner moves one candidate before our UPDATE
+                Ad.objects.filter(pk=theirs.pk).update(status='live')
+
+        with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', False), \
+                mock.patch.object(QuerySet, '_fetch_all', fetch_then_race), transaction.atomic():
+            claimed = _claim(Ad.objects.filter(status='approved'), 10, ('status',), status='live')
+        self.assertEqual([ad.pk for ad in claimed], [mine.pk])
+
+    def test_notices_are_sent_once_and_flags_set(self):
+        upcoming = self.booking('confirmed', 1, 4)
+        begun = self.booking('confirmed', 0, 4)
+        finished = self.booking('active', -4, -1)
+        long_done = self.booking('completed', -30, -20)
+
+        run_lifecycle(self.today, batch_size=1)
+
+        types = dict(Notification.objects.values_list('related_booking_id', 'notification_type'))
+        self.assertEqual(types, {
+            upcoming.pk: 'booking_reminder',
+            begun.pk: 'booking_started',
+            finished.pk: 'booking_completed',
+        })
+        self.assertEqual(OutboxEmail.objects.count(), 3)
+        self.assertTrue(Booking.objects.get(pk=upcoming.pk).reminder_sent)
+        self.assertTrue(Booking.objects.get(pk=begun.pk).start_notification_sent)
+        self.assertTrue(Booking.objects.get(pk=finished.pk).end_notification_sent)
+        self.assertFalse(Booking.objects.get(pk=long_done.pk).end_notification_sent)
+
+        # A second run, e.g. on another node, has nothing left to do:
+        # one SELECT per step, each inside its savepoint pair
+        with self.assertNumQueries(21):
+            counts = run_lifecycle(self.today)
+        self.assertFalse(any(counts.values()))
+        self.assertEqual(Notification.objects.count(), 3)
+
+    def test_completed_booking_frees_the_placement(self):
+        self.placement.max_concurrent_ads = 1
+        self.placement.save()
+        self.booking('active', -5, -1)
+        self.assertFalse(occupancy_index.is_available(self.placement.pk, self.today - timedelta(days=2), self.today))
+
+        run_lifecycle(self.today)
+        self.assertTrue(occupancy_index.is_available(self.placement.pk, self.today - timedelta(days=2), self.today))
+
+    def test_command_reports_changes(self):
+        self.ad('approved', None, None)
+        out = StringIO()
+        call_command('run_lifecycle', stdout=out)
+        self.assertIn('ads_live: 1', out.getvalue())
+
+
+class AdServingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        serving_index.invalidate()
+        self.user = User.objects.create_user(username='adv', email='adv@example.com', password='pass')
+        self.placement = AdPlacement.objects.create(
+            placement_name='Sidebar', placement_code='sidebar', base_price_per_day=10,
+            dimensions='300x250', max_concurrent_ads=5
+        )
+        self.client = APIClient()
+
+    def book(self, title, start=-1, end=1, **ad_fields):
+        today = timezone.localdate()
+        ad = Ad.objects.create(user=self.user, title=title, status='live', **ad_fields)
+        Booking.objects.create(
+            user=self.user, ad=ad, placement=self.placement,
+            start_date=today + timedelta(days=start), end_date=today + timedelta(days=end),
+            price_per_day=10, status='active'
+        )
+        return ad
+
+    def test_serves_live_booked_ads_without_queries(self):
+        ad = self.book('Spring Sale')
+        self.book('Next Week', start=3, end=5)
+        UploadedFile.objects.create(
+            user=self.user, ad=ad, original_filename='a.png', stored_filename='a.png',
+            file_path='/media/a.png', file_type='image/png', file_size_kb=1,
+            virus_scan_status='clean', variants={'300x250@1x': '/media/variants/a.webp'}
+        )
+
+        self.client.get('/api/advertisers/serve/sidebar/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/advertisers/serve/sidebar/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['live_ads'], 1)
+        self.assertEqual(response.data['ad']['id'], ad.id)
+        self.assertEqual(response.data['ad']['image_url'], '/media/variants/a.webp')
+        self.assertIn('no-store', response['Cache-Control'])
+        self.assertEqual(self.client.get('/api/advertisers/serve/footer/').status_code, 404)
+
+    def test_rebuilt_when_ads_or_bookings_change(self):
+        self.assertIsNone(self.client.get('/api/advertisers/serve/sidebar/').data['ad'])
+
+        ad = self.book('Spring Sale')
+        self.assertEqual(self.client.get('/api/advertisers/serve/sidebar/').data['ad']['id'], ad.id)
+
+        ad.status = 'paused'
+        ad.save()
+        self.assertEqual(self.client.get('/api/advertisers/serve/sidebar/').data['live_ads'], 0)
+
+    def test_featured_and_priority_ads_ordered_first_and_weighted(self):
+        plain = self.book('Plain')
+        featured = self.book('Featured', is_featured=True)
+        urgent = self.book('Urgent', priority_order=1)
+
+        rotation = serving_index.rotation('sidebar')
+        self.assertEqual([ad['id'] for ad in rotation.ads], [featured.id, urgent.id, plain.id])
+        self.assertEqual(rotation.cumulative, (3, 5, 6))
+
+        with mock.patch('advertisers.serving.random.random', return_value=0.99):
+            self.assertEqual(rotation.pick()['id'], plain.id)
+        with mock.patch('advertisers.serving.random.random', return_value=0.0):
+            self.assertEqual(rotation.pick()['id'], featured.id)
+        self.assertIsNone(PlacementRotation([], []).pick())
+
+    def test_stale_snapshot_served_while_another_thread_rebuilds(self):
+        ad = self.book('Spring Sale')
+        self.assertEqual(len(serving_index.rotation('sidebar')), 1)
+        ad.status = 'paused'
+        ad.save()
+
+        # Another thread holds the build lock: readers neither block nor rebuild
+        serving_index._build_lock.acquire()
+        try:
+            with self.assertNumQueries(0):
+                self.assertEqual(len(serving_index.rotation('sidebar')), 1)
+        finally:
+            serving_index._build_lock.release()
+        self.assertEqual(len(serving_index.rotation('sidebar')), 0)
+
+
+FIREFOX_UA = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:131.0) Gecko/20100101 Firefox/131.0'
+
+
+class EventDeduplicationTests(TestCase):
+
+    def setUp(self):
+        event_deduplicator.reset()
+        self.client = APIClient(HTTP_USER_AGENT=FIREFOX_UA)
+
+    def test_repeats_are_caught_until_the_window_passes(self):
+        now = [0.0]
+        bloom = TimeBucketedBloomFilter(window=60, capacity=1000, error_rate=0.001, buckets=4, clock=lambda: now[0])
+
+        self.assertFalse(bloom.check_and_add('impression|1|10.0.0.1|Firefox'))
+        self.assertFalse(bloom.check_and_add('impression|2|10.0.0.1|Firefox'))
+        now[0] = 50
+        self.assertTrue(bloom.check_and_add('impression|1|10.0.0.1|Firefox'))
+        now[0] = 61
+        self.assertFalse(bloom.check_and_add('impression|2|10.0.0.1|Firefox'))
+
+        # Bounded: at most one filter per bucket is kept
+        for second in range(0, 600, 5):
+            now[0] = second
+            bloom.check_and_add(f'key {second}')
+        self.assertLessEqual(len(bloom._filters), 4)
+
+    def test_false_positive_rate_stays_near_target(self):
+        bloom = TimeBucketedBloomFilter(window=60, capacity=20000, error_rate=0.01, buckets=1, clock=lambda: 0)
+        for i in range(20000):
+            bloom.check_and_add(f'seen {i}')
+        false_positives = sum(bloom.check_and_add(f'new {i}') for i in range(5000))
+        self.assertLess(false_positives / 5000, 0.03)
+
+    def test_beacon_drops_repeated_impressions(self):
+        beacon = [
+            {'ad_id': 1, 'event_type': 'impression'},
+            {'ad_id': 1, 'event_type': 'impression'},
+            {'ad_id': 1, 'event_type': 'click'},
+        ]
+        with mock.patch('advertisers.views.analytics_buffer') as buffer:
+            first = self.client.post('/api/advertisers/analytics/track/', beacon, format='json')
+            second = self.client.post(
+                '/api/advertisers/analytics/track/', beacon[:1], format='json', REMOTE_ADDR='10.0.0.2'
+            )
+            repeat = self.client.post('/api/advertisers/analytics/track/', beacon, format='json')
+
+        self.assertEqual((first.data['accepted'], first.data['duplicates']), (2, 1))
+        self.assertEqual(second.data['accepted'], 1)
+        self.assertEqual((repeat.data['accepted'], repeat.data['duplicates']), (0, 3))
+        self.assertEqual(buffer.add.call_count, 2)
+        buffered = buffer.add.call_args_list[0].args[0]
+        self.assertEqual([event['event_type'] for event in buffered], ['impression', 'click'])
+        # Derived from the user agent on ingestion
+        self.assertEqual((buffered[0]['device_type'], buffered[0]['browser']), ('desktop', 'Firefox'))
+
+    @override_settings(ANALYTICS_DEDUP_WINDOW=0)
+    def test_can_be_disabled(self):
+        event = {'ad_id': 1, 'event_type': 'impression'}
+        self.assertEqual(len(event_deduplicator.admit([event, event])), 2)
+
+
+class UniqueReachTests(TestCase):
+
+    def setUp(self):
+        user_agents.clear()
+        self.user = User.objects.create_user(username='adv', email='adv@example.com', password='pass')
+        self.ad = Ad.objects.create(user=self.user, title='Spring Sale', status='live')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def impressions(self, day, visitors, country='UK', hour=12):
+        agent_id = user_agents.resolve([FIREFOX_UA])[FIREFOX_UA]
+        rows = Analytics.objects.bulk_create([
+            Analytics(ad=self.ad, event_type='impression', ip_address=f'10.0.{i // 250}.{i % 250}',
+                      user_agent_id=agent_id, country=country)
+            for i in visitors
+        ])
+        when = timezone.make_aware(datetime.combine(day, datetime.min.time())) + timedelta(hours=hour)
+        Analytics.objects.filter(pk__in=[row.pk for row in rows]).update(event_timestamp=when)
+
+    def test_sketch_estimates_merge_and_round_trip(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(20000):
+            first.add(f'visitor {i}')
+        for i in range(10000, 30000):
+            second.add(f'visitor {i}')
+        self.assertAlmostEqual(first.count(), 20000, delta=20000 * 0.05)
+        self.assertAlmostEqual(first.merge(second).count(), 30000, delta=30000 * 0.05)
+
+        restored = HyperLogLog.from_bytes(first.to_bytes())
+        self.assertEqual(restored.registers, first.registers)
+
+        small = HyperLogLog()
+        for i in range(10):
+            small.add(i)
+        self.assertEqual(small.count(), 10)
+        self.assertLess(len(small.to_bytes()), 64)
+        self.assertEqual(HyperLogLog.from_bytes(small.to_bytes()).registers, small.registers)
+
+    def test_statistics_merge_daily_sketches_for_a_range(self):
+        today = timezone.localdate()
+        self.impressions(today - timedelta(days=3), range(0, 300))
+        self.impressions(today - timedelta(days=2), range(200, 500), country='FR')
+        self.impressions(today, range(450, 600))
+        fold_daily_rollups()
+        self.assertEqual(AnalyticsReachSketch.objects.filter(ad=self.ad).count(), 4)
+
+        url = f'/api/advertisers/ads/{self.ad.id}/statistics/'
+        data = self.client.get(url).data
+        self.assertAlmostEqual(data['unique_visitors'], 600, delta=30)
+        self.assertEqual(len(data['unique_visitors_by_date']), 3)
+        self.assertEqual(data['reach_by_country'][0]['country'], 'UK')
+        self.assertAlmostEqual(data['reach_by_country'][0]['unique_visitors'], 450, delta=25)
+
+        data = self.client.get(url, {
+            'start_date': str(today - timedelta(days=2)), 'end_date': str(today - timedelta(days=2)),
+        }).data
+        self.assertAlmostEqual(data['unique_visitors'], 300, delta=15)
+        self.assertEqual(data['reach_by_country'][0]['country'], 'FR')
+        self.assertEqual(sum(row['count'] for row in data['impressions_by_date']), 300)
+
+        self.assertEqual(self.client.get(url, {'start_date': 'yesterday'}).status_code, 400)
+
+    def test_later_fold_merges_into_stored_sketch(self):
+        day = timezone.localdate() - timedelta(days=2)
+        self.impressions(day, range(0, 200), hour=9)
+        fold_daily_rollups(cutoff=timezone.make_aware(datetime.combine(day, datetime.min.time())) + timedelta(hours=12))
+        self.impressions(day, range(100, 400), hour=15)
+        fold_daily_rollups()
+
+        self.assertEqual(AnalyticsReachSketch.objects.filter(ad=self.ad, country='').count(), 1)
+        self.assertAlmostEqual(ad_reach(self.ad)['unique_visitors'], 400, delta=20)
+
+    def test_visitors_are_keyed_on_user_agent_text(self):
+        # Sketches folded before user agents moved to their own table hashed the
+        # text; keying on the row ID would count those visitors again
+        day = timezone.localdate() - timedelta(days=2)
+        self.impressions(day, range(0, 5))
+        fold_daily_rollups()
+
+        expected = HyperLogLog()
+        for i in range(0, 5):
+            expected.add(visitor_key(f'10.0.0.{i}', FIREFOX_UA))
+        stored = AnalyticsReachSketch.objects.get(ad=self.ad, day=day, country='')
+        self.assertEqual(HyperLogLog.from_bytes(stored.sketch).registers, expected.registers)
+
+
+class UserAgentTests(TestCase):
+
+    def setUp(self):
+        user_agents.clear()
+        self.user = User.objects.create_user(username='adv', email='adv@example.com', password='pass')
+        self.ad = Ad.objects.create(user=self.user, title='Spring Sale', status='live')
+
+    def test_classifies_devices_browsers_and_bots(self):
+        cases = {
+            FIREFOX_UA: ('desktop', 'Firefox', 'Windows', False),
+            'Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 '
+            '(KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1': ('mobile', 'Safari', 'iOS', False),
+            'Mozilla/5.0 (Linux; Android 14; SM-X710) AppleWebKit/537.36 (KHTML, like Gecko) '
+            'Chrome/129.0.0.0 Safari/537.36': ('tablet', 'Chrome', 'Android', False),
+            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+            'Chrome/129.0.0.0 Safari/537.36 Edg/129.0.0.0': ('desktop', 'Edge', 'Windows', False),
+            'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)': ('bot', 'Other', 'Other', True),
+            'curl/8.4.0': ('bot', 'Other', 'Other', True),
+            '': ('bot', 'Other', 'Other', True),
+        }
+        for user_agent, expected in cases.items():
+            agent = user_agents.parse(user_agent)
+            self.assertEqual((agent.device_type, agent.browser, agent.os, agent.is_bot), expected, user_agent)
+
+    def test_parse_is_cached_and_bounded(self):
+        cache_ = type(user_agents)(max_size=2)
+        first = cache_.parse(FIREFOX_UA)
+        self.assertIs(cache_.parse(FIREFOX_UA), first)
+        cache_.parse('curl/8.4.0')
+        cache_.parse('Wget/1.21')
+        self.assertIsNot(cache_.parse(FIREFOX_UA), first)
+
+    def test_events_reference_one_row_per_user_agent(self):
+        events = [
+            {'ad_id': self.ad.id, 'event_type': 'impression', 'ip_address': f'10.0.0.{i}', 'user_agent': FIREFOX_UA}
+            for i in range(5)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            write_events(events)
+        self.assertEqual(UserAgent.objects.count(), 1)
+        agent = UserAgent.objects.get()
+        self.assertEqual(Analytics.objects.filter(user_agent=agent).count(), 5)
+
+        # A warm cache resolves the user agent without a query:
+        # ads SELECT, INSERT and counter UPDATE inside the savepoint pair
+        with self.assertNumQueries(5):
+            write_events(events[:1])
+
+    def test_rolled_back_user_agent_rows_are_not_cached(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                user_agents.resolve([FIREFOX_UA])
+                raise RuntimeError('rolled back')
+
+        self.assertFalse(UserAgent.objects.exists())
+        self.assertIsNone(user_agents.parse(FIREFOX_UA).id)
+
+    def test_failed_write_forgets_cached_user_agent_ids(self):
+        event = {'ad_id': self.ad.id, 'event_type': 'impression', 'user_agent': FIREFOX_UA}
+        with self.captureOnCommitCallbacks(execute=True):
+            write_events([event])
+        self.assertIsNotNone(user_agents.parse(FIREFOX_UA).id)
+
+        with mock.patch.object(Analytics.objects, 'bulk_create', side_effect=IntegrityError('FOREIGN KEY')):
+            with self.assertRaises(IntegrityError):
+                write_events([event])
+        self.assertIsNone(user_agents.parse(FIREFOX_UA).id)
+
+    def test_beacons_from_bots_are_dropped(self):
+        client = APIClient(HTTP_USER_AGENT='Mozilla/5.0 (compatible; bingbot/2.0)')
+        with mock.patch('advertisers.views.analytics_buffer') as buffer:
+            response = client.post('/api/advertisers/analytics/track/', {
+                'ad_id': self.ad.id, 'event_type': 'impression', 'device_type': 'mobile',
+            }, format='json')
+        self.assertEqual((response.data['accepted'], response.data['bots']), (0, 1))
+        buffer.add.assert_not_called()
+
+
+class AnalyticsIngestionTests(TestCase):
+
+    def setUp(self):
+        user_agents.clear()
+        self.user = User.objects.create_user(username='adv', email='adv@example.com', password='pass')
+        self.ad = Ad.objects.create(user=self.user, title='Spring Sale', status='live')
+        # No background writer: the tests flush by hand
+        patcher = mock.patch.object(AnalyticsBuffer, '_ensure_writer')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def events(self, count, event_type='impression'):
+        return [{'ad_id': self.ad.id, 'event_type': event_type} for _ in range(count)]
+
+    def test_flush_writes_buffered_events_and_counters(self):
+        buffer = AnalyticsBuffer(max_events=100)
+        buffer.add(self.events(3))
+        buffer.add(self.events(1, 'click'))
+        self.assertEqual(buffer.pending(), 4)
+
+        self.assertEqual(buffer.flush(), 4)
+        self.assertEqual(buffer.pending(), 0)
+        self.assertEqual(buffer.flush(), 0)
+        self.ad.refresh_from_db()
+        self.assertEqual((self.ad.total_impressions, self.ad.total_clicks), (3, 1))
+
+    def test_failed_flush_keeps_events_for_the_next_one(self):
+        buffer = AnalyticsBuffer(max_events=100)
+        buffer.add(self.events(3))
+        with mock.patch('advertisers.ingestion.write_events', side_effect=OperationalError('gone away')):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+        self.assertEqual(buffer.pending(), 3)
+
+        buffer.add(self.events(2, 'click'))
+        self.assertEqual(buffer.flush(), 5)
+        self.assertEqual(Analytics.objects.count(), 5)
+
+    def test_batch_failing_for_other_reasons_is_dropped(self):
+        buffer = AnalyticsBuffer(max_events=100)
+        buffer.add(self.events(3))
+        with mock.patch('advertisers.ingestion.write_events', side_effect=OverflowError('too big')):
+            with self.assertRaises(OverflowError):
+                buffer.flush()
+        self.assertEqual(buffer.pending(), 0)
+
+    def test_beacon_rejects_out_of_range_ad_ids(self):
+        with mock.patch('advertisers.views.analytics_buffer') as buffer:
+            response = APIClient(HTTP_USER_AGENT=FIREFOX_UA).post(
+                '/api/advertisers/analytics/track/', {'ad_id': 2 ** 70, 'event_type': 'impression'}, format='json'
+            )
+        self.assertEqual(response.status_code, 400)
+        buffer.add.assert_not_called()
+
+    def test_retry_backlog_is_bounded(self):
+        buffer = AnalyticsBuffer(max_events=100, max_pending=4)
+        buffer.add(self.events(3, 'click') + self.events(3))
+        with mock.patch('advertisers.ingestion.write_events', side_effect=OperationalError('gone away')):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+        # The oldest events are dropped first
+        self.assertEqual(buffer.pending(), 4)
+        buffer.flush()
+        self.assertEqual(
+            list(Analytics.objects.values_list('event_type', flat=True).order_by('id')),
+            ['click', 'impression', 'impression', 'impression']
+        )
+
+    @override_settings(TRUSTED_PROXIES=['10.0.0.0/8'])
+    def test_client_ip_trusts_forwarded_for_only_from_proxies(self):
+        def client_ip(remote, forwarded=None):
+            extra = {'HTTP_X_FORWARDED_FOR': forwarded} if forwarded is not None else {}
+            return get_client_ip(APIRequestFactory().post('/', REMOTE_ADDR=remote, **extra))
+
+        self.assertEqual(client_ip('203.0.113.9'), '203.0.113.9')
+        # Spoofed header from a direct client
+        self.assertEqual(client_ip('203.0.113.9', '1.2.3.4'), '203.0.113.9')
+        # Through our proxies, the rightmost untrusted hop is the client
+        self.assertEqual(client_ip('10.0.0.1', '1.2.3.4, 198.51.100.7, 10.0.0.2'), '198.51.100.7')
+        self.assertEqual(client_ip('10.0.0.1', 'not-an-ip'), '10.0.0.1')
+        self.assertIsNone(client_ip('garbage'))
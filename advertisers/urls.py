@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import streams, views
 
 from .views import (
     # Existing ViewSets
@@ -54,5 +54,9 @@ urlpatterns = [
     path('', include(router.urls)),
     path('ads/<int:ad_id>/statistics/', views.get_ad_statistics, name='ad-statistics'),
     path('ads/statistics/all/', views.get_all_ads_statistics, name='all-ads-statistics'),
+    path('dnn/metrics/', views.get_dnn_metrics, name='dnn-metrics'),
     path('categories/', views.get_categories, name='categories-list'),
+    path('serve/<slug:placement_code>/', views.serve_ad, name='serve-ad'),
+    path('analytics/track/', views.track_events, name='analytics-track'),
+    path('events/stream/', streams.event_stream, name='event-stream'),
 ]
\ No newline at end of file
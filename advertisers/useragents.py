@@ -0,0 +1,156 @@
+"""
+User-agent parsing and bot classification for analytics ingestion
+
+Beacon traffic comes from a few thousand distinct user agents, so each is
+parsed once: results are kept in a process-wide LRU cache keyed on a hash
+of the string. Every distinct string is stored once in the ``user_agents``
+table, and Analytics rows point at it with a small foreign key instead of
+repeating the text. The row ID is cached next to the parse result, so a
+warm cache resolves an event's user agent without a query. IDs are only
+cached once the insert has committed, and are forgotten again when a write
+that used them fails, in case the row has since gone away.
+
+Classification is regex-based and deliberately coarse: device type
+(mobile, tablet, desktop or bot), browser family, OS family and whether
+the client is a crawler, monitor or script. Events from bots are dropped
+before they are buffered.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+
+MAX_USER_AGENT_LENGTH = 1000
+
+BOT_RE = re.compile(
+    r'bot\b|bot/|crawl|spider|slurp|scrape|archiver|facebookexternalhit|embedly|preview|'
+    r'headless|phantomjs|lighthouse|pingdom|uptime|monitor|curl/|wget/|python-|java/|'
+    r'go-http-client|okhttp|axios/|node-fetch|libwww|httpclient|postman',
+    re.IGNORECASE
+)
+TABLET_RE = re.compile(r'ipad|tablet|kindle|silk/|playbook|(android(?!.*mobile))', re.IGNORECASE)
+MOBILE_RE = re.compile(r'mobi|iphone|ipod|android|windows phone|blackberry|opera mini', re.IGNORECASE)
+
+# First match wins, so more specific tokens come before the engines they embed
+BROWSERS = [
+    ('Edge', re.compile(r'edg(e|a|ios)?/', re.IGNORECASE)),
+    ('Opera', re.compile(r'opr/|opera', re.IGNORECASE)),
+    ('Samsung Internet', re.compile(r'samsungbrowser/', re.IGNORECASE)),
+    ('Firefox', re.compile(r'firefox/|fxios/', re.IGNORECASE)),
+    ('Chrome', re.compile(r'chrome/|crios/|chromium/', re.IGNORECASE)),
+    ('Safari', re.compile(r'version/[\d.]+.*safari/', re.IGNORECASE)),
+    ('Internet Explorer', re.compile(r'msie |trident/', re.IGNORECASE)),
+]
+OPERATING_SYSTEMS = [
+    ('iOS', re.compile(r'iphone|ipad|ipod', re.IGNORECASE)),
+    ('Android', re.compile(r'android', re.IGNORECASE)),
+    ('Windows', re.compile(r'windows', re.IGNORECASE)),
+    ('ChromeOS', re.compile(r'cros', re.IGNORECASE)),
+    ('macOS', re.compile(r'mac os x|macintosh', re.IGNORECASE)),
+    ('Linux', re.compile(r'linux', re.IGNORECASE)),
+]
+
+
+def user_agent_hash(user_agent):
+    return hashlib.blake2b(user_agent.encode(), digest_size=16).hexdigest()
+
+
+def _first_match(patterns, user_agent):
+    return next((name for name, pattern in patterns if pattern.search(user_agent)), 'Other')
+
+
+class ParsedUserAgent:
+    """Classification of one user-agent string"""
+    __slots__ = ('hash', 'user_agent', 'device_type', 'browser', 'os', 'is_bot', 'id')
+
+    def __init__(self, user_agent):
+        self.user_agent = user_agent[:MAX_USER_AGENT_LENGTH]
+        self.hash = user_agent_hash(self.user_agent)
+        # Real browsers always identify themselves; an empty UA is a script
+        self.is_bot = not self.user_agent.strip() or bool(BOT_RE.search(self.user_agent))
+        if self.is_bot:
+            self.device_type = 'bot'
+        elif TABLET_RE.search(self.user_agent):
+            self.device_type = 'tablet'
+        elif MOBILE_RE.search(self.user_agent):
+            self.device_type = 'mobile'
+        else:
+            self.device_type = 'desktop'
+        self.browser = _first_match(BROWSERS, self.user_agent)
+        self.os = _first_match(OPERATING_SYSTEMS, self.user_agent)
+        # ID of the user_agents row, filled in when first resolved
+        self.id = None
+
+
+class UserAgentCache:
+    """LRU of ParsedUserAgent by UA hash, shared by all threads"""
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _max_size(self):
+        return self.max_size or getattr(settings, 'USER_AGENT_CACHE_SIZE', 4096)
+
+    def parse(self, user_agent):
+        user_agent = (user_agent or '')[:MAX_USER_AGENT_LENGTH]
+        key = user_agent_hash(user_agent)
+        with self._lock:
+            parsed = self._entries.get(key)
+            if parsed is not None:
+                self._entries.move_to_end(key)
+                return parsed
+
+        parsed = ParsedUserAgent(user_agent)
+        with self._lock:
+            parsed = self._entries.setdefault(key, parsed)
+            while len(self._entries) > self._max_size():
+                self._entries.popitem(last=False)
+        return parsed
+
+    def resolve(self, user_agents):
+        """
+        ``{user_agent: user_agents row ID}`` for many strings, creating rows
+        for new ones. Strings already resolved by this process cost nothing.
+        """
+        from .models import UserAgent
+
+        parsed = {user_agent: self.parse(user_agent) for user_agent in set(user_agents)}
+        missing = {agent.hash: agent for agent in parsed.values() if agent.id is None}
+        if missing:
+            UserAgent.objects.bulk_create([
+                UserAgent(
+                    ua_hash=agent.hash, user_agent=agent.user_agent, device_type=agent.device_type,
+                    browser=agent.browser, os=agent.os, is_bot=agent.is_bot
+                )
+                for agent in missing.values()
+            ], batch_size=500, ignore_conflicts=True)
+            # Re-read: rows may have been created by another process
+            resolved = dict(UserAgent.objects.filter(ua_hash__in=list(missing)).values_list('ua_hash', 'pk'))
+
+            def remember():
+                for ua_hash, pk in resolved.items():
+                    missing[ua_hash].id = pk
+            transaction.on_commit(remember)
+        else:
+            resolved = {}
+        return {user_agent: agent.id or resolved.get(agent.hash) for user_agent, agent in parsed.items()}
+
+    def forget(self, user_agents):
+        """Drop cached row IDs so the next resolve looks them up again"""
+        with self._lock:
+            for user_agent in set(user_agents):
+                parsed = self._entries.get(user_agent_hash((user_agent or '')[:MAX_USER_AGENT_LENGTH]))
+                if parsed is not None:
+                    parsed.id = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_agents = UserAgentCache()
@@ -1,30 +1,25 @@
-from rest_framework import viewsets, status, permissions
+from rest_framework import viewsets, status, permissions, filters
 from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
-from rest_framework.parsers import MultiPartParser, FormParser
-from django.db.models import Sum, Avg, Count, Q
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
+from django.db import transaction
+from django_filters.rest_framework import DjangoFilterBackend
+from django.db.models import Sum, Avg, Count, Prefetch, Q
 from django.utils import timezone
+from django.utils.cache import add_never_cache_headers
 from datetime import datetime, timedelta
+import ipaddress
 import os
 from django.conf import settings
-import uuid
 from rest_framework import serializers
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from .models import Ad  # Add this if not already there
 
-import requests
-
-try:
-    import clamd
-    _HAS_CLAMD = True
-except Exception:
-    clamd = None
-    _HAS_CLAMD = False
 from datetime import datetime
 from django.utils import timezone
-from django.core.mail import send_mail
 from django.contrib.auth import get_user_model
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
@@ -35,7 +30,7 @@ from collections import defaultdict
 from .models import (
     PricingPackage, AdPlacement, Ad, UploadedFile,
     Booking, Analytics, Message, MessageReply,
-    Notification, AuditLog,
+    Notification, AuditLog, UploadSession,
     PlatformBenefit, FAQ, Testimonial, CaseStudy,
     PricingFeature, EnhancedPricingPackage, PackageFeature,
     PromotionalBanner, PlatformStatistic
@@ -47,29 +42,54 @@ from .serializers import (
     AnalyticsSerializer, MessageSerializer, MessageListSerializer,
     MessageReplySerializer, NotificationSerializer, AuditLogSerializer,
     AdStatisticsSerializer, BookingStatisticsSerializer,
+    AnalyticsEventSerializer, BatchAvailabilitySerializer, UploadSessionSerializer,
+    BulkModerationSerializer,
     
     PlatformBenefitSerializer, FAQSerializer, FAQListSerializer,
     TestimonialSerializer, CaseStudyListSerializer, CaseStudyDetailSerializer,
     PricingFeatureSerializer, EnhancedPricingPackageSerializer,
     PromotionalBannerSerializer, PlatformStatisticSerializer
 )
+from .ingestion import analytics_buffer
+from .dedup import event_deduplicator
+from .useragents import user_agents
+from .rollups import ad_statistics
+from .dnn import dnn_client
+from .stats_cache import get_user_stats
+from .marketing_cache import get_marketing_overview
+from .conditional import ConditionalGetMixin, apply_cache_policy, etag_matches, make_etag
+from .query_plans import QueryPlan, QueryPlanMixin
+from .pagination import KeysetPagination
+from .search import FullTextSearchFilter
+from .occupancy import occupancy_index
+from .serving import serving_index
+from .scanning import scan_pool
+from .outbox import queue_email
+from .notifications import adjust_unread, reset_unread, unread_count
+from .moderation import (
+    DEFAULT_REJECTION_REASON, ad_status_email, ad_status_notification, moderate_ads
+)
+from .storage import shared_fields, store_upload
+from .resumable import ChunkTooLarge, OffsetMismatch, SessionFile, discard, write_chunk
 
 User = get_user_model()
 
 
-class PricingPackageViewSet(viewsets.ReadOnlyModelViewSet):
+class PricingPackageViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """
     List and retrieve pricing packages
     """
+    etag_models = [PricingPackage]
     queryset = PricingPackage.objects.filter(is_active=True)
     serializer_class = PricingPackageSerializer
     permission_classes = [permissions.AllowAny]
 
 
-class AdPlacementViewSet(viewsets.ReadOnlyModelViewSet):
+class AdPlacementViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """
     List and retrieve ad placements
     """
+    etag_models = [AdPlacement]
     queryset = AdPlacement.objects.filter(is_active=True)
     serializer_class = AdPlacementSerializer
     permission_classes = [permissions.AllowAny]
@@ -94,30 +114,92 @@ class AdPlacementViewSet(viewsets.ReadOnlyModelViewSet):
                 'error': 'Invalid date format. Use YYYY-MM-DD'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Check for conflicts
-        conflicts = Booking.objects.filter(
-            placement=placement,
-            status__in=['confirmed', 'active'],
-            start_date__lte=end_date,
-            end_date__gte=start_date
-        )
+        # Check capacity against the in-memory occupancy index
+        tree = occupancy_index.tree(placement.id)
+        conflict_ids = tree.overlapping(start_date, end_date)
         
-        is_available = not conflicts.exists()
+        conflicts = []
+        if conflict_ids:
+            conflicts = Booking.objects.filter(id__in=conflict_ids).select_related(
+                'ad', 'placement', 'user'
+            )
         
         return Response({
-            'is_available': is_available,
+            'is_available': tree.has_capacity(start_date, end_date),
             'conflicting_bookings': BookingCalendarSerializer(conflicts, many=True).data
         })
+    
+    @action(detail=False, methods=['post'])
+    def batch_availability(self, request):
+        """
+        Check many placements against many date ranges in one request,
+        optionally listing the first free windows of a given length
+        """
+        serializer = BatchAvailabilitySerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        data = serializer.validated_data
+        placement_ids = list(
+            self.get_queryset().filter(
+                id__in=data['placement_ids']
+            ).values_list('id', flat=True)
+        )
+        trees = occupancy_index.trees(placement_ids)
+        free_windows = data.get('free_windows')
+        
+        results = []
+        for placement_id in placement_ids:
+            tree = trees[placement_id]
+            result = {
+                'placement_id': placement_id,
+                'ranges': [
+                    {
+                        'start_date': date_range['start_date'],
+                        'end_date': date_range['end_date'],
+                        'is_available': tree.has_capacity(date_range['start_date'], date_range['end_date']),
+                    }
+                    for date_range in data.get('ranges', [])
+                ],
+            }
+            if free_windows:
+                length = timedelta(days=free_windows['length_days'] - 1)
+                result['free_windows'] = [
+                    {
+                        'start_date': gap_start,
+                        'end_date': gap_start + length,
+                        'available_until': gap_end,
+                    }
+                    for gap_start, gap_end in tree.free_windows(
+                        free_windows['start_date'],
+                        free_windows['end_date'],
+                        free_windows['length_days'],
+                        free_windows['limit'],
+                    )
+                ]
+            results.append(result)
+        
+        return Response({'placements': results})
 
 
-class AdViewSet(viewsets.ModelViewSet):
+class AdViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     """
     CRUD operations for ads
     """
     queryset = Ad.objects.all()
+    pagination_class = KeysetPagination
+    query_plans = {
+        'list': QueryPlan(select_related=['user'], prefetch_related=['files']),
+        'default': QueryPlan(
+            select_related=['user__profile'],
+            prefetch_related=[
+                Prefetch('files', queryset=UploadedFile.objects.select_related('user__profile'))
+            ]
+        ),
+    }
     permission_classes = [permissions.IsAuthenticated]
     filterset_fields = ['status', 'is_featured']
-    search_fields = ['title', 'short_description']
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, filters.OrderingFilter]
     ordering_fields = ['created_at', 'start_date', 'total_clicks', 'total_impressions']
     
     def get_serializer_class(self):
@@ -126,11 +208,13 @@ class AdViewSet(viewsets.ModelViewSet):
         return AdSerializer
     
     def get_queryset(self):
+        queryset = super().get_queryset()
         # Regular users see only their own ads
         if not self.request.user.is_staff:
-            return Ad.objects.filter(user=self.request.user)
-        return super().get_queryset()
+            return queryset.filter(user=self.request.user)
+        return queryset
     
+    @transaction.atomic
     def perform_create(self, serializer):
         ad = serializer.save(user=self.request.user)
         
@@ -139,7 +223,7 @@ class AdViewSet(viewsets.ModelViewSet):
             self.notify_admins_new_ad(ad)
     
     def notify_admins_new_ad(self, ad):
-        """Send email notification to admins about new ad"""
+        """Queue an email notification to admins about new ad"""
         try:
             # Get all admin users
             admin_emails = User.objects.filter(
@@ -168,18 +252,13 @@ http://127.0.0.1:8000/admin/advertisers/ad/{ad.id}/change/
 AdPortal Admin System
                 """
                 
-                send_mail(
-                    subject,
-                    message,
-                    settings.DEFAULT_FROM_EMAIL,
-                    admin_emails,
-                    fail_silently=True,
-                )
-                print(f"✉️ Notification sent to {len(admin_emails)} admins")
+                queue_email(subject, message, list(admin_emails))
+                print(f"✉️ Notification queued for {len(admin_emails)} admins")
         except Exception as e:
             print(f"⚠️ Failed to send admin notification: {e}")
     
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    @transaction.atomic
     def approve(self, request, pk=None):
         """Approve an ad (admin only)"""
         ad = self.get_object()
@@ -192,21 +271,16 @@ AdPortal Admin System
         self.notify_user_ad_status(ad, 'approved')
         
         # Create notification
-        Notification.objects.create(
-            user=ad.user,
-            title='Ad Approved',
-            message=f'Your ad "{ad.title}" has been approved and is now live!',
-            notification_type='ad_approved',
-            related_ad=ad
-        )
+        ad_status_notification(ad, 'approved').save()
         
         return Response({'message': 'Ad approved successfully'})
     
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    @transaction.atomic
     def reject(self, request, pk=None):
         """Reject an ad (admin only)"""
         ad = self.get_object()
-        reason = request.data.get('reason', 'No reason provided')
+        reason = request.data.get('reason', DEFAULT_REJECTION_REASON)
         
         ad.status = 'rejected'
         ad.rejection_reason = reason
@@ -218,189 +292,171 @@ AdPortal Admin System
         self.notify_user_ad_status(ad, 'rejected', reason)
         
         # Create notification
-        Notification.objects.create(
-            user=ad.user,
-            title='Ad Rejected',
-            message=f'Your ad "{ad.title}" has been rejected. Reason: {reason}',
-            notification_type='ad_rejected',
-            related_ad=ad
-        )
+        ad_status_notification(ad, 'rejected', reason).save()
         
         return Response({'message': 'Ad rejected'})
     
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def moderate(self, request):
+        """Approve or reject many ads awaiting review at once (admin only)"""
+        serializer = BulkModerationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ad_ids = serializer.validated_data['ad_ids']
+        
+        updated = moderate_ads(
+            ad_ids,
+            serializer.validated_data['decision'],
+            request.user,
+            serializer.validated_data.get('reason')
+        )
+        return Response({
+            'updated': len(updated),
+            'ad_ids': updated,
+            # Unknown, or no longer pending review
+            'skipped': sorted(set(ad_ids) - set(updated)),
+        })
+    
     def notify_user_ad_status(self, ad, status, reason=None):
-        """Send email to user about ad status change"""
+        """Queue an email to the user about ad status change"""
         try:
-            if status == 'approved':
-                subject = f'[AdPortal] Your Ad "{ad.title}" Has Been Approved!'
-                message = f"""
-Hello {ad.user.first_name or ad.user.username},
-
-Great news! Your advertisement has been approved and is now live:
-
-Title: {ad.title}
-Status: Approved ✅
-Approved on: {timezone.now().strftime('%Y-%m-%d %H:%M')}
-
-You can now book advertising slots for this ad in the calendar.
-
-View your ad: http://localhost:5173/ads/{ad.id}
-
-Thank you for using AdPortal!
-
----
-AdPortal Team
-                """
-            else:  # rejected
-                subject = f'[AdPortal] Update Required for "{ad.title}"'
-                message = f"""
-Hello {ad.user.first_name or ad.user.username},
-
-Your advertisement requires some updates before it can be approved:
-
-Title: {ad.title}
-Status: Needs Revision ⚠️
-
-Reason:
-{reason}
-
-What to do next:
-1. Log in to your account
-2. Go to "My Ads"
-3. Edit your ad and address the feedback
-4. Resubmit for review
-
-Edit your ad: http://localhost:5173/ads/{ad.id}/edit
-
-If you have questions, please contact our support team.
-
----
-AdPortal Team
-                """
-            
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [ad.user.email],
-                fail_silently=True,
-            )
-            print(f"✉️ Status notification sent to {ad.user.email}")
+            subject, message = ad_status_email(ad, status, reason)
+            queue_email(subject, message, [ad.user.email])
+            print(f"✉️ Status notification queued for {ad.user.email}")
         except Exception as e:
             print(f"⚠️ Failed to send user notification: {e}")
     
     @action(detail=True, methods=['get'])
     def statistics(self, request, pk=None):
-        """Get statistics for an ad"""
+        """
+        Get statistics for an ad, optionally limited to
+        ?start_date=YYYY-MM-DD&end_date=YYYY-MM-DD
+        """
         ad = self.get_object()
         
-        # Analytics by date
-        analytics = Analytics.objects.filter(ad=ad)
-        
-        impressions_by_date = analytics.filter(event_type='impression').values(
-            'event_timestamp__date'
-        ).annotate(count=Count('id')).order_by('event_timestamp__date')
-        
-        clicks_by_date = analytics.filter(event_type='click').values(
-            'event_timestamp__date'
-        ).annotate(count=Count('id')).order_by('event_timestamp__date')
-        
-        # Device breakdown
-        device_breakdown = analytics.values('device_type').annotate(
-            count=Count('id')
-        ).order_by('-count')
+        try:
+            start_date, end_date = (
+                datetime.strptime(value, '%Y-%m-%d').date() if value else None
+                for value in (request.query_params.get('start_date'), request.query_params.get('end_date'))
+            )
+        except ValueError:
+            return Response({
+                'error': 'Invalid date format. Use YYYY-MM-DD'
+            }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Country breakdown
-        country_breakdown = analytics.values('country').annotate(
-            count=Count('id')
-        ).order_by('-count')[:10]
+        # Served from daily rollups and reach sketches plus today's raw events
+        stats = ad_statistics(ad, start_date, end_date)
         
         return Response({
             'total_impressions': ad.total_impressions,
             'total_clicks': ad.total_clicks,
             'click_through_rate': ad.click_through_rate,
-            'impressions_by_date': list(impressions_by_date),
-            'clicks_by_date': list(clicks_by_date),
-            'device_breakdown': list(device_breakdown),
-            'country_breakdown': list(country_breakdown)
+            'impressions_by_date': stats['impressions_by_date'],
+            'clicks_by_date': stats['clicks_by_date'],
+            'device_breakdown': stats['device_breakdown'],
+            'country_breakdown': stats['country_breakdown'],
+            'unique_visitors': stats['unique_visitors'],
+            'unique_visitors_by_date': stats['unique_visitors_by_date'],
+            'reach_by_country': stats['reach_by_country'],
         })
     
     @action(detail=False, methods=['get'])
     def my_statistics(self, request):
         """Get overall statistics for user's ads"""
-        user_ads = Ad.objects.filter(user=request.user)
-        
-        total_ads = user_ads.count()
-        active_ads = user_ads.filter(status='live').count()
-        pending_ads = user_ads.filter(status='pending_review').count()
-        
-        total_impressions = user_ads.aggregate(Sum('total_impressions'))['total_impressions__sum'] or 0
-        total_clicks = user_ads.aggregate(Sum('total_clicks'))['total_clicks__sum'] or 0
-        
-        average_ctr = (total_clicks / total_impressions * 100) if total_impressions > 0 else 0
+        def compute():
+            # One conditional-aggregation query instead of five round trips
+            totals = Ad.objects.filter(user=request.user).aggregate(
+                total_ads=Count('id'),
+                active_ads=Count('id', filter=Q(status='live')),
+                pending_ads=Count('id', filter=Q(status='pending_review')),
+                total_impressions=Sum('total_impressions'),
+                total_clicks=Sum('total_clicks'),
+            )
+            total_impressions = totals['total_impressions'] or 0
+            total_clicks = totals['total_clicks'] or 0
+            average_ctr = (total_clicks / total_impressions * 100) if total_impressions > 0 else 0
+            
+            return AdStatisticsSerializer({
+                'total_ads': totals['total_ads'],
+                'active_ads': totals['active_ads'],
+                'pending_ads': totals['pending_ads'],
+                'total_impressions': total_impressions,
+                'total_clicks': total_clicks,
+                'average_ctr': round(average_ctr, 2)
+            }).data
         
-        return Response(AdStatisticsSerializer({
-            'total_ads': total_ads,
-            'active_ads': active_ads,
-            'pending_ads': pending_ads,
-            'total_impressions': total_impressions,
-            'total_clicks': total_clicks,
-            'average_ctr': round(average_ctr, 2)
-        }).data)
+        return Response(get_user_stats(request.user.id, 'ads', compute))
 
 
-class UploadedFileViewSet(viewsets.ModelViewSet):
+class UploadedFileViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     """
     File upload and management
     """
     queryset = UploadedFile.objects.all()
+    query_plans = {
+        'default': QueryPlan(select_related=['user__profile']),
+    }
     serializer_class = UploadedFileSerializer
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
     
     def get_queryset(self):
+        queryset = super().get_queryset()
         # Users see only their own files
         if not self.request.user.is_staff:
-            return UploadedFile.objects.filter(user=self.request.user)
-        return super().get_queryset()
+            return queryset.filter(user=self.request.user)
+        return queryset
+    
+    def create(self, request, *args, **kwargs):
+        """Store the upload and accept it for background virus scanning"""
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
     
-    def scan_file_for_virus(self, file_path):
+    def save_upload(self, serializer, file):
         """
-        Scan a file for viruses using ClamAV
-        Returns: ('clean'|'infected'|'failed', threat_name_or_error)
+        Store an uploaded file and create its record. Shared by the
+        multipart upload and resumable upload finalize.
         """
-        # If pyclamd / clamd isn't installed, return failed so uploads still work
-        if not _HAS_CLAMD or clamd is None:
-            print("⚠️ WARNING: clamd (pyclamd) not installed. Skipping virus scan.")
-            return ('failed', 'clamd not installed')
-
-        try:
-            # Connect to ClamAV daemon (Unix socket by default)
-            cd = clamd.ClamdUnixSocket()  # Use ClamdNetworkSocket() for TCP if available
-
-            # Scan the file
-            scan_result = cd.scan(file_path)
-
-            if scan_result is None:
-                return ('clean', None)
-
-            # Check if file is infected
-            if file_path in scan_result:
-                status, threat = scan_result[file_path]
-                if status == 'FOUND':
-                    return ('infected', threat)
-                else:
-                    return ('clean', None)
-
-            return ('clean', None)
-
-        except clamd.ConnectionError:
-            # ClamAV daemon not running
-            print("⚠️ WARNING: ClamAV daemon not running. File not scanned.")
-            return ('failed', 'ClamAV daemon not available')
-        except Exception as e:
-            print(f"⚠️ WARNING: Virus scan failed: {str(e)}")
-            return ('failed', str(e))
+        # Get file size (before storing, which may move the file)
+        file_size_kb = file.size // 1024
+        print(f"  File size: {file_size_kb} KB")
+        
+        # Store by content hash; known content is not written again
+        blob, created = store_upload(file)
+        print(f"  Content hash: {blob.sha256} ({'new' if created else 'already stored'})")
+        
+        if blob.virus_scan_status == 'infected':
+            raise serializers.ValidationError({
+                'file': 'File is infected with malware. Upload rejected.'
+            })
+        
+        # Calculate relative file path for URL
+        relative_path = f'/media/uploads/{blob.stored_filename}'
+        
+        # Reuse the blob's scan and image results; anything not known clean is rescanned
+        shared = shared_fields(blob)
+        if blob.virus_scan_status != 'clean':
+            shared['virus_scan_status'] = 'pending'
+        
+        print(f"  Saving to database...")
+        # Save to database
+        serializer.save(
+            user=self.request.user,
+            original_filename=file.name,
+            blob=blob,
+            stored_filename=blob.stored_filename,
+            file_path=relative_path,
+            file_type=file.content_type,
+            file_size_kb=file_size_kb,
+            **shared
+        )
+        
+        # Scanned by the background worker pool; infected files are quarantined,
+        # images that pass get a thumbnail and placement-size variants
+        if blob.virus_scan_status != 'clean':
+            scan_pool.submit(serializer.instance.id)
+            print(f"  Queued for virus scan")
+        return serializer.instance
     
     def perform_create(self, serializer):
         import traceback
@@ -423,69 +479,7 @@ class UploadedFileViewSet(viewsets.ModelViewSet):
             print(f"  Size: {file.size} bytes")
             print(f"  Type: {file.content_type}")
             
-            # Generate unique filename
-            ext = os.path.splitext(file.name)[1]
-            stored_filename = f"{uuid.uuid4()}{ext}"
-            print(f"  Generated filename: {stored_filename}")
-            
-            # Save file
-            upload_dir = os.path.join(settings.MEDIA_ROOT, 'uploads')
-            os.makedirs(upload_dir, exist_ok=True)
-            file_path = os.path.join(upload_dir, stored_filename)
-            print(f"  Saving to: {file_path}")
-            
-            with open(file_path, 'wb+') as destination:
-                for chunk in file.chunks():
-                    destination.write(chunk)
-            
-            print(f"✓ File saved successfully")
-            
-            # Get file size
-            file_size_kb = file.size // 1024
-            print(f"  File size: {file_size_kb} KB")
-            
-            # Scan for viruses
-            print(f"  Scanning for viruses...")
-            scan_status, threat_info = self.scan_file_for_virus(file_path)
-            print(f"  Scan result: {scan_status}")
-            
-            # If infected, delete the file immediately
-            if scan_status == 'infected':
-                os.remove(file_path)
-                print(f"❌ File infected: {threat_info}")
-                raise serializers.ValidationError({
-                    'file': f'File is infected with malware: {threat_info}. Upload rejected.'
-                })
-            
-            # Get image dimensions if it's an image
-            width = None
-            height = None
-            if file.content_type.startswith('image/'):
-                try:
-                    from PIL import Image
-                    with Image.open(file_path) as img:
-                        width, height = img.size
-                    print(f"  Image dimensions: {width}x{height}")
-                except Exception as e:
-                    print(f"⚠️ Could not get image dimensions: {e}")
-            
-            # Calculate relative file path for URL
-            relative_path = f'/media/uploads/{stored_filename}'
-            
-            print(f"  Saving to database...")
-            # Save to database
-            serializer.save(
-                user=self.request.user,
-                original_filename=file.name,
-                stored_filename=stored_filename,
-                file_path=relative_path,
-                file_type=file.content_type,
-                file_size_kb=file_size_kb,
-                width=width,
-                height=height,
-                virus_scan_status=scan_status,
-                virus_scan_date=timezone.now()
-            )
+            self.save_upload(serializer, file)
             
             print(f"✅ FILE UPLOAD SUCCESS")
             print("=" * 50)
@@ -504,11 +498,116 @@ class UploadedFileViewSet(viewsets.ModelViewSet):
             raise
 
 
-class BookingViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'])
+    def scan_status(self, request, pk=None):
+        """Poll the virus scan result for an upload"""
+        uploaded_file = self.get_object()
+        return Response({
+            'id': uploaded_file.id,
+            'virus_scan_status': uploaded_file.virus_scan_status,
+            'virus_scan_date': uploaded_file.virus_scan_date,
+        })
+    
+    # Resumable uploads: POST uploads/ -> PUT chunks -> POST uploads/<id>/finalize/
+    
+    @action(detail=False, methods=['post'], url_path='uploads', parser_classes=[JSONParser])
+    def start_upload(self, request):
+        """Open a resumable upload session"""
+        serializer = UploadSessionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        session = serializer.save(user=request.user)
+        return Response({
+            **UploadSessionSerializer(session).data,
+            'chunk_size': settings.RESUMABLE_UPLOAD_CHUNK_SIZE,
+        }, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['get', 'put', 'delete'],
+            url_path=r'uploads/(?P<upload_id>[0-9a-f-]+)', parser_classes=[])
+    def upload_chunk(self, request, upload_id=None):
+        """
+        GET returns the offset to resume from. PUT writes the raw request
+        body at the offset given in the Upload-Offset header. DELETE aborts.
+        """
+        session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+        
+        if request.method == 'DELETE':
+            discard(session)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        
+        if request.method == 'PUT':
+            try:
+                offset = int(request.META.get('HTTP_UPLOAD_OFFSET', ''))
+                length = int(request.META.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                return Response(
+                    {'error': 'Upload-Offset and Content-Length headers are required'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                write_chunk(session, request.stream, offset, length)
+            except OffsetMismatch as e:
+                return Response(
+                    {'error': 'Offset mismatch', 'offset': e.expected},
+                    status=status.HTTP_409_CONFLICT
+                )
+            except ChunkTooLarge as e:
+                return Response({'error': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        
+        return Response(UploadSessionSerializer(session).data)
+    
+    @action(detail=False, methods=['post'],
+            url_path=r'uploads/(?P<upload_id>[0-9a-f-]+)/finalize', parser_classes=[JSONParser])
+    def finalize_upload(self, request, upload_id=None):
+        """Turn a complete session into an UploadedFile and queue it for scanning"""
+        session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+        if session.received_bytes != session.total_size:
+            return Response(
+                {'error': 'Upload is incomplete', 'offset': session.received_bytes},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        serializer = self.get_serializer(data={
+            'original_filename': session.original_filename,
+            'ad': session.ad_id,
+            'alt_text': request.data.get('alt_text'),
+            'is_primary': request.data.get('is_primary', False),
+        })
+        serializer.is_valid(raise_exception=True)
+        
+        # Only one request may turn the session into a file
+        claimed = UploadSession.objects.filter(pk=session.pk, status='uploading').update(
+            status='finalizing', updated_at=timezone.now()
+        )
+        if not claimed:
+            return Response(
+                {'error': 'Upload is already being finalized'},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        file = SessionFile(session)
+        try:
+            self.save_upload(serializer, file)
+        except Exception:
+            # Let the client retry
+            UploadSession.objects.filter(pk=session.pk).update(status='uploading')
+            raise
+        finally:
+            file.close()
+        discard(session)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+
+class BookingViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     """
     Booking management (Calendar functionality)
     """
     queryset = Booking.objects.all()
+    query_plans = {
+        'default': QueryPlan(
+            select_related=['user__profile', 'ad__user', 'placement'],
+            prefetch_related=['ad__files']
+        ),
+    }
     serializer_class = BookingSerializer
     permission_classes = [permissions.IsAuthenticated]
     filterset_fields = ['status', 'placement']
@@ -516,9 +615,10 @@ class BookingViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         # Users see only their own bookings
+        queryset = super().get_queryset()
         if not self.request.user.is_staff:
-            return Booking.objects.filter(user=self.request.user)
-        return super().get_queryset()
+            return queryset.filter(user=self.request.user)
+        return queryset
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -530,7 +630,9 @@ class BookingViewSet(viewsets.ModelViewSet):
         start_date = request.query_params.get('start_date')
         end_date = request.query_params.get('end_date')
         
-        queryset = Booking.objects.filter(status__in=['confirmed', 'active'])
+        queryset = Booking.objects.filter(
+            status__in=['confirmed', 'active']
+        ).select_related('ad', 'placement', 'user')
         
         if placement_id:
             queryset = queryset.filter(placement_id=placement_id)
@@ -568,29 +670,38 @@ class BookingViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def my_statistics(self, request):
         """Get booking statistics for user"""
-        user_bookings = Booking.objects.filter(user=request.user)
-        
-        total_bookings = user_bookings.count()
-        active_bookings = user_bookings.filter(status='active').count()
-        completed_bookings = user_bookings.filter(status='completed').count()
-        
-        total_revenue = user_bookings.filter(
-            status__in=['completed', 'active']
-        ).aggregate(Sum('final_price'))['final_price__sum'] or 0
+        def compute():
+            totals = Booking.objects.filter(user=request.user).aggregate(
+                total_bookings=Count('id'),
+                active_bookings=Count('id', filter=Q(status='active')),
+                completed_bookings=Count('id', filter=Q(status='completed')),
+                total_revenue=Sum('final_price', filter=Q(status__in=['completed', 'active'])),
+            )
+            
+            return BookingStatisticsSerializer({
+                'total_bookings': totals['total_bookings'],
+                'active_bookings': totals['active_bookings'],
+                'completed_bookings': totals['completed_bookings'],
+                'total_revenue': totals['total_revenue'] or 0
+            }).data
         
-        return Response(BookingStatisticsSerializer({
-            'total_bookings': total_bookings,
-            'active_bookings': active_bookings,
-            'completed_bookings': completed_bookings,
-            'total_revenue': total_revenue
-        }).data)
+        return Response(get_user_stats(request.user.id, 'bookings', compute))
 
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     """
     Support message management
     """
     queryset = Message.objects.all()
+    query_plans = {
+        'list': QueryPlan(select_related=['user'], annotate={'reply_count': Count('replies')}),
+        'default': QueryPlan(
+            select_related=['user__profile', 'assigned_to'],
+            prefetch_related=[
+                Prefetch('replies', queryset=MessageReply.objects.select_related('user__profile'))
+            ]
+        ),
+    }
     permission_classes = [permissions.IsAuthenticated]
     filterset_fields = ['status', 'priority']
     ordering_fields = ['-created_at']
@@ -601,10 +712,11 @@ class MessageViewSet(viewsets.ModelViewSet):
         return MessageSerializer
     
     def get_queryset(self):
+        queryset = super().get_queryset()
         # Users see only their own messages
         if not self.request.user.is_staff:
-            return Message.objects.filter(user=self.request.user)
-        return super().get_queryset()
+            return queryset.filter(user=self.request.user)
+        return queryset
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -636,6 +748,7 @@ class NotificationViewSet(viewsets.ModelViewSet):
     """
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
+    pagination_class = KeysetPagination
     permission_classes = [permissions.IsAuthenticated]
     filterset_fields = ['is_read', 'notification_type']
     ordering_fields = ['-created_at']
@@ -647,9 +760,12 @@ class NotificationViewSet(viewsets.ModelViewSet):
     def mark_read(self, request, pk=None):
         """Mark notification as read"""
         notification = self.get_object()
-        notification.is_read = True
-        notification.read_at = timezone.now()
-        notification.save()
+        updated = Notification.objects.filter(pk=notification.pk, is_read=False).update(
+            is_read=True,
+            read_at=timezone.now()
+        )
+        # Only the request that actually flipped it adjusts the counter
+        adjust_unread({request.user.id: -updated})
         return Response({'message': 'Marked as read'})
     
     @action(detail=False, methods=['post'])
@@ -659,23 +775,35 @@ class NotificationViewSet(viewsets.ModelViewSet):
             is_read=True,
             read_at=timezone.now()
         )
+        reset_unread(request.user.id)
         return Response({'message': 'All notifications marked as read'})
     
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        """
+        Unread count for the bell badge. Later changes are pushed as
+        ``unread_count`` events on the event stream.
+        """
+        return Response({'unread_count': unread_count(request.user.id)})
+    
     # ============================================================================
 # MARKETING VIEWSETS (ADD THESE AT THE BOTTOM)
 # ============================================================================
 
-class PlatformBenefitViewSet(viewsets.ReadOnlyModelViewSet):
+class PlatformBenefitViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    etag_models = [PlatformBenefit]
     queryset = PlatformBenefit.objects.filter(is_active=True)
     serializer_class = PlatformBenefitSerializer
     permission_classes = [permissions.AllowAny]
 
 
-class FAQViewSet(viewsets.ReadOnlyModelViewSet):
+class FAQViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    etag_models = [FAQ]
+    conditional_actions = ('list', 'retrieve', 'by_category')
     queryset = FAQ.objects.filter(is_active=True)
     permission_classes = [permissions.AllowAny]
     filterset_fields = ['category']
-    search_fields = ['question', 'answer']
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, filters.OrderingFilter]
     
     def get_serializer_class(self):
         if self.action == 'list':
@@ -710,7 +838,9 @@ class FAQViewSet(viewsets.ReadOnlyModelViewSet):
         return Response({'message': 'Feedback recorded'})
 
 
-class TestimonialViewSet(viewsets.ReadOnlyModelViewSet):
+class TestimonialViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    etag_models = [Testimonial]
+    conditional_actions = ('list', 'retrieve', 'featured')
     queryset = Testimonial.objects.filter(is_active=True)
     serializer_class = TestimonialSerializer
     permission_classes = [permissions.AllowAny]
@@ -722,12 +852,14 @@ class TestimonialViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
 
 
-class CaseStudyViewSet(viewsets.ReadOnlyModelViewSet):
+class CaseStudyViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    etag_models = [CaseStudy]
+    conditional_actions = ('list', 'retrieve', 'featured')
     queryset = CaseStudy.objects.filter(is_published=True)
     permission_classes = [permissions.AllowAny]
     lookup_field = 'slug'
     filterset_fields = ['industry', 'is_featured']
-    search_fields = ['title', 'company_name', 'summary']
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, filters.OrderingFilter]
     
     def get_serializer_class(self):
         if self.action == 'retrieve':
@@ -741,14 +873,22 @@ class CaseStudyViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
 
 
-class PricingFeatureViewSet(viewsets.ReadOnlyModelViewSet):
+class PricingFeatureViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    etag_models = [PricingFeature]
     queryset = PricingFeature.objects.all()
     serializer_class = PricingFeatureSerializer
     permission_classes = [permissions.AllowAny]
 
 
-class EnhancedPricingPackageViewSet(viewsets.ReadOnlyModelViewSet):
+class EnhancedPricingPackageViewSet(ConditionalGetMixin, QueryPlanMixin, viewsets.ReadOnlyModelViewSet):
+    etag_models = [EnhancedPricingPackage, PackageFeature, PricingFeature]
+    conditional_actions = ('list', 'retrieve', 'comparison', 'popular')
     queryset = EnhancedPricingPackage.objects.filter(is_active=True)
+    query_plans = {
+        'default': QueryPlan(prefetch_related=[
+            Prefetch('packagefeature_set', queryset=PackageFeature.objects.select_related('feature'))
+        ]),
+    }
     serializer_class = EnhancedPricingPackageSerializer
     permission_classes = [permissions.AllowAny]
     lookup_field = 'slug'
@@ -771,10 +911,15 @@ class EnhancedPricingPackageViewSet(viewsets.ReadOnlyModelViewSet):
         return Response({'message': 'No packages available'}, status=404)
 
 
-class PromotionalBannerViewSet(viewsets.ReadOnlyModelViewSet):
+class PromotionalBannerViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    etag_models = [PromotionalBanner]
     serializer_class = PromotionalBannerSerializer
     permission_classes = [permissions.AllowAny]
     
+    def get_etag_parts(self):
+        # Banners enter and leave their window without any write
+        return list(self.get_queryset().values_list('pk', flat=True))
+    
     def get_queryset(self):
         now = timezone.now()
         return PromotionalBanner.objects.filter(
@@ -786,7 +931,8 @@ class PromotionalBannerViewSet(viewsets.ReadOnlyModelViewSet):
         )
 
 
-class PlatformStatisticViewSet(viewsets.ReadOnlyModelViewSet):
+class PlatformStatisticViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    etag_models = [PlatformStatistic]
     queryset = PlatformStatistic.objects.filter(is_active=True)
     serializer_class = PlatformStatisticSerializer
     permission_classes = [permissions.AllowAny]
@@ -796,13 +942,21 @@ class MarketingOverviewViewSet(viewsets.ViewSet):
     permission_classes = [permissions.AllowAny]
     
     def list(self, request):
+        return Response(get_marketing_overview(self.build_overview))
+    
+    @staticmethod
+    def build_overview(now):
         benefits = PlatformBenefit.objects.filter(is_active=True)
         statistics = PlatformStatistic.objects.filter(is_active=True)
         testimonials = Testimonial.objects.filter(is_active=True, is_featured=True)[:3]
         case_studies = CaseStudy.objects.filter(is_published=True, is_featured=True)[:3]
-        pricing = EnhancedPricingPackage.objects.filter(is_active=True)
+        pricing = EnhancedPricingPackage.objects.filter(is_active=True).prefetch_related(
+            Prefetch(
+                'packagefeature_set',
+                queryset=PackageFeature.objects.select_related('feature')
+            )
+        )
         
-        now = timezone.now()
         banners = PromotionalBanner.objects.filter(
             is_active=True
         ).filter(
@@ -811,14 +965,14 @@ class MarketingOverviewViewSet(viewsets.ViewSet):
             Q(end_date__isnull=True) | Q(end_date__gte=now)
         )
         
-        return Response({
+        return {
             'benefits': PlatformBenefitSerializer(benefits, many=True).data,
             'statistics': PlatformStatisticSerializer(statistics, many=True).data,
             'featured_testimonials': TestimonialSerializer(testimonials, many=True).data,
             'featured_case_studies': CaseStudyListSerializer(case_studies, many=True).data,
             'active_banners': PromotionalBannerSerializer(banners, many=True).data,
             'pricing_packages': EnhancedPricingPackageSerializer(pricing, many=True).data,
-        })
+        }
 
 
 # ==============================================================================
@@ -849,29 +1003,11 @@ def get_ad_statistics(request, ad_id):
     week_ago = today - timedelta(days=7)
     thirty_days_ago = today - timedelta(days=30)
     
-    # Call DNN API to get click data
-    dnn_api_url = getattr(settings, 'DNN_API_URL', 'http://webflyers.uk/api')
+    # Cached, circuit-broken call to the DNN API
+    dnn_data = dnn_client.get_click_statistics(ad_id)
     
-    try:
-        response = requests.get(
-            f"{dnn_api_url}/clicks/statistics",
-            params={'flyer_id': ad_id},
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            dnn_data = response.json()
-        else:
-            # Fallback to local data if DNN API fails
-            dnn_data = {
-                'total_clicks': ad.total_clicks,
-                'clicks_today': 0,
-                'clicks_this_week': 0,
-                'daily_data': [],
-                'device_breakdown': {'mobile': 0, 'desktop': 0}
-            }
-    except Exception as e:
-        # Fallback if DNN not reachable
+    if dnn_data is None:
+        # Fallback to local data if DNN API is failing or unreachable
         dnn_data = {
             'total_clicks': ad.total_clicks,
             'clicks_today': 0,
@@ -895,30 +1031,45 @@ def get_ad_statistics(request, ad_id):
     })
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def get_dnn_metrics(request):
+    """
+    Cache hit rate and circuit breaker state for the DNN statistics client
+    """
+    return Response(dnn_client.metrics())
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_all_ads_statistics(request):
     """
     Get statistics summary for all user's ads
     """
-    user_ads = Ad.objects.filter(user=request.user, status='live')
-    
-    ads_stats = []
-    for ad in user_ads:
-        ads_stats.append({
-            'id': ad.id,
-            'title': ad.title,
-            'category': ad.get_category_display(),
-            'total_clicks': ad.total_clicks,
-            'status': ad.status,
-            'start_date': ad.start_date,
-        })
+    def compute():
+        # Evaluate the ads once; totals are derived from the same rows
+        categories = dict(Ad.MERCHANDISE_CATEGORY_CHOICES)
+        ads_stats = [
+            {
+                'id': ad['id'],
+                'title': ad['title'],
+                'category': categories.get(ad['category'], ad['category']),
+                'total_clicks': ad['total_clicks'],
+                'status': ad['status'],
+                'start_date': ad['start_date'],
+            }
+            for ad in Ad.objects.filter(user=request.user, status='live').values(
+                'id', 'title', 'category', 'total_clicks', 'status', 'start_date'
+            )
+        ]
+        
+        return {
+            'ads': ads_stats,
+            'total_ads': len(ads_stats),
+            'total_clicks': sum(ad['total_clicks'] for ad in ads_stats),
+        }
     
-    return Response({
-        'ads': ads_stats,
-        'total_ads': user_ads.count(),
-        'total_clicks': sum(ad.total_clicks for ad in user_ads),
-    })
+    return Response(get_user_stats(request.user.id, 'live_ads', compute))
 
 
 @api_view(['GET'])
@@ -931,5 +1082,119 @@ def get_categories(request):
         {'value': key, 'label': label}
         for key, label in Ad.MERCHANDISE_CATEGORY_CHOICES
     ]
-    return Response({'categories': categories})
+    # The choices only change with a deploy
+    etag = make_etag(categories, request.accepted_media_type)
+    if etag_matches(request, etag):
+        return apply_cache_policy(Response(status=status.HTTP_304_NOT_MODIFIED), etag, public=False)
+    return apply_cache_policy(Response({'categories': categories}), etag, public=False)
+
+
+# ==============================================================================
+# AD SERVING
+# ==============================================================================
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([permissions.AllowAny])
+def serve_ad(request, placement_code):
+    """
+    The ad to render in a placement right now, picked by weighted rotation.
+    Answered from the in-memory serving index without touching the database.
+    """
+    rotation = serving_index.rotation(placement_code)
+    if rotation is None:
+        return Response({'error': 'Unknown placement'}, status=status.HTTP_404_NOT_FOUND)
+    response = Response({
+        'placement': placement_code,
+        'ad': rotation.pick(),
+        'live_ads': len(rotation),
+    })
+    # Every request is a new pick, so no shared or browser caching
+    add_never_cache_headers(response)
+    return response
+
+
+# ==============================================================================
+# TRACKING BEACON
+# ==============================================================================
+
+MAX_EVENTS_PER_BEACON = 100
+
+
+def _parse_ip(value):
+    try:
+        return ipaddress.ip_address((value or '').strip())
+    except ValueError:
+        return None
+
+
+def get_client_ip(request):
+    """
+    Client IP. X-Forwarded-For is only believed when the connection comes
+    from one of TRUSTED_PROXIES, and then read right to left past our own
+    proxies, since clients can put anything in the leftmost entries.
+    """
+    remote = _parse_ip(request.META.get('REMOTE_ADDR'))
+    if remote is None:
+        return None
+    proxies = [ipaddress.ip_network(proxy, strict=False) for proxy in settings.TRUSTED_PROXIES]
+    client = remote
+    hops = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')
+    while any(client in network for network in proxies) and hops:
+        hop = _parse_ip(hops.pop())
+        if hop is None:
+            break
+        client = hop
+    return str(client)
+
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([permissions.AllowAny])
+def track_events(request):
+    """
+    Record one impression/click event or an array of them.
+    Events from bots and repeats from the same visitor within the dedup
+    window are dropped; the rest are buffered in-process and written in
+    bulk, so this endpoint never touches the database.
+    """
+    payload = request.data
+    many = isinstance(payload, list)
+    if many and len(payload) > MAX_EVENTS_PER_BEACON:
+        return Response(
+            {'error': f'At most {MAX_EVENTS_PER_BEACON} events per request'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    serializer = AnalyticsEventSerializer(data=payload, many=many)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    events = serializer.validated_data if many else [serializer.validated_data]
+    ip_address = get_client_ip(request)
+    # Parsed once per distinct user agent, then served from the LRU cache
+    agent = user_agents.parse(request.META.get('HTTP_USER_AGENT', ''))
+    if agent.is_bot:
+        return Response({
+            'accepted': 0, 'duplicates': 0, 'bots': len(events),
+        }, status=status.HTTP_202_ACCEPTED)
+    
+    admitted = event_deduplicator.admit([
+        {
+            **event,
+            'ip_address': ip_address,
+            'user_agent': agent.user_agent,
+            'device_type': agent.device_type,
+            'browser': agent.browser,
+        }
+        for event in events
+    ])
+    if admitted:
+        analytics_buffer.add(admitted)
+    
+    return Response({
+        'accepted': len(admitted),
+        'duplicates': len(events) - len(admitted),
+        'bots': 0,
+    }, status=status.HTTP_202_ACCEPTED)
 # END OF FILE 
\ No newline at end of file
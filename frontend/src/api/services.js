@@ -1,3 +1,4 @@
+import Cookies from 'js-cookie';
 import axiosInstance from './axios';
 
 // Auth Services
@@ -78,6 +79,9 @@ export const placementsAPI = {
     axiosInstance.get(`/advertisers/ad-placements/${id}/availability/`, {
       params: { start_date: startDate, end_date: endDate },
     }),
+  
+  batchAvailability: (data) =>
+    axiosInstance.post('/advertisers/ad-placements/batch_availability/', data),
 };
 
 // Pricing Services
@@ -100,6 +104,27 @@ export const filesAPI = {
   
   delete: (id) =>
     axiosInstance.delete(`/advertisers/files/${id}/`),
+  
+  getScanStatus: (id) =>
+    axiosInstance.get(`/advertisers/files/${id}/scan_status/`),
+
+  // Resumable uploads for large files
+  startUpload: (data) =>
+    axiosInstance.post('/advertisers/files/uploads/', data),
+
+  getUploadOffset: (uploadId) =>
+    axiosInstance.get(`/advertisers/files/uploads/${uploadId}/`),
+
+  uploadChunk: (uploadId, offset, chunk) =>
+    axiosInstance.put(`/advertisers/files/uploads/${uploadId}/`, chunk, {
+      headers: {
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': offset,
+      },
+    }),
+
+  finalizeUpload: (uploadId, data) =>
+    axiosInstance.post(`/advertisers/files/uploads/${uploadId}/finalize/`, data),
 };
 
 
@@ -125,4 +150,23 @@ export const notificationsAPI = {
   
   markAllAsRead: () =>
     axiosInstance.post('/advertisers/notifications/mark_all_read/'),
+
+  // Current count; later changes arrive as `unread_count` stream events
+  getUnreadCount: () =>
+    axiosInstance.get('/advertisers/notifications/unread_count/'),
+
+  // Live `notification`, `ad_status` and `unread_count` events. EventSource
+  // cannot send headers, so the access token goes in the query string.
+  // Returns the EventSource; call close() on it when done.
+  openEventStream: (onEvent) => {
+    const baseURL = axiosInstance.defaults.baseURL.replace(/\/$/, '');
+    const token = Cookies.get('access_token');
+    const source = new EventSource(
+      `${baseURL}/advertisers/events/stream/?token=${encodeURIComponent(token || '')}`
+    );
+    ['notification', 'ad_status', 'unread_count'].forEach((type) =>
+      source.addEventListener(type, (event) => onEvent(type, JSON.parse(event.data)))
+    );
+    return source;
+  },
 };
\ No newline at end of file
@@ -1,8 +1,39 @@
-import React, { useState, useCallback } from 'react';
+import React, { useState, useCallback, useEffect } from 'react';
 import { useDropzone } from 'react-dropzone';
 import { Upload, X, CheckCircle, AlertCircle, Loader } from 'lucide-react';
 import { filesAPI } from '../api/services';
 
+// Files above the server's in-memory upload limit are sent in resumable chunks
+const RESUMABLE_THRESHOLD = 3 * 1024 * 1024;
+const MAX_CHUNK_RETRIES = 5;
+
+const uploadInChunks = async (file) => {
+  const { data: session } = await filesAPI.startUpload({
+    original_filename: file.name,
+    file_type: file.type || 'application/octet-stream',
+    total_size: file.size,
+  });
+
+  let offset = 0;
+  let retries = 0;
+  while (offset < file.size) {
+    try {
+      const chunk = file.slice(offset, offset + session.chunk_size);
+      const { data } = await filesAPI.uploadChunk(session.id, offset, chunk);
+      offset = data.received_bytes;
+      retries = 0;
+    } catch (error) {
+      if (++retries > MAX_CHUNK_RETRIES) throw error;
+      // Resume from whatever the server actually stored
+      await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+      const { data } = await filesAPI.getUploadOffset(session.id);
+      offset = data.received_bytes;
+    }
+  }
+
+  return filesAPI.finalizeUpload(session.id, {});
+};
+
 const FileUpload = ({ onFilesUploaded }) => {
   const [files, setFiles] = useState([]);
   const [errors, setErrors] = useState([]);
@@ -14,7 +45,9 @@ const FileUpload = ({ onFilesUploaded }) => {
     formData.append('original_filename', file.name);
 
     try {
-      const response = await filesAPI.upload(formData);
+      const response = file.size > RESUMABLE_THRESHOLD
+        ? await uploadInChunks(file)
+        : await filesAPI.upload(formData);
       return {
         id: response.data.id,
         file,
@@ -60,13 +93,37 @@ const FileUpload = ({ onFilesUploaded }) => {
     setUploading(false);
   }, [files, onFilesUploaded]);
 
+  // Virus scans run in the background; poll until every upload has a result
+  useEffect(() => {
+    const pending = files.filter(
+      f => f.status === 'uploaded' && f.backendData?.virus_scan_status === 'pending'
+    );
+    if (pending.length === 0) return;
+
+    const timer = setTimeout(async () => {
+      const results = await Promise.all(
+        pending.map(f => filesAPI.getScanStatus(f.id).then(r => r.data).catch(() => null))
+      );
+      setFiles(prev => prev.map(f => {
+        const result = results.find(r => r && r.id === f.id);
+        if (!result) return f;
+        if (result.virus_scan_status === 'infected') {
+          return { ...f, status: 'error', error: 'File contains malware and was removed' };
+        }
+        return { ...f, backendData: { ...f.backendData, ...result } };
+      }));
+    }, 2000);
+
+    return () => clearTimeout(timer);
+  }, [files]);
+
   const { getRootProps, getInputProps, isDragActive } = useDropzone({
     onDrop,
     accept: {
       'image/*': ['.png', '.jpg', '.jpeg', '.svg'],
       'application/pdf': ['.pdf']
     },
-    maxSize: 10 * 1024 * 1024, // 10MB
+    maxSize: 100 * 1024 * 1024, // 100MB, large files upload in chunks
     multiple: true,
     disabled: uploading
   });
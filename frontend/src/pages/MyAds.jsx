@@ -193,9 +193,9 @@ const MyAds = () => {
                 <div key={ad.id} className="card-hover">
                   {/* Ad Image - Show first uploaded image or placeholder */}
                   <div className="h-48 bg-gradient-to-br from-cyan-100 to-cyan-200 rounded-lg mb-4 flex items-center justify-center relative overflow-hidden">
-                    {ad.files && ad.files.length > 0 && ad.files[0].file_path ? (
+                    {ad.thumbnail_path || (ad.files && ad.files.length > 0 && ad.files[0].file_path) ? (
                       <img 
-                        src={`http://127.0.0.1:8000${ad.files[0].file_path}`}
+                        src={`http://127.0.0.1:8000${ad.thumbnail_path || ad.files[0].file_path}`}
                         alt={ad.title}
                         className="w-full h-full object-cover"
                         onError={(e) => {
@@ -204,7 +204,7 @@ const MyAds = () => {
                         }}
                       />
                     ) : null}
-                    <div className={`w-full h-full flex items-center justify-center ${ad.files && ad.files.length > 0 ? 'hidden' : ''}`}>
+                    <div className={`w-full h-full flex items-center justify-center ${ad.thumbnail_path || (ad.files && ad.files.length > 0) ? 'hidden' : ''}`}>
                       <BarChart3 size={48} className="text-cyan-400" />
                     </div>
                     {/* File count badge */}
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0013_keyset_pagination_indexes'),
+        ('payments', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['created_at', 'id'], name='payments_created_d7f01e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='payments_user_id_b0b72b_idx'),
+        ),
+    ]
@@ -60,6 +60,9 @@ class Payment(models.Model):
         indexes = [
             models.Index(fields=['payment_status']),
             models.Index(fields=['transaction_id']),
+            # Keyset pagination: staff over all payments, users over their own
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['user', 'created_at', 'id']),
         ]
     
     def __str__(self):
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from advertisers.stats_cache import invalidate_user_stats
+from .models import Payment
+
+
+@receiver([post_save, post_delete], sender=Payment)
+def invalidate_dashboard_statistics(sender, instance, **kwargs):
+    """Drop cached dashboard statistics for the owner of a changed payment"""
+    invalidate_user_stats(instance.user_id)
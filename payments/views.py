@@ -1,17 +1,32 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import Sum
+from django.db.models import Count, Q, Sum
+from django.db import transaction
 from .models import Payment
 from .serializers import PaymentSerializer, PaymentListSerializer, PaymentCreateSerializer
+from advertisers.allocator import PlacementFullError, confirm_booking
 from advertisers.models import Booking
+from advertisers.pagination import KeysetPagination
+from advertisers.query_plans import QueryPlan, QueryPlanMixin
+from advertisers.stats_cache import get_user_stats
 
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     """
     Payment management
     """
     queryset = Payment.objects.all()
+    pagination_class = KeysetPagination
+    query_plans = {
+        'list': QueryPlan(select_related=['user']),
+        'default': QueryPlan(
+            select_related=[
+                'user__profile', 'booking__user__profile', 'booking__ad__user', 'booking__placement'
+            ],
+            prefetch_related=['booking__ad__files']
+        ),
+    }
     permission_classes = [permissions.IsAuthenticated]
     filterset_fields = ['payment_status', 'payment_method']
     ordering_fields = ['-created_at']
@@ -24,10 +39,11 @@ class PaymentViewSet(viewsets.ModelViewSet):
         return PaymentSerializer
     
     def get_queryset(self):
+        queryset = super().get_queryset()
         # Users see only their own payments
         if not self.request.user.is_staff:
-            return Payment.objects.filter(user=self.request.user)
-        return super().get_queryset()
+            return queryset.filter(user=self.request.user)
+        return queryset
     
     def create(self, request, *args, **kwargs):
         """Create a new payment"""
@@ -47,14 +63,23 @@ class PaymentViewSet(viewsets.ModelViewSet):
                         'error': 'Booking not found'
                     }, status=status.HTTP_404_NOT_FOUND)
             
-            # Create payment
-            payment = Payment.objects.create(
-                user=request.user,
-                booking=booking,
-                amount=serializer.validated_data['amount'],
-                payment_method=serializer.validated_data['payment_method'],
-                description=serializer.validated_data.get('description', '')
-            )
+            # The booking is confirmed under the placement lock and the payment
+            # recorded in one transaction, so neither exists without the other
+            try:
+                with transaction.atomic():
+                    if booking is not None:
+                        confirm_booking(booking)
+                    payment = Payment.objects.create(
+                        user=request.user,
+                        booking=booking,
+                        amount=serializer.validated_data['amount'],
+                        payment_method=serializer.validated_data['payment_method'],
+                        description=serializer.validated_data.get('description', '')
+                    )
+            except PlacementFullError as e:
+                return Response({
+                    'error': str(e)
+                }, status=status.HTTP_409_CONFLICT)
             
             # TODO: Integrate with payment gateway (Stripe, PayPal, M-Pesa)
             # process_payment(payment)
@@ -64,11 +89,6 @@ class PaymentViewSet(viewsets.ModelViewSet):
             payment.transaction_id = f"TXN-{payment.id}-TEST"
             payment.save()
             
-            # Update booking status if payment is for a booking
-            if booking:
-                booking.status = 'confirmed'
-                booking.save()
-            
             return Response(
                 PaymentSerializer(payment).data,
                 status=status.HTTP_201_CREATED
@@ -79,22 +99,22 @@ class PaymentViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def my_statistics(self, request):
         """Get payment statistics for user"""
-        user_payments = Payment.objects.filter(user=request.user)
-        
-        total_payments = user_payments.count()
-        completed_payments = user_payments.filter(payment_status='completed').count()
-        pending_payments = user_payments.filter(payment_status='pending').count()
-        
-        total_spent = user_payments.filter(
-            payment_status='completed'
-        ).aggregate(Sum('amount'))['amount__sum'] or 0
+        def compute():
+            totals = Payment.objects.filter(user=request.user).aggregate(
+                total_payments=Count('id'),
+                completed_payments=Count('id', filter=Q(payment_status='completed')),
+                pending_payments=Count('id', filter=Q(payment_status='pending')),
+                total_spent=Sum('amount', filter=Q(payment_status='completed')),
+            )
+            
+            return {
+                'total_payments': totals['total_payments'],
+                'completed_payments': totals['completed_payments'],
+                'pending_payments': totals['pending_payments'],
+                'total_spent': float(totals['total_spent'] or 0)
+            }
         
-        return Response({
-            'total_payments': total_payments,
-            'completed_payments': completed_payments,
-            'pending_payments': pending_payments,
-            'total_spent': float(total_spent)
-        })
+        return Response(get_user_stats(request.user.id, 'payments', compute))
     
     @action(detail=True, methods=['get'])
     def invoice(self, request, pk=None):